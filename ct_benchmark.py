@@ -0,0 +1,270 @@
+# Reproducible performance benchmarks on synthetic volumes, headless. For example, to compare two commits:
+#   python viewer.py benchmark --output before.json
+#   python viewer.py benchmark --output after.json --compare before.json --threshold 0.2
+import os
+import sys
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from ct_core import (composite_overlay, default_cache_dir, default_label_color, display_slice, intensity_histogram, label_contours,
+                     load_nii, overlay_lut, window_ct_slice)
+
+# Synthetic volume sizes (x, y, z); the default run uses the first three
+benchmark_sizes = {
+    'small': (128, 128, 128),
+    'medium': (256, 256, 256),
+    'large': (512, 512, 512),
+    'xlarge': (512, 512, 1000),
+}
+
+# Voxel size of the synthetic volumes in mm, and the number of labelled organs
+benchmark_spacing = (0.8, 0.8, 1.25)
+benchmark_labels = 5
+
+# Stages timed for every size, in order, followed by a display_<name> stage per display of the viewer (--displays)
+benchmark_stages = ['load', 'window', 'slice_axial', 'slice_coronal', 'slice_sagittal', 'composite', 'contour', 'render', 'histogram']
+benchmark_displays = ['matplotlib', 'raster']
+
+# Function to generate a synthetic CT (air around an elliptic body with noise) and a label volume with
+# ellipsoid organs. The same seed always gives the same volumes. Built a few axial slices at a time.
+def synthetic_volumes(shape, seed=0, chunk_slices=64):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0.3, 0.7, (benchmark_labels, 3)) * shape
+    radii = rng.uniform(0.06, 0.15, (benchmark_labels, 3)) * shape
+    intensities = rng.integers(20, 300, benchmark_labels)
+    x = np.linspace(-1, 1, shape[0])[:, None]
+    y = np.linspace(-1, 1, shape[1])[None, :]
+    body = (x / 0.9) ** 2 + (y / 0.7) ** 2 <= 1
+
+    ct_scan = np.empty(shape, dtype=np.int16)
+    labels = np.zeros(shape, dtype=np.uint8)
+    grid = np.ogrid[:shape[0], :shape[1]]
+    for start in range(0, shape[2], chunk_slices):
+        z = np.arange(start, min(start + chunk_slices, shape[2]))[None, None, :]
+        ct_chunk = np.where(body[..., None], 40, -1000) + rng.normal(0, 20, (shape[0], shape[1], z.shape[2]))
+        label_chunk = labels[:, :, z[0, 0, 0]:z[0, 0, -1] + 1]
+        for label, (center, radius, intensity) in enumerate(zip(centers, radii, intensities), 1):
+            inside = (((grid[0][..., None] - center[0]) / radius[0]) ** 2 + ((grid[1][..., None] - center[1]) / radius[1]) ** 2
+                      + ((z - center[2]) / radius[2]) ** 2) <= 1
+            label_chunk[inside] = label
+            ct_chunk[inside] += intensity
+        ct_scan[:, :, z[0, 0, 0]:z[0, 0, -1] + 1] = np.clip(ct_chunk, -1024, 3071)
+    return ct_scan, labels
+
+# Function to get the CT and label files of a benchmark size, generating them on first use
+def benchmark_volume_paths(name, data_dir, seed=0):
+    import nibabel as nib
+    paths = [os.path.join(data_dir, f'{name}-{seed}-{kind}.nii.gz') for kind in ('ct', 'labels')]
+    if all(os.path.exists(path) for path in paths):
+        return paths
+    os.makedirs(data_dir, exist_ok=True)
+    print(f"Generating the {name} volumes {benchmark_sizes[name]} in {data_dir}...")
+    # Voxel axes to the patient's left, posterior and superior, so that loading does not reorient them
+    affine = np.diag([-benchmark_spacing[0], -benchmark_spacing[1], benchmark_spacing[2], 1.0])
+    for path, volume in zip(paths, synthetic_volumes(benchmark_sizes[name], seed)):
+        tmp_path = f'{path[:-len(".nii.gz")]}.tmp{os.getpid()}.nii.gz'
+        nib.save(nib.Nifti1Image(volume, affine), tmp_path)
+        os.replace(tmp_path, path)
+    return paths
+
+# Function to summarize the latencies of a stage in milliseconds
+def latency_summary(times):
+    milliseconds = np.array(times) * 1000
+    return {
+        'runs': len(milliseconds),
+        'mean_ms': float(milliseconds.mean()),
+        'p50_ms': float(np.percentile(milliseconds, 50)),
+        'p90_ms': float(np.percentile(milliseconds, 90)),
+        'p99_ms': float(np.percentile(milliseconds, 99)),
+        'max_ms': float(milliseconds.max()),
+    }
+
+# Function to time function(run) for every run
+def time_runs(function, runs):
+    times = []
+    for run in range(runs):
+        start = time.perf_counter()
+        function(run)
+        times.append(time.perf_counter() - start)
+    return latency_summary(times)
+
+# Function to time frames of the viewer's slice panels with each display: compositing, drawing and painting into
+# the window, as when scrolling through slices that were not shown before. Uses the offscreen Qt platform
+# unless QT_QPA_PLATFORM is set (e.g. to xcb, to measure on a real screen).
+def time_displays(ct_scan, labels, slice_indices, window, label_colors, displays, size):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtWidgets import QApplication
+        from ct_gui import MplCanvas, RasterSliceCanvas
+    except ImportError as e:
+        print(f"Skipping the display stages: {e}")
+        return {}
+    app = QApplication.instance() or QApplication(['benchmark'])
+    stages = {}
+    for display in displays:
+        canvas = RasterSliceCanvas() if display == 'raster' else MplCanvas()
+        canvas.show_hud = False
+        canvas.resize(*size)
+        canvas.show()
+
+        def frame(run):
+            canvas.plot_slices(int(slice_indices[run]), *window, ct_scan, labels, labels, True, 'axial', False, dict(label_colors))
+            app.processEvents()
+
+        # The first frame lays out the panels
+        frame(0)
+        canvas.frame_cache.clear()
+        stages[f'display_{display}'] = time_runs(frame, len(slice_indices))
+        canvas.close()
+    return stages
+
+# Function to run all stages on one size. Runs in a fresh process, so that the peak RSS is that of this size alone.
+def benchmark_size(name, paths, runs, seed=0, displays=(), display_size=(1920, 640)):
+    from ct_render import AggSliceCanvas
+    stages = {}
+    slow_runs = max(runs // 10, 3)
+    ct_path, labels_path = paths
+
+    stages['load'] = time_runs(lambda run: load_nii(ct_path), slow_runs)
+    ct_scan, labels = load_nii(ct_path), load_nii(labels_path)
+
+    # The same spread of slices in a shuffled order for every stage, so that no stage benefits from the CPU cache
+    rng = np.random.default_rng(seed)
+    indices = {view: rng.permutation(np.linspace(0, ct_scan.shape[axis] - 1, runs).astype(int))
+               for view, axis in (('sagittal', 0), ('coronal', 1), ('axial', 2))}
+    window = (-160, 240)
+    label_colors = tuple((label, default_label_color(label)) for label in range(1, benchmark_labels + 1))
+    lut = overlay_lut(label_colors, 0.5)
+    buffers = {}
+
+    stages['window'] = time_runs(lambda run: window_ct_slice(display_slice(ct_scan, 'axial', indices['axial'][run]), *window), runs)
+    for view in ('axial', 'coronal', 'sagittal'):
+        stages[f'slice_{view}'] = time_runs(lambda run: np.ascontiguousarray(display_slice(ct_scan, view, indices[view][run])), runs)
+    gray_slices = [window_ct_slice(display_slice(ct_scan, 'axial', index), *window) for index in indices['axial']]
+    stages['composite'] = time_runs(lambda run: composite_overlay(gray_slices[run], display_slice(labels, 'axial', indices['axial'][run]), lut, buffers), runs)
+
+    def contours(run):
+        label_slice = display_slice(labels, 'axial', indices['axial'][run])
+        for label, _ in label_colors:
+            label_contours(label_slice, label)
+
+    stages['contour'] = time_runs(contours, runs)
+
+    # A full frame of the three panels, drawn offscreen; every run is a slice that was not drawn before
+    canvas = AggSliceCanvas()
+
+    def render(run):
+        canvas.plot_slices(int(indices['axial'][run]), *window, ct_scan, labels, labels, True, 'axial', False, dict(label_colors))
+        canvas.render_frame()
+
+    stages['render'] = time_runs(render, runs)
+    stages['histogram'] = time_runs(lambda run: intensity_histogram(ct_scan), slow_runs)
+    # ru_maxrss is in KB on Linux; taken before the display stages, which add the memory of Qt
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if displays:
+        stages.update(time_displays(ct_scan, labels, indices['axial'], window, label_colors, displays, display_size))
+
+    return {
+        'shape': list(ct_scan.shape),
+        'stages': stages,
+        'peak_rss_mb': peak_rss_mb,
+    }
+
+# Function to describe the machine and the code the results come from
+def benchmark_environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+# Function to compare results with a baseline. A stage regresses when its median latency grew by more than
+# threshold (a fraction) and by more than min_change_ms; the peak RSS when it grew by more than threshold.
+def compare_results(results, baseline, threshold, min_change_ms=1.0):
+    regressions = []
+    for name, size in results['sizes'].items():
+        baseline_size = baseline.get('sizes', {}).get(name)
+        if baseline_size is None:
+            continue
+        print(f"\n{name} {tuple(size['shape'])} vs. {baseline.get('environment', {}).get('commit') or 'baseline'}:")
+        for stage, summary in size['stages'].items():
+            if stage not in baseline_size['stages']:
+                continue
+            before, after = baseline_size['stages'][stage]['p50_ms'], summary['p50_ms']
+            change = after / before - 1 if before > 0 else 0.0
+            regressed = change > threshold and after - before > min_change_ms
+            print(f"  {stage:<20} {before:10.2f} -> {after:10.2f} ms  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(f'{name} {stage}: p50 {before:.2f} -> {after:.2f} ms ({change:+.1%})')
+        before, after = baseline_size['peak_rss_mb'], size['peak_rss_mb']
+        change = after / before - 1 if before > 0 else 0.0
+        print(f"  {'peak RSS':<20} {before:10.1f} -> {after:10.1f} MB  {change:+7.1%}{'  REGRESSION' if change > threshold else ''}")
+        if change > threshold:
+            regressions.append(f'{name} peak RSS: {before:.1f} -> {after:.1f} MB ({change:+.1%})')
+    return regressions
+
+# Function to run the benchmarks, e.g. python viewer.py benchmark --sizes small medium --output results.json
+def benchmark_command(args):
+    parser = argparse.ArgumentParser(prog='viewer.py benchmark', description='Time loading, windowing, slicing, compositing, contours, '
+                                     'rendering and histograms on synthetic volumes.')
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium', 'large'], choices=list(benchmark_sizes),
+                        help='volume sizes: ' + ', '.join(f'{name} {"x".join(map(str, shape))}' for name, shape in benchmark_sizes.items())
+                        + ' (default: small medium large)')
+    parser.add_argument('--runs', type=int, default=30, help='timed runs per stage; load and histogram run a tenth as often (default: 30)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic volumes and slice order (default: 0)')
+    parser.add_argument('--data-dir', default=None, help='where the synthetic volumes are kept (default: benchmark/ in the cache folder)')
+    parser.add_argument('--displays', nargs='*', default=benchmark_displays, choices=benchmark_displays,
+                        help='displays of the viewer to time frames (and frames per second) of; none to skip (default: all)')
+    parser.add_argument('--display-size', nargs=2, type=int, default=[1920, 640], metavar=('WIDTH', 'HEIGHT'),
+                        help='size of the slice panels in pixels for the display stages (default: 1920 640)')
+    parser.add_argument('--output', default='benchmark.json', help='JSON results file (default: benchmark.json)')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against --compare before failing, as a fraction (default: 0.2)')
+    parser.add_argument('--min-change-ms', type=float, default=1.0, help='ignore slowdowns smaller than this, as noise (default: 1.0)')
+    options = parser.parse_args(args)
+
+    data_dir = options.data_dir or os.path.join(default_cache_dir(), 'benchmark')
+    results = {'environment': benchmark_environment(), 'runs': options.runs, 'seed': options.seed, 'sizes': {}}
+    for name in options.sizes:
+        paths = benchmark_volume_paths(name, data_dir, options.seed)
+        # A fresh process per size: spawned, not forked, so it does not inherit the memory of the earlier sizes
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            size = executor.submit(benchmark_size, name, paths, options.runs, options.seed, options.displays, options.display_size).result()
+        results['sizes'][name] = size
+        print(f"\n{name} {tuple(size['shape'])}, peak RSS {size['peak_rss_mb']:.0f} MB:")
+        print(f"  {'stage':<20} {'p50':>9} {'p90':>9} {'p99':>9}  (ms)")
+        for stage in benchmark_stages + [stage for stage in size['stages'] if stage.startswith('display_')]:
+            summary = size['stages'][stage]
+            frame_rate = f"  {1000 / summary['mean_ms']:.1f} FPS" if stage.startswith('display_') else ''
+            print(f"  {stage:<20} {summary['p50_ms']:9.2f} {summary['p90_ms']:9.2f} {summary['p99_ms']:9.2f}{frame_rate}")
+
+    with open(options.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults written to {options.output}")
+
+    if options.compare:
+        with open(options.compare) as file:
+            baseline = json.load(file)
+        regressions = compare_results(results, baseline, options.threshold, options.min_change_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {options.threshold:.0%}:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            return 1
+        print(f"\nNo regressions above {options.threshold:.0%}")
+    return 0
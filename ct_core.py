@@ -0,0 +1,1614 @@
+# GUI-free core of the 3D CT Scan Viewer: loading of NIfTI volumes and subjects, slicing in the
+# display orientations, intensity windowing, label overlay compositing, contours and statistics.
+# Only numpy is imported up front; nibabel, contourpy and matplotlib are imported on first use.
+import os
+import re
+import csv
+import json
+import argparse
+import bisect
+import fnmatch
+import gzip
+import hashlib
+import mmap
+import shutil
+import time
+import threading
+import tracemalloc
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, partial
+import numpy as np
+
+# Optional faster gzip decompressors
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
+
+color_map = {
+    'red': [1, 0, 0],
+    'green': [0, 1, 0],
+    'blue': [0, 0, 1],
+    'yellow': [1, 1, 0],
+    'cyan': [0, 1, 1],
+    'magenta': [1, 0, 1],
+}
+
+# Hot-path instrumentation. Stage timers are off by default, and then cost a single attribute check.
+# When enabled, the recent durations of each stage are kept (e.g. for the viewer HUD), and while a trace
+# is recorded every timed span is also kept as a Chrome trace event (open in chrome://tracing or Perfetto).
+class Profiler:
+
+    def __init__(self, history=30):
+        self.enabled = False
+        self.history = history
+        self.durations = {}
+        self.trace_events = None
+        self.trace_start = 0.0
+        self.thread_names = {}
+        self.lock = threading.Lock()
+
+    # Function to time a block: with profiler.timer('composite'): ...
+    def timer(self, stage):
+        return StageTimer(self, stage) if self.enabled else null_timer
+
+    # Function to add a duration measured elsewhere; start is its perf_counter() start time when known
+    def record(self, stage, seconds, start=None):
+        if not self.enabled:
+            return
+        with self.lock:
+            if stage not in self.durations:
+                self.durations[stage] = deque(maxlen=self.history)
+            self.durations[stage].append(seconds)
+            if self.trace_events is not None:
+                start = time.perf_counter() - seconds if start is None else start
+                thread = threading.current_thread()
+                self.thread_names[thread.ident] = thread.name
+                self.trace_events.append({'name': stage, 'cat': 'viewer', 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+                                          'ts': (start - self.trace_start) * 1e6, 'dur': seconds * 1e6})
+
+    # Function to get the mean of the recent durations of a stage in ms (None when it was not timed)
+    def mean_ms(self, stage):
+        with self.lock:
+            durations = self.durations.get(stage)
+            return sum(durations) / len(durations) * 1000 if durations else None
+
+    def clear(self):
+        with self.lock:
+            self.durations = {}
+
+    def start_trace(self):
+        with self.lock:
+            self.trace_events = []
+            self.thread_names = {}
+            self.trace_start = time.perf_counter()
+
+    # Function to stop recording and write the trace in the Chrome trace event format; returns the number of events
+    def stop_trace(self, path):
+        with self.lock:
+            events, self.trace_events = self.trace_events or [], None
+            names = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}}
+                     for ident, name in self.thread_names.items()]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': names + events, 'displayTimeUnit': 'ms'}, file)
+        return len(events)
+
+# Timer of one stage while the profiler is enabled
+class StageTimer:
+    __slots__ = ('profiler', 'stage', 'start')
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.stage, time.perf_counter() - self.start, self.start)
+
+null_timer = nullcontext()
+
+# Shared by the loading, rendering and GUI code
+profiler = Profiler()
+
+# Raised from a progress callback to abort a load that is no longer needed
+class LoadCancelled(Exception):
+    pass
+
+# File wrapper that reports how much of the compressed file has been read, and how long reading took
+class ProgressReader:
+
+    def __init__(self, fileobj, total_size, progress=None):
+        self.fileobj = fileobj
+        self.total_size = max(total_size, 1)
+        self.progress = progress
+        self.read_time = 0.0
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.fileobj.read(size)
+        self.read_time += time.perf_counter() - start
+        if self.progress is not None:
+            self.progress(min(self.fileobj.tell() / self.total_size, 1.0))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+# Decompression backends for .nii.gz files. 'zlib' is the standard library gzip module used by nibabel;
+# 'isal' (python-isal) is a faster drop-in, 'rapidgzip' decompresses blocks in parallel on all cores.
+def available_gzip_backends():
+    backends = ['zlib']
+    if igzip is not None:
+        backends.append('isal')
+    if rapidgzip is not None:
+        backends.append('rapidgzip')
+    return backends
+
+# Function to open a decompressed stream of a .gz file with the given backend
+def open_gzip_stream(raw, file_path, backend='zlib'):
+    if backend == 'rapidgzip' and rapidgzip is not None:
+        # rapidgzip reads the file itself from its worker threads, so it gets the path rather than the wrapper
+        return rapidgzip.open(file_path, parallelization=os.cpu_count() or 1)
+    if backend == 'isal' and igzip is not None:
+        return igzip.GzipFile(fileobj=raw, mode='rb')
+    return gzip.GzipFile(fileobj=raw, mode='rb')
+
+# Function to open a .nii.gz through our own gzip stream so that decompression progress can be reported
+def open_nii_stream(stream):
+    # NIfTI-2 headers are 540 bytes long, NIfTI-1 headers 348
+    import nibabel as nib
+    magic = stream.read(4)
+    stream.seek(0)
+    if 540 in (int.from_bytes(magic, 'little'), int.from_bytes(magic, 'big')):
+        return nib.Nifti2Image.from_stream(stream)
+    return nib.Nifti1Image.from_stream(stream)
+
+# Orientation every volume is brought to when it is loaded: voxel axes pointing to the patient's left,
+# posterior and superior, as written by DICOM converters. The display views assume this orientation.
+canonical_axcodes = ('L', 'P', 'S')
+
+# Volume that can carry its voxel size in mm (spacing) and contiguous copies per slicing axis (axis_copies).
+# Memory-mapped arrays take attributes as they are; other arrays are viewed as a VolumeArray, without copying.
+class VolumeArray(np.ndarray):
+
+    # Results of computations on a volume are plain arrays (and plain scalars for reductions)
+    def __array_wrap__(self, array, context=None, return_scalar=False):
+        array = array.view(np.ndarray)
+        return array[()] if return_scalar else array
+
+# Function to attach attributes (spacing, axis_copies) to a volume
+def volume_with(volume, **attributes):
+    if not hasattr(volume, '__dict__'):
+        volume = volume.view(VolumeArray)
+    volume.__dict__.update(attributes)
+    return volume
+
+# Function to get how to reorient an image to the canonical orientation (nibabel ornt array, derived
+# from the header affine) and its voxel size in mm (pixdim) along the reoriented axes
+def canonical_orientation(img):
+    from nibabel import orientations
+    ornt = orientations.ornt_transform(orientations.io_orientation(img.affine), orientations.axcodes2ornt(canonical_axcodes))
+    zooms = list(img.header.get_zooms()[:3]) + [1.0] * 3
+    spacing = [1.0, 1.0, 1.0]
+    for axis, (new_axis, _) in enumerate(ornt):
+        spacing[int(new_axis)] = float(zooms[axis])
+    return ornt, tuple(spacing)
+
+# Function to get the voxel data of a loaded image
+# With native=True the volume keeps its on-disk dtype (e.g. int16 CT, uint8 labels) and
+# uncompressed .nii files stay memory-mapped, so only the slices that are displayed get paged in.
+# The volume is reoriented to canonical_axcodes with transposes and flips, which are views, not copies.
+def image_volume(img, native=True, timings=None):
+    start = time.perf_counter()
+    proxy = img.dataobj
+    raw = np.asanyarray(proxy.get_unscaled() if hasattr(proxy, 'get_unscaled') else proxy)
+    fetched = time.perf_counter()
+    slope = getattr(proxy, 'slope', 1.0)
+    inter = getattr(proxy, 'inter', 0.0)
+
+    if not native:
+        volume = raw * slope + inter if (slope != 1 or inter != 0) else raw.astype(np.float64)
+    elif slope == 1 and inter == 0:
+        volume = raw
+    elif raw.dtype.kind in 'iu' and float(slope).is_integer() and float(inter).is_integer():
+        # Scaled data: keep integers when the scaling is integral, otherwise use float32
+        bounds = [int(raw.min()) * int(slope) + int(inter), int(raw.max()) * int(slope) + int(inter)]
+        dtype = np.result_type(np.min_scalar_type(min(bounds)), np.min_scalar_type(max(bounds)))
+        volume = raw.astype(dtype)
+        volume *= dtype.type(slope)
+        volume += dtype.type(inter)
+    else:
+        volume = raw.astype(np.float32)
+        volume *= np.float32(slope)
+        volume += np.float32(inter)
+
+    if timings is not None:
+        timings['fetch'] = fetched - start
+        timings['convert'] = time.perf_counter() - fetched
+    if volume.ndim < 3:
+        return volume
+    from nibabel.orientations import apply_orientation
+    ornt, spacing = canonical_orientation(img)
+    return volume_with(apply_orientation(volume, ornt), spacing=spacing)
+
+# Function to load nii.gz files. progress(fraction) is called while the file is decompressed,
+# timings receives the read / decompress / convert breakdown in seconds
+def load_nii(file_path, native=True, progress=None, backend='zlib', timings=None):
+    import nibabel as nib
+    timings = {} if timings is None else timings
+    if not file_path.endswith('.gz'):
+        volume = image_volume(nib.load(file_path, mmap='r'), native, timings)
+        # Memory-mapped: nothing is read or decompressed up front
+        timings['read'] = 0.0
+        timings['decompress'] = 0.0
+    else:
+        if progress is not None:
+            progress(0.0)
+        with open(file_path, 'rb') as raw_file:
+            raw = ProgressReader(raw_file, os.path.getsize(file_path), progress)
+            with open_gzip_stream(raw, file_path, backend) as stream:
+                volume = image_volume(open_nii_stream(stream), native, timings)
+        # For rapidgzip reading happens inside the decompressor and is counted there
+        timings['read'] = raw.read_time
+        timings['decompress'] = max(timings['fetch'] - raw.read_time, 0.0)
+    timings.pop('fetch', None)
+    if progress is not None:
+        progress(1.0)
+    return volume
+
+# Function to find the file of a subject, compressed or not
+def find_volume_path(folder, subject_name):
+    for extension in ('.nii.gz', '.nii'):
+        path = os.path.join(folder, f'{subject_name}{extension}')
+        if os.path.exists(path):
+            return path
+    return None
+
+# Function to get a 2D slice of a volume along an axis (0 sagittal, 1 coronal, 2 axial).
+# Uses the contiguous per-axis copy of the volume when one is available.
+def volume_slice(volume, axis, index):
+    axis_copies = getattr(volume, 'axis_copies', None)
+    if axis_copies is not None and axis in axis_copies:
+        return axis_copies[axis][index]
+    return volume[(slice(None),) * axis + (index,)]
+
+# Slicing axis of each view
+view_axes = {'sagittal': 0, 'coronal': 1, 'axial': 2}
+
+# Function to check whether the slices of a volume along an axis are contiguous reads: the axis has a
+# contiguous copy or the largest stride. Sagittal slices of a C-ordered volume are, axial ones are not.
+def slices_contiguous(volume, axis):
+    axis_copies = getattr(volume, 'axis_copies', None)
+    if axis_copies is not None and axis in axis_copies:
+        return True
+    strides = [abs(stride) for stride in volume.strides]
+    return strides[axis] == max(strides)
+
+# Function to build a contiguous copy of a volume with an axis first, used by volume_slice from then on.
+# Building takes one pass over the volume (e.g. in the background); returns the bytes added.
+def build_axis_copy(volume, axis):
+    if not hasattr(volume, '__dict__') or slices_contiguous(volume, axis):
+        return 0
+    axis_copy = np.ascontiguousarray(np.moveaxis(volume, axis, 0))
+    # Replaced, not updated, so that readers on other threads see either the old or the new copies
+    axis_copies = dict(getattr(volume, 'axis_copies', None) or {})
+    axis_copies[axis] = axis_copy
+    volume.axis_copies = axis_copies
+    return axis_copy.nbytes
+
+# Function to orient a 2D slice of a view for display. Rotations and flips are strided views, never copies.
+def orient_slice(volume_2d, view):
+    if view == 'axial':
+        return np.flip(np.rot90(volume_2d))  # Adjust orientation for display
+    elif view == 'coronal':
+        return np.rot90(volume_2d)  # Adjust orientation for display
+    return np.flip(np.rot90(volume_2d, 3, (1, 0)), 1)  # Adjust orientation for display
+
+# Function to get a slice of a volume for a view, oriented for display
+def display_slice(volume, view, index):
+    if volume is None:
+        return None
+    return orient_slice(volume_slice(volume, view_axes[view], index), view)
+
+# Function to halve a volume along every axis. Intensities are averaged over 2x2x2 blocks (the last voxel is
+# repeated for odd sizes); labels are subsampled, so that no new label values appear. Reads a few slices at a time.
+def downsample_volume(volume, labels=False, chunk_voxels=2**22):
+    if labels:
+        return np.ascontiguousarray(volume[::2, ::2, ::2])
+    downsampled = np.empty(tuple((size + 1) // 2 for size in volume.shape), dtype=volume.dtype)
+    step = max(chunk_voxels // max(volume[0].size, 1), 1) * 2
+    for start in range(0, volume.shape[0], step):
+        block = np.asarray(volume[start:start + step], dtype=np.float32)
+        block = np.pad(block, [(0, size % 2) for size in block.shape], mode='edge')
+        rows, columns = block.shape[1] // 2, block.shape[2] // 2
+        means = block.reshape(block.shape[0] // 2, 2, rows, 2, columns, 2).mean(axis=(1, 3, 5))
+        if volume.dtype.kind in 'iu':
+            np.rint(means, out=means)
+        downsampled[start // 2:start // 2 + means.shape[0]] = means
+    return downsampled
+
+# Function to build the multi-resolution pyramid of a large volume (e.g. in the background after loading).
+# Each level halves the previous one, down to about min_size voxels along the longest axis. Levels are
+# attached (volume.pyramid) as soon as each is built; returns the bytes added.
+def build_pyramid(volume, labels=False, min_size=256):
+    if not hasattr(volume, '__dict__') or getattr(volume, 'pyramid', None) is not None:
+        return 0
+    levels = []
+    level = volume
+    while max(level.shape) >= 2 * min_size:
+        level = downsample_volume(level, labels)
+        levels = levels + [level]
+        volume.pyramid = levels
+    return sum(level.nbytes for level in levels)
+
+# Function to choose the pyramid level to show a view in a panel of (height, width) screen pixels: the coarsest
+# level that still has a voxel per screen pixel. coarser adds levels, e.g. for a quick preview while scrolling fast.
+# Only levels that all the given volumes have are used.
+def pyramid_level(volumes, view, panel_size, coarser=0):
+    volumes = [volume for volume in volumes if volume is not None]
+    if not volumes:
+        return 0
+    levels = min(len(getattr(volume, 'pyramid', None) or ()) for volume in volumes)
+    rows, columns = (volumes[0].shape[axis] for axis in display_axes(view))
+    level = 0
+    while level < levels and rows >> (level + 1) >= panel_size[0] and columns >> (level + 1) >= panel_size[1]:
+        level += 1
+    return min(level + coarser, levels)
+
+# Function to get a slice of a view from a pyramid level of a volume (0 is the volume itself)
+def level_slice(volume, view, index, level=0):
+    if volume is None or level == 0:
+        return display_slice(volume, view, index)
+    volume = volume.pyramid[level - 1]
+    return display_slice(volume, view, min(index >> level, volume.shape[view_axes[view]] - 1))
+
+# Function to get the volume axes along the rows and the columns of the displayed slices of a view
+@lru_cache(maxsize=None)
+def display_axes(view):
+    axes = [axis for axis in range(3) if axis != view_axes[view]]
+    oriented = orient_slice(np.zeros((2, 3)), view)
+    return (axes[0], axes[1]) if oriented.shape[0] == 2 else (axes[1], axes[0])
+
+# Function to get the height / width ratio of a displayed pixel of a view from the voxel size of the volume,
+# so that anisotropic scans are not squashed. 1 when the voxel size is unknown.
+def display_aspect(volume, view):
+    spacing = getattr(volume, 'spacing', None)
+    if spacing is None or min(spacing) <= 0:
+        return 1.0
+    row_axis, column_axis = display_axes(view)
+    return spacing[row_axis] / spacing[column_axis]
+
+# Function to get, for each in-plane axis of a view, the voxel index at every display position.
+# The grids are broadcast views, so this costs nothing even for large slices.
+def display_index_grids(shape, view):
+    axes = [axis for axis in range(3) if axis != view_axes[view]]
+    rows, columns = shape[axes[0]], shape[axes[1]]
+    grids = [np.broadcast_to(np.arange(rows)[:, None], (rows, columns)), np.broadcast_to(np.arange(columns)[None, :], (rows, columns))]
+    return axes, [orient_slice(grid, view) for grid in grids]
+
+# Function to get the voxel shown at a display (row, column) of a slice of a view
+def voxel_at(shape, view, index, row, column):
+    voxel = [0, 0, 0]
+    voxel[view_axes[view]] = index
+    axes, grids = display_index_grids(shape, view)
+    for axis, grid in zip(axes, grids):
+        voxel[axis] = int(grid[row, column])
+    return tuple(voxel)
+
+# Function to get the display (row, column) of a voxel in a view
+def display_position(shape, view, voxel):
+    position = [0, 0]
+    axes, grids = display_index_grids(shape, view)
+    for axis, grid in zip(axes, grids):
+        if grid.shape[0] > 1 and grid[0, 0] != grid[1, 0]:
+            position[0] = int(np.flatnonzero(grid[:, 0] == voxel[axis])[0])
+        else:
+            position[1] = int(np.flatnonzero(grid[0, :] == voxel[axis])[0])
+    return tuple(position)
+
+# Function to get the folder of the disk cache and the dataset index cache
+def default_cache_dir():
+    return os.environ.get('CT_VIEWER_CACHE') or os.path.join(os.path.expanduser('~'), '.cache', '3d-ct-scan-viewer')
+
+# On-disk cache of decoded volumes as uncompressed .npy files. Each volume is stored once per
+# slicing axis with that axis first, so that sagittal, coronal and axial slices are all contiguous
+# reads. Entries are keyed by source path, size and mtime and evicted least recently used first.
+# They are kept in their own folder of the cache, so that eviction never touches the index,
+# the metrics, the recorded profiles or the benchmark volumes next to them.
+class VolumeCache:
+
+    def __init__(self, cache_dir=None, max_size_gb=20):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.volumes_dir = os.path.join(self.cache_dir, 'volumes')
+        self.max_size = max_size_gb * 2**30
+        self.lock = threading.Lock()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='volume-cache')
+
+    def entry_dir(self, file_path):
+        stat = os.stat(file_path)
+        # Versioned: entries before volumes were reoriented and carried their voxel size are not reused
+        key = f'v2|{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}'
+        return os.path.join(self.volumes_dir, hashlib.sha1(key.encode()).hexdigest()[:20])
+
+    def load(self, file_path):
+        entry_dir = self.entry_dir(file_path)
+        try:
+            axis_copies = {axis: np.load(os.path.join(entry_dir, f'axis{axis}.npy'), mmap_mode='r') for axis in range(3)}
+            spacing = tuple(float(size) for size in np.load(os.path.join(entry_dir, 'spacing.npy')))
+            # Mark as recently used for the LRU eviction
+            os.utime(entry_dir)
+        except (OSError, ValueError):
+            return None
+        return volume_with(axis_copies[0], axis_copies=axis_copies, spacing=spacing)
+
+    def store(self, file_path, volume):
+        entry_dir = self.entry_dir(file_path)
+        if volume.ndim != 3 or os.path.isdir(entry_dir):
+            return
+        # Written to a temporary folder and renamed, so readers never see a partial entry
+        tmp_dir = f'{entry_dir}.tmp{os.getpid()}-{threading.get_ident()}'
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            for axis in range(3):
+                axis_first = np.moveaxis(volume, axis, 0)
+                axis_copy = np.lib.format.open_memmap(os.path.join(tmp_dir, f'axis{axis}.npy'), mode='w+', dtype=volume.dtype, shape=axis_first.shape)
+                axis_copy[...] = axis_first
+                axis_copy.flush()
+                del axis_copy
+            np.save(os.path.join(tmp_dir, 'spacing.npy'), np.array(getattr(volume, 'spacing', (1.0, 1.0, 1.0))))
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(entry_dir):
+                print(f"Could not cache {file_path}: {e}")
+            return
+        self.evict()
+
+    def store_async(self, file_path, volume):
+        self.writer.submit(self.store, file_path, volume)
+
+    def entries(self):
+        entries = []
+        if not os.path.isdir(self.volumes_dir):
+            return entries
+        for name in os.listdir(self.volumes_dir):
+            entry_dir = os.path.join(self.volumes_dir, name)
+            if '.tmp' in name or not os.path.isdir(entry_dir):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+            entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+        return entries
+
+    def evict(self):
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            # Always keep the most recent entry, even if it alone exceeds the cap
+            for _, size, entry_dir in entries[:-1]:
+                if total <= self.max_size:
+                    break
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total -= size
+
+    def shutdown(self):
+        self.writer.shutdown(wait=True)
+
+# Define min and max intensity values
+min_intensity = 0
+max_intensity = 90
+
+# Window presets as (min, max) intensity in HU
+window_presets = {
+    'Default': (min_intensity, max_intensity),
+    'Soft Tissue': (-160, 240),
+    'Lung': (-1350, 150),
+    'Bone': (-500, 1300),
+    'Brain': (0, 80),
+}
+
+# Function to build the lookup table that windows every value of a small integer dtype to 0-255.
+# The table is ordered by the unsigned view of the dtype so it can be indexed with the raw bits.
+@lru_cache(maxsize=32)
+def window_lut(dtype, min_intensity, max_intensity):
+    info = np.iinfo(dtype)
+    values = np.arange(info.min, info.max + 1, dtype=np.float32)
+    scale = 255.0 / max(max_intensity - min_intensity, 1e-6)
+    lut = np.rint(np.clip((values - min_intensity) * scale, 0, 255)).astype(np.uint8)
+    return np.roll(lut, info.min)
+
+# Function to window a CT slice to uint8 gray levels between given min and max intensity
+def window_ct_slice(ct_slice, min_intensity, max_intensity):
+    dtype = ct_slice.dtype
+    if dtype.kind in 'iu' and dtype.itemsize <= 2:
+        lut = window_lut(dtype, min_intensity, max_intensity)
+        return lut.take(ct_slice.view(f'u{dtype.itemsize}'))
+    scale = 255.0 / max(max_intensity - min_intensity, 1e-6)
+    windowed = (ct_slice.astype(np.float32) - min_intensity) * scale
+    return np.rint(np.clip(windowed, 0, 255, out=windowed)).astype(np.uint8)
+
+
+# Function to check whether an array is memory-mapped from a file. Reoriented volumes are views of the
+# memory map and do not keep the np.memmap type, so the arrays they are views of are checked too.
+def memory_mapped(array):
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+# Function to compute how much RAM the loaded volumes, their in-memory axis copies and pyramids occupy
+# (memory-mapped volumes are paged in on demand)
+def resident_memory(*volumes):
+    arrays = []
+    for volume in volumes:
+        if volume is not None:
+            arrays.append(volume)
+            arrays.extend((getattr(volume, 'axis_copies', None) or {}).values())
+            arrays.extend(getattr(volume, 'pyramid', None) or ())
+    return sum(array.nbytes for array in arrays if not memory_mapped(array))
+
+# Peak allocation tracking, shared by loads running on several threads at once
+memory_tracking_lock = threading.Lock()
+memory_tracking_users = 0
+memory_tracking_baseline = 0
+
+@contextmanager
+def track_peak_memory(stats):
+    global memory_tracking_users, memory_tracking_baseline
+    with memory_tracking_lock:
+        if memory_tracking_users == 0:
+            tracemalloc.start()
+            memory_tracking_baseline = tracemalloc.get_traced_memory()[0]
+        memory_tracking_users += 1
+    try:
+        yield stats
+    finally:
+        with memory_tracking_lock:
+            # The peak since tracking started: when loads overlap it includes the other loads, so it is an upper bound.
+            # It is never reset while a load is in flight, which would lose the peak of that load.
+            stats['peak'] = max(tracemalloc.get_traced_memory()[1] - memory_tracking_baseline, 0)
+            memory_tracking_users -= 1
+            if memory_tracking_users == 0:
+                tracemalloc.stop()
+
+# Subject folders and the volume each one holds, in loading order
+subject_volumes = [('CT', 'ct_scan'), ('Ground_truth', 'ground_truth'), ('Predicted', 'predicted')]
+required_folders = [folder for folder, _ in subject_volumes]
+
+# Function to load the CT, ground truth and prediction of a subject.
+# The three files are decompressed concurrently; on_volume(kind, volume) is called as soon as
+# each volume is ready and progress(kind, fraction) while it decodes.
+def load_subject_data(subject_name, native=True, on_volume=None, progress=None, backend='zlib', volume_cache=None, verbose=True, index=None):
+    # Initialize variables to None
+    volumes = {'ct_scan': None, 'ground_truth': None, 'predicted': None}
+    use_volume_cache = volume_cache is not None and native
+
+    # The CT is kept raw; windowing is applied to the displayed slice only
+    def load_volume(path, kind):
+        start = time.perf_counter()
+        volumes[kind] = volume_cache.load(path) if use_volume_cache else None
+        if volumes[kind] is not None:
+            profiler.record('cache load', time.perf_counter() - start, start)
+            if verbose:
+                print(f"Loaded {path} [disk cache]: {time.perf_counter() - start:.3f}s")
+        else:
+            timings = {}
+            volumes[kind] = load_nii(path, native, partial(progress, kind) if progress is not None else None, backend, timings)
+            # Reading and decompressing overlap; the trace shows them one after the other
+            stage_start = start
+            for stage in ('read', 'decompress', 'convert'):
+                profiler.record(stage, timings[stage], stage_start)
+                stage_start += timings[stage]
+            if verbose:
+                print(f"Loaded {path} [{backend if path.endswith('.gz') else 'mmap'}]: read {timings['read']:.2f}s, "
+                      f"decompress {timings['decompress']:.2f}s, convert {timings['convert']:.2f}s")
+            if use_volume_cache:
+                volume_cache.store_async(path, volumes[kind])
+        if on_volume is not None:
+            on_volume(kind, volumes[kind])
+
+    if index is not None:
+        paths = [(index.volume_path(subject_name, folder), kind) for folder, kind in subject_volumes]
+    else:
+        paths = [(find_volume_path(folder, subject_name), kind) for folder, kind in subject_volumes]
+    with ThreadPoolExecutor(max_workers=len(subject_volumes), thread_name_prefix='decompress') as executor:
+        futures = [executor.submit(load_volume, path, kind) for path, kind in paths if path is not None]
+    for future in futures:
+        future.result()
+
+    ct_scan, ground_truth, predicted = volumes['ct_scan'], volumes['ground_truth'], volumes['predicted']
+
+    # Ensure the dimensions match if all images are present
+    if ct_scan is not None and ground_truth is not None:
+        assert ct_scan.shape == ground_truth.shape, "CT scan and ground truth dimensions do not match!"
+    if ct_scan is not None and predicted is not None:
+        assert ct_scan.shape == predicted.shape, "CT scan and predicted dimensions do not match!"
+
+    return ct_scan, ground_truth, predicted
+
+# Function to load a subject together with its peak and resident memory
+# The label set is discovered from the label volumes unless known_labels (e.g. from a color table) is given.
+# Without track_memory (background prefetches) the peak is None: tracemalloc slows down every allocation of the process.
+def load_subject_with_stats(subject_name, on_volume=None, progress=None, backend='zlib', volume_cache=None, known_labels=None, index=None,
+                            track_memory=True):
+    stats = {'peak': None}
+    with track_peak_memory(stats) if track_memory else nullcontext():
+        volumes = load_subject_data(subject_name, on_volume=on_volume, progress=progress, backend=backend, volume_cache=volume_cache, index=index)
+    stats['resident'] = resident_memory(*volumes)
+    stats['labels'] = sorted(known_labels) if known_labels is not None else discover_labels(volumes[1], volumes[2])
+    return volumes, stats
+
+# Function to sort subject names naturally, so that SUB_9 comes before SUB_10
+def natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+# Function to get the subject name of a .nii/.nii.gz file name, or None for other files
+def subject_name_of(file_name):
+    for extension in ('.nii.gz', '.nii'):
+        if file_name.endswith(extension):
+            return file_name[:-len(extension)]
+    return None
+
+# Index of the subjects of a dataset: the CT, ground truth and prediction path of every subject (None if missing).
+# It is built by scanning the subject folders, or read from a manifest (CSV with subject,ct,ground_truth,predicted
+# columns or a JSON list of objects with these keys; paths relative to the manifest) for datasets on network storage.
+# Scans are cached next to the disk cache and refreshed incrementally: a folder is listed again only when its mtime changes.
+class DatasetIndex:
+
+    manifest_columns = dict(zip(required_folders, ['ct', 'ground_truth', 'predicted']))
+
+    def __init__(self, root='.', manifest=None, cache_dir=None):
+        self.root = os.path.abspath(root)
+        self.manifest = os.path.abspath(manifest) if manifest else None
+        source = self.manifest or self.root
+        self.cache_path = os.path.join(cache_dir or default_cache_dir(), f"index-{hashlib.sha1(source.encode()).hexdigest()[:20]}.json")
+        self.lock = threading.Lock()
+        # Folder (or the manifest) -> {'mtime': mtime_ns, 'paths': {subject name: path}}
+        self.sources = {}
+        self.subjects = []
+        self.ct_subjects = []
+        self.ct_keys = []
+        self.load_cache()
+        self.refresh()
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                self.sources = json.load(f)
+        except (OSError, ValueError):
+            self.sources = {}
+        self.rebuild()
+
+    def save_cache(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        temporary_path = f'{self.cache_path}.tmp{os.getpid()}-{threading.get_ident()}'
+        with open(temporary_path, 'w') as f:
+            json.dump(self.sources, f)
+        os.replace(temporary_path, self.cache_path)
+
+    # Re-read the folders or the manifest that changed since the last refresh; returns True if the index changed
+    def refresh(self):
+        sources = dict(self.sources)
+        changed = False
+        for source in ([self.manifest] if self.manifest else required_folders):
+            path = source if self.manifest else os.path.join(self.root, source)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if source in sources and sources[source]['mtime'] == mtime:
+                continue
+            if mtime is None:
+                entry = {'mtime': None, 'paths': {}}
+            elif self.manifest:
+                entry = {'mtime': mtime, 'paths': self.read_manifest()}
+            else:
+                entry = {'mtime': mtime, 'paths': self.scan_folder(path)}
+            changed = changed or sources.get(source) != entry
+            sources[source] = entry
+        if changed:
+            with self.lock:
+                self.sources = sources
+                self.rebuild()
+            try:
+                self.save_cache()
+            except OSError as e:
+                print(f"Could not write the dataset index cache {self.cache_path}: {e}")
+        return changed
+
+    def scan_folder(self, folder):
+        paths = {}
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                subject_name = subject_name_of(entry.name)
+                # .nii.gz wins over .nii, as in find_volume_path
+                if subject_name is not None and (subject_name not in paths or entry.name.endswith('.gz')):
+                    paths[subject_name] = entry.path
+        return paths
+
+    def read_manifest(self):
+        with open(self.manifest, newline='') as f:
+            if self.manifest.endswith('.json'):
+                rows = json.load(f)
+            else:
+                rows = list(csv.DictReader(f))
+        base = os.path.dirname(self.manifest)
+        paths = {}
+        for row in rows:
+            paths[row['subject']] = {folder: os.path.join(base, row[column]) if row.get(column) else None
+                                     for folder, column in self.manifest_columns.items()}
+        return paths
+
+    def rebuild(self):
+        if self.manifest:
+            paths = self.sources.get(self.manifest, {'paths': {}})['paths']
+        else:
+            paths = {}
+            for folder in required_folders:
+                for subject_name, path in self.sources.get(folder, {'paths': {}})['paths'].items():
+                    paths.setdefault(subject_name, dict.fromkeys(required_folders))[folder] = path
+        subjects = sorted(paths, key=natural_key)
+        ct_subjects = [name for name in subjects if paths[name].get('CT')]
+        self.paths, self.subjects, self.ct_subjects = paths, subjects, ct_subjects
+        self.ct_keys = [natural_key(name) for name in ct_subjects]
+
+    def __len__(self):
+        return len(self.subjects)
+
+    def __contains__(self, subject_name):
+        return subject_name in self.paths
+
+    # Path of one volume of a subject, or None; subjects outside the index are looked up on disk
+    def volume_path(self, subject_name, folder):
+        with self.lock:
+            paths = self.paths.get(subject_name)
+        if paths is None:
+            return None if self.manifest else find_volume_path(os.path.join(self.root, folder), subject_name)
+        return paths.get(folder)
+
+    # Which of CT / ground truth / prediction exist for a subject
+    def available(self, subject_name):
+        paths = self.paths.get(subject_name, {})
+        return tuple(paths.get(folder) is not None for folder in required_folders)
+
+    # Subject n positions away among the subjects that have a CT, so that gaps are skipped.
+    # Names outside the index are placed by their natural sort order.
+    def shift(self, subject_name, offset):
+        with self.lock:
+            if not self.ct_subjects:
+                return subject_name
+            key = natural_key(subject_name)
+            if offset > 0:
+                position = bisect.bisect_right(self.ct_keys, key) + offset - 1
+            else:
+                position = bisect.bisect_left(self.ct_keys, key) + offset
+            return self.ct_subjects[min(max(position, 0), len(self.ct_subjects) - 1)]
+
+    # Subjects around the current one, nearest first
+    def neighbours(self, subject_name, radius=1):
+        neighbours = []
+        for distance in range(1, radius + 1):
+            for offset in (distance, -distance):
+                name = self.shift(subject_name, offset)
+                if name != subject_name and name not in neighbours:
+                    neighbours.append(name)
+        return neighbours
+
+# Function to get the dataset index once per process (e.g. per batch worker)
+@lru_cache(maxsize=None)
+def dataset_index(manifest=None):
+    return DatasetIndex(manifest=manifest)
+
+# Function to pick the subjects matching names or glob patterns (e.g. 'SUB_0*') from the available ones.
+# Plain names that are not available are left out and added to missing, when given, to be reported.
+def expand_subjects(patterns, available, missing=None):
+    available_names = set(available)
+    subjects = []
+    for pattern in patterns:
+        if any(char in pattern for char in '*?['):
+            matches = fnmatch.filter(available, pattern)
+        elif pattern in available_names:
+            matches = [pattern]
+        else:
+            matches = []
+            if missing is not None and pattern not in missing:
+                missing.append(pattern)
+        subjects.extend(match for match in matches if match not in subjects)
+    return subjects
+
+# LRU cache of loaded subjects with a memory budget. Neighbouring subjects are decoded
+# on a background thread pool so that prev/next navigation is instant on a hit.
+class SubjectCache:
+
+    def __init__(self, budget_mb=2048, max_workers=2):
+        self.budget = budget_mb * 2**20
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self.hits = 0
+        self.misses = 0
+        self.gzip_backend = 'zlib'
+        self.volume_cache = None
+        self.known_labels = None
+        self.index = None
+        # The subject on screen is never evicted, and prefetched subjects that were not shown yet are evicted first
+        self.current = None
+        self.prefetched = set()
+
+    def size(self):
+        # Computed from the volumes, since axis copies can be added after loading
+        return sum(resident_memory(*volumes) for volumes, _ in self.entries.values())
+
+    def set_budget(self, budget_mb):
+        with self.lock:
+            self.budget = budget_mb * 2**20
+            self.evict()
+
+    def evict(self, keep=None):
+        # Drop the least recently used subjects until the cache fits in the budget, prefetched ones first
+        order = sorted(self.entries, key=lambda subject_name: subject_name not in self.prefetched)
+        for subject_name in order:
+            if self.size() <= self.budget:
+                break
+            if subject_name not in (keep, self.current):
+                del self.entries[subject_name]
+                self.prefetched.discard(subject_name)
+
+    def put(self, subject_name, entry, prefetched=False):
+        volumes, _ = entry
+        if all(volume is None for volume in volumes):
+            return
+        with self.lock:
+            self.entries[subject_name] = entry
+            self.entries.move_to_end(subject_name)
+            if prefetched:
+                self.prefetched.add(subject_name)
+            else:
+                self.prefetched.discard(subject_name)
+            self.evict(keep=subject_name)
+
+    def peek(self, subject_name):
+        # Cached entry or None, without loading anything
+        with self.lock:
+            if subject_name not in self.entries:
+                return None
+            self.hits += 1
+            self.entries.move_to_end(subject_name)
+            self.prefetched.discard(subject_name)
+            return self.entries[subject_name]
+
+    def get(self, subject_name, on_volume=None, progress=None, cancel_event=None):
+        with self.lock:
+            if subject_name in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(subject_name)
+                self.prefetched.discard(subject_name)
+                return self.entries[subject_name]
+            future = self.pending.get(subject_name)
+            if future is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if future is not None:
+            # Already being decoded in the background, wait for it
+            while True:
+                try:
+                    entry = future.result(timeout=0.05)
+                    with self.lock:
+                        self.prefetched.discard(subject_name)
+                    return entry
+                except FutureTimeoutError:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise LoadCancelled(subject_name)
+        entry = load_subject_with_stats(subject_name, on_volume, progress, self.gzip_backend, self.volume_cache, self.known_labels, self.index)
+        self.put(subject_name, entry)
+        return entry
+
+    def prefetch(self, subject_names):
+        with self.lock:
+            for subject_name in subject_names:
+                if subject_name in self.entries or subject_name in self.pending:
+                    continue
+                self.pending[subject_name] = self.executor.submit(self.load_in_background, subject_name)
+
+    def load_in_background(self, subject_name):
+        try:
+            entry = load_subject_with_stats(subject_name, backend=self.gzip_backend, volume_cache=self.volume_cache,
+                                           known_labels=self.known_labels, index=self.index, track_memory=False)
+            self.put(subject_name, entry, prefetched=True)
+            return entry
+        finally:
+            with self.lock:
+                self.pending.pop(subject_name, None)
+
+    def status_text(self):
+        with self.lock:
+            return f"Cache: {self.hits} hits / {self.misses} misses, {len(self.entries)} subjects, {self.size() / 2**20:.0f} MB"
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# Function to build the label -> (premultiplied color, inverse alpha) lookup table used to composite
+# overlays. label_colors holds (label, (r, g, b)) pairs; values are 8.8 fixed point so that blending
+# stays in integer arithmetic, and the cost per pixel does not depend on the number of labels.
+@lru_cache(maxsize=64)
+def overlay_lut(label_colors, opacity):
+    size = max([256] + [label + 1 for label, _ in label_colors])
+    lut = np.zeros((size, 4), dtype=np.uint16)
+    lut[:, 3] = 256
+    alpha = int(round(opacity * 256))
+    for label, color in label_colors:
+        lut[label, :3] = np.rint(np.array(color) * 255 * alpha)
+        lut[label, 3] = 256 - alpha
+    lut.flags.writeable = False
+    return lut
+
+# Function to blend a label slice over a windowed uint8 CT slice into an RGBA frame.
+# One LUT lookup per pixel gives the label color and alpha; buffers holds reusable scratch arrays.
+def composite_overlay(gray, labels, lut, buffers=None):
+    buffers = {} if buffers is None else buffers
+    if labels.dtype.kind not in 'iu':
+        labels = labels.astype(np.intp)
+    if buffers.get('shape') != labels.shape:
+        buffers['shape'] = labels.shape
+        buffers['lookup'] = np.empty(labels.shape + (4,), dtype=np.uint16)
+        buffers['product'] = np.empty(labels.shape + (1,), dtype=np.uint16)
+
+    lookup = buffers['lookup']
+    np.take(lut, labels, axis=0, out=lookup, mode='clip')
+    np.multiply(gray[..., None], lookup[..., 3:], out=buffers['product'])
+    blended = lookup[..., :3]
+    blended += buffers['product']
+
+    frame = np.empty(labels.shape + (4,), dtype=np.uint8)
+    np.right_shift(blended, 8, out=frame[..., :3], casting='unsafe')
+    frame[..., 3] = 255
+    return frame
+
+# Classes and colors of the error map: true positive, false positive, false negative and wrong label
+# (labelled in both, with different labels: a false positive of one label and a false negative of another)
+error_classes = ['TP', 'FP', 'FN', 'Wrong label']
+error_colors = ((1, (0.0, 0.8, 0.0)), (2, (1.0, 0.0, 0.0)), (3, (0.1, 0.4, 1.0)), (4, (1.0, 0.85, 0.0)))
+error_class_table = np.array([0, 3, 2, 1], dtype=np.uint8)
+
+# Function to classify every voxel of a ground truth and a predicted slice (0: background, 1-4: error_classes),
+# counting only the given labels (None: all labels)
+def error_slice(gt_slice, pred_slice, labels=None):
+    if labels is not None:
+        labels = list(labels)
+        gt_slice = np.where(np.isin(gt_slice, labels), gt_slice, 0)
+        pred_slice = np.where(np.isin(pred_slice, labels), pred_slice, 0)
+    gt_present = gt_slice > 0
+    pred_present = pred_slice > 0
+    classes = error_class_table[gt_present.view(np.uint8) + 2 * pred_present.view(np.uint8)]
+    classes[gt_present & pred_present & (gt_slice != pred_slice)] = 4
+    return classes
+
+# Function to get the number of false positive plus false negative voxels per slice along an axis, from the
+# per-slice counts of segmentation_metrics (a wrong-label voxel counts once for each of its two labels)
+def slice_errors(subject_metrics, labels, axis):
+    rows = [row for row, label in enumerate(subject_metrics['labels']) if label in labels]
+    return (subject_metrics['slice_total'][axis][rows] - 2 * subject_metrics['slice_intersection'][axis][rows]).sum(axis=0)
+
+# Default label colors: the classic red and blue for labels 1 and 2, then the rest of color_map, then tab20
+label_palette = ['red', 'blue', 'green', 'yellow', 'cyan', 'magenta']
+
+def default_label_color(label):
+    if 1 <= label <= len(label_palette):
+        return tuple(color_map[label_palette[label - 1]])
+    from matplotlib import colormaps
+    return tuple(float(value) for value in colormaps['tab20'](label % 20)[:3])
+
+# Function to read a label color table (3D Slicer style): one "label name R G B [A]" line per label, RGB in 0-255.
+# Label 0 (Background in Slicer tables) and negative labels are skipped, as in discover_labels().
+def read_color_table(path):
+    table = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 5 or fields[0].startswith('#') or int(fields[0]) <= 0:
+                continue
+            table[int(fields[0])] = (fields[1], tuple(int(value) / 255 for value in fields[2:5]))
+    return table
+
+# Function to find the labels present in label volumes. Volumes are read a few slices at a time
+# so that no full-size temporary is created.
+def discover_labels(*volumes, chunk_voxels=2**22):
+    labels = set()
+    for volume in volumes:
+        if volume is None:
+            continue
+        step = max(1, chunk_voxels // max(1, volume[0].size))
+        for start in range(0, volume.shape[0], step):
+            chunk = np.asarray(volume[start:start + step])
+            if chunk.dtype == np.uint8:
+                labels.update(np.flatnonzero(np.bincount(chunk.ravel(), minlength=256)).tolist())
+            else:
+                labels.update(np.unique(chunk).tolist())
+    return sorted(int(label) for label in labels if label > 0)
+
+# Function to extract the contour lines of one label of a 2D label slice, with marching squares
+def label_contours(label_slice, label):
+    mask = label_slice == label
+    if not mask.any():
+        return []
+    import contourpy
+    return contourpy.contour_generator(z=mask.view(np.uint8), line_type='Separate').lines(0.5)
+
+# Cache of label contour lines of the current subject. Lines are computed once per slice and
+# label; precompute() fills a whole volume and view on a background thread.
+class ContourCache:
+
+    def __init__(self):
+        self.lines = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='contours')
+
+    def clear(self):
+        with self.lock:
+            self.lines = {}
+            self.generation += 1
+
+    def get(self, role, volume, view, index, label, label_slice=None):
+        key = (role, view, index, label)
+        lines = self.lines.get(key)
+        if lines is None:
+            if label_slice is None:
+                label_slice = display_slice(volume, view, index)
+            lines = label_contours(label_slice, label)
+            self.lines[key] = lines
+        return lines
+
+    def precompute(self, role, volume, view, labels):
+        generation = self.generation
+
+        def run():
+            for index in range(volume.shape[view_axes[view]]):
+                if self.generation != generation:
+                    return
+                label_slice = None
+                for label in labels:
+                    key = (role, view, index, label)
+                    if key in self.lines:
+                        continue
+                    if label_slice is None:
+                        label_slice = display_slice(volume, view, index)
+                    lines = label_contours(label_slice, label)
+                    with self.lock:
+                        if self.generation == generation:
+                            self.lines[key] = lines
+
+        self.executor.submit(run)
+
+# LRU cache of rendered frames, bounded by memory
+class FrameCache:
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.frames.move_to_end(key)
+        return frame
+
+    def put(self, key, frame):
+        if key in self.frames:
+            self.size -= self.frames.pop(key).nbytes
+        self.frames[key] = frame
+        self.size += frame.nbytes
+        while self.size > self.max_bytes and len(self.frames) > 1:
+            self.size -= self.frames.popitem(last=False)[1].nbytes
+
+    def clear(self):
+        self.frames.clear()
+        self.size = 0
+
+# Playback orders of the cine mode
+cine_modes = ['Loop', 'Bounce', 'Once']
+
+# Function to get the slice shown at a playback position (frame number) of the cine mode, within the slices
+# first..last: Loop starts over after the last slice, Bounce plays back and forth, and Once returns None at the end
+def cine_index(position, first, last, mode='Loop'):
+    count = last - first + 1
+    if mode == 'Bounce' and count > 1:
+        position %= 2 * count - 2
+        return first + (position if position < count else 2 * count - 2 - position)
+    if mode == 'Once':
+        return first + position if position < count else None
+    return first + position % count
+
+# Frames of the cine mode rendered ahead of playback on a worker thread. render(slice_index) runs on the
+# worker for the upcoming playback positions (slice_at(position), None after the end); at most capacity
+# frames are kept, oldest first. take() hands the frame of a position to the GUI and drops the frames of
+# positions that playback skipped; the worker skips them too instead of rendering frames that are late.
+class CineBuffer:
+
+    def __init__(self, render, slice_at, capacity=16, start=0):
+        self.render = render
+        self.slice_at = slice_at
+        self.capacity = capacity
+        self.frames = deque()
+        self.next_position = start
+        self.played = start - 1
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name='cine', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and len(self.frames) >= self.capacity:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                position = self.next_position
+                self.next_position += 1
+            slice_index = self.slice_at(position)
+            if slice_index is None:
+                return
+            frame = self.render(slice_index)
+            with self.condition:
+                if self.stopped:
+                    return
+                # Playback may have passed this position while it was rendered
+                if position > self.played:
+                    self.frames.append((position, frame))
+
+    # Function to get the frame of a playback position, or None when it is not rendered yet
+    def take(self, position):
+        with self.condition:
+            while self.frames and self.frames[0][0] < position:
+                self.frames.popleft()
+            frame = None
+            if self.frames and self.frames[0][0] == position:
+                frame = self.frames.popleft()[1]
+            self.played = max(self.played, position)
+            self.next_position = max(self.next_position, position + 1)
+            self.condition.notify_all()
+            return frame
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.frames.clear()
+            self.condition.notify_all()
+
+# Function to compute the intensity histogram of a volume a few slices at a time, without copying it.
+# With a mask volume only voxels whose label is mask_label are counted (mask_label=None: any label).
+# Integer volumes of up to 16 bits get one exact bin per value; other dtypes get 4096 bins.
+def intensity_histogram(volume, mask_volume=None, mask_label=None, chunk_voxels=2**22, float_bins=4096):
+    step = max(1, chunk_voxels // max(1, volume[0].size))
+
+    def chunks():
+        for start in range(0, volume.shape[0], step):
+            chunk = np.asarray(volume[start:start + step])
+            if mask_volume is None:
+                yield chunk.ravel()
+                continue
+            mask_chunk = np.asarray(mask_volume[start:start + step])
+            yield chunk[mask_chunk > 0] if mask_label is None else chunk[mask_chunk == mask_label]
+
+    dtype = volume.dtype
+    if dtype.kind in 'iu' and dtype.itemsize <= 2:
+        info = np.iinfo(dtype)
+        counts = np.zeros(info.max - info.min + 1, dtype=np.int64)
+        for chunk in chunks():
+            counts += np.bincount(chunk.astype(np.int32) - info.min, minlength=len(counts))
+        values = np.arange(info.min, info.max + 1, dtype=np.float64)
+    else:
+        # Floating point: a first pass for the range, a second one for the counts
+        low, high = np.inf, -np.inf
+        for chunk in chunks():
+            if chunk.size:
+                low, high = min(low, float(chunk.min())), max(high, float(chunk.max()))
+        if low > high:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        edges = np.linspace(low, high if high > low else low + 1, float_bins + 1)
+        counts = np.zeros(float_bins, dtype=np.int64)
+        for chunk in chunks():
+            counts += np.histogram(chunk, bins=edges)[0]
+        values = (edges[:-1] + edges[1:]) / 2
+
+    # Trim to the range of values that actually occur
+    occupied = np.flatnonzero(counts)
+    if len(occupied) == 0:
+        return counts[:0], values[:0]
+    return counts[occupied[0]:occupied[-1] + 1], values[occupied[0]:occupied[-1] + 1]
+
+# Function to derive statistics from a histogram; percentiles interpolate linearly like np.percentile
+def histogram_statistics(counts, values, percentiles=(1, 5, 25, 50, 75, 95, 99)):
+    total = int(counts.sum())
+    if total == 0:
+        return None
+    mean = float((counts * values).sum() / total)
+    std = float(np.sqrt((counts * (values - mean) ** 2).sum() / total))
+    cumulative = np.cumsum(counts)
+
+    def percentile(q):
+        rank = q / 100 * (total - 1)
+        lower = values[np.searchsorted(cumulative, np.floor(rank), side='right')]
+        upper = values[np.searchsorted(cumulative, np.ceil(rank), side='right')]
+        return float(lower + (upper - lower) * (rank - np.floor(rank)))
+
+    return {
+        'count': total,
+        'mean': mean,
+        'std': std,
+        'min': float(values[0]),
+        'max': float(values[-1]),
+        'median': percentile(50),
+        'percentiles': {q: percentile(q) for q in percentiles},
+    }
+
+# Function to read the voxel size in mm of a NIfTI file from its header, along the axes of the loaded (reoriented) volume
+def volume_spacing(file_path):
+    import nibabel as nib
+    return canonical_orientation(nib.load(file_path))[1]
+
+# Function to count the ground truth, predicted and overlapping voxels of each label per slice along each axis,
+# in one pass over a few slices at a time. Returns {name: [per-axis (labels, slices) arrays]}.
+def overlap_counts(ground_truth, predicted, labels, chunk_voxels=2**22):
+    shape = ground_truth.shape
+    counts = {name: [np.zeros((len(labels), shape[axis]), dtype=np.int64) for axis in range(3)]
+              for name in ('intersection', 'ground_truth', 'predicted')}
+    step = max(1, chunk_voxels // max(1, ground_truth[0].size))
+    for start in range(0, shape[0], step):
+        ground_truth_chunk = np.asarray(ground_truth[start:start + step])
+        predicted_chunk = np.asarray(predicted[start:start + step])
+        stop = start + ground_truth_chunk.shape[0]
+        for row, label in enumerate(labels):
+            masks = {'ground_truth': ground_truth_chunk == label, 'predicted': predicted_chunk == label}
+            masks['intersection'] = masks['ground_truth'] & masks['predicted']
+            for name, mask in masks.items():
+                plane = mask.sum(axis=0, dtype=np.int64)
+                counts[name][0][row, start:stop] = mask.sum(axis=(1, 2))
+                counts[name][1][row] += plane.sum(axis=1)
+                counts[name][2][row] += plane.sum(axis=0)
+    return counts
+
+# Function to compute the 95th percentile Hausdorff distance and the average symmetric surface distance
+# in mm between two binary masks. Needs scipy; returns (None, None) without it.
+def surface_distances(ground_truth_mask, predicted_mask, spacing):
+    try:
+        from scipy import ndimage
+    except ImportError:
+        return None, None
+    structure = ndimage.generate_binary_structure(3, 1)
+    surfaces = [mask & ~ndimage.binary_erosion(mask, structure) for mask in (ground_truth_mask, predicted_mask)]
+    to_ground_truth = ndimage.distance_transform_edt(~surfaces[0], sampling=spacing)[surfaces[1]]
+    to_prediction = ndimage.distance_transform_edt(~surfaces[1], sampling=spacing)[surfaces[0]]
+    hd95 = max(np.percentile(to_ground_truth, 95), np.percentile(to_prediction, 95))
+    assd = (to_ground_truth.sum() + to_prediction.sum()) / (to_ground_truth.size + to_prediction.size)
+    return float(hd95), float(assd)
+
+# Function to compute per-label Dice, IoU, volumes (mL) and, with surface=True, HD95 and ASSD (mm) of a
+# prediction against the ground truth, plus the per-slice overlap counts used for per-slice Dice.
+# Surface distances are computed on the bounding box of each label only. NaN marks undefined values.
+def segmentation_metrics(ground_truth, predicted, labels, spacing=(1.0, 1.0, 1.0), surface=True, chunk_voxels=2**22, timings=None):
+    timings = {} if timings is None else timings
+    labels = list(labels)
+    start = time.perf_counter()
+    counts = overlap_counts(ground_truth, predicted, labels, chunk_voxels)
+    timings['overlap'] = timings.get('overlap', 0.0) + time.perf_counter() - start
+    voxel_volume = float(np.prod(spacing)) / 1000
+    label_metrics = {}
+    for row, label in enumerate(labels):
+        intersection, ground_truth_voxels, predicted_voxels = (int(counts[name][0][row].sum()) for name in ('intersection', 'ground_truth', 'predicted'))
+        union = ground_truth_voxels + predicted_voxels - intersection
+        metrics = {
+            'dice': 2 * intersection / (ground_truth_voxels + predicted_voxels) if union else float('nan'),
+            'iou': intersection / union if union else float('nan'),
+            'ground_truth_volume': ground_truth_voxels * voxel_volume,
+            'predicted_volume': predicted_voxels * voxel_volume,
+            'volume_difference': (predicted_voxels - ground_truth_voxels) * voxel_volume,
+            'hd95': float('nan'),
+            'assd': float('nan'),
+        }
+        if surface and ground_truth_voxels and predicted_voxels:
+            present = [np.flatnonzero(counts['ground_truth'][axis][row] + counts['predicted'][axis][row]) for axis in range(3)]
+            bounds = tuple(slice(max(int(indices[0]) - 1, 0), int(indices[-1]) + 2) for indices in present)
+            start = time.perf_counter()
+            hd95, assd = surface_distances(np.asarray(ground_truth[bounds]) == label, np.asarray(predicted[bounds]) == label, spacing)
+            timings['surface'] = timings.get('surface', 0.0) + time.perf_counter() - start
+            if hd95 is not None:
+                metrics['hd95'], metrics['assd'] = hd95, assd
+        label_metrics[label] = metrics
+    return {
+        'labels': labels,
+        'metrics': label_metrics,
+        'slice_intersection': counts['intersection'],
+        'slice_total': [counts['ground_truth'][axis] + counts['predicted'][axis] for axis in range(3)],
+    }
+
+# Function to get the per-slice Dice along an axis over the given labels (NaN where none of them is present)
+def slice_dice(subject_metrics, labels, axis):
+    rows = [row for row, label in enumerate(subject_metrics['labels']) if label in labels]
+    intersection = subject_metrics['slice_intersection'][axis][rows].sum(axis=0)
+    total = subject_metrics['slice_total'][axis][rows].sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, 2 * intersection / total, np.nan)
+
+# On-disk cache of segmentation metrics, one .npz file per ground truth / prediction pair.
+# Entries are keyed by both paths, sizes and mtimes, so a new prediction is evaluated again.
+class MetricsCache:
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+
+    def entry_path(self, ground_truth_path, predicted_path, labels, surface):
+        key = [repr(list(labels)), str(surface)]
+        for path in (ground_truth_path, predicted_path):
+            stat = os.stat(path)
+            key.append(f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}')
+        return os.path.join(self.cache_dir, f"metrics-{hashlib.sha1('|'.join(key).encode()).hexdigest()[:20]}.npz")
+
+    def load(self, ground_truth_path, predicted_path, labels, surface=True):
+        try:
+            with np.load(self.entry_path(ground_truth_path, predicted_path, labels, surface)) as entry:
+                label_metrics = {int(label): metrics for label, metrics in json.loads(str(entry['metrics'])).items()}
+                return {
+                    'labels': entry['labels'].tolist(),
+                    'metrics': label_metrics,
+                    'slice_intersection': [entry[f'slice_intersection{axis}'] for axis in range(3)],
+                    'slice_total': [entry[f'slice_total{axis}'] for axis in range(3)],
+                }
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def store(self, ground_truth_path, predicted_path, labels, surface, subject_metrics):
+        path = self.entry_path(ground_truth_path, predicted_path, labels, surface)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        arrays = {f'{name}{axis}': subject_metrics[name][axis] for name in ('slice_intersection', 'slice_total') for axis in range(3)}
+        temporary_path = f'{path[:-len(".npz")]}.tmp{os.getpid()}-{threading.get_ident()}.npz'
+        np.savez(temporary_path, labels=np.array(subject_metrics['labels'], dtype=np.int64),
+                 metrics=np.array(json.dumps(subject_metrics['metrics'])), **arrays)
+        os.replace(temporary_path, path)
+
+# Function to get the metrics of a loaded subject from the metrics cache, computing and storing them on a miss
+def subject_metrics(ground_truth, predicted, labels, ground_truth_path, predicted_path, metrics_cache=None, surface=True):
+    if metrics_cache is not None:
+        cached = metrics_cache.load(ground_truth_path, predicted_path, labels, surface)
+        if cached is not None:
+            return cached
+    result = segmentation_metrics(ground_truth, predicted, labels, volume_spacing(ground_truth_path), surface)
+    if metrics_cache is not None:
+        try:
+            metrics_cache.store(ground_truth_path, predicted_path, labels, surface, result)
+        except OSError as e:
+            print(f"Could not write the metrics cache: {e}")
+    return result
+
+# Function to decode every volume of the given folders into the disk cache, e.g. overnight:
+#   python viewer.py warm-cache CT Ground_truth Predicted --max-size-gb 200
+def warm_cache_command(args):
+    parser = argparse.ArgumentParser(prog='viewer.py warm-cache', description='Pre-convert .nii/.nii.gz volumes into the disk cache.')
+    parser.add_argument('folders', nargs='*', default=required_folders, help='folders to scan (default: CT Ground_truth Predicted)')
+    parser.add_argument('--cache-dir', default=None, help='cache location (default: $CT_VIEWER_CACHE or ~/.cache/3d-ct-scan-viewer)')
+    parser.add_argument('--max-size-gb', type=float, default=20, help='cache size cap in GB (default: 20)')
+    parser.add_argument('--backend', default='zlib', choices=available_gzip_backends(), help='gzip decompression backend')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of volumes decoded at once')
+    options = parser.parse_args(args)
+
+    volume_cache = VolumeCache(options.cache_dir, options.max_size_gb)
+    paths = sorted(os.path.join(folder, name) for folder in options.folders if os.path.isdir(folder)
+                   for name in os.listdir(folder) if name.endswith(('.nii.gz', '.nii')))
+
+    def warm(path):
+        if volume_cache.load(path) is not None:
+            return 'cached'
+        volume_cache.store(path, load_nii(path, backend=options.backend))
+        return 'converted'
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.workers) as executor:
+        for count, (path, result) in enumerate(zip(paths, executor.map(warm, paths)), 1):
+            print(f"[{count}/{len(paths)}] {path}: {result}")
+    print(f"Warmed {len(paths)} volumes in {time.perf_counter() - start:.1f}s into {volume_cache.volumes_dir}")
+    return 0
+
+# Function to scan the dataset, report missing volumes and optionally write a manifest, e.g.
+#   python viewer.py index --output manifest.csv   (then: python viewer.py --manifest manifest.csv)
+def index_command(args):
+    parser = argparse.ArgumentParser(prog='viewer.py index', description='Index the subjects of a dataset and write a manifest.')
+    parser.add_argument('--root', default='.', help='folder with the CT, Ground_truth and Predicted folders (default: .)')
+    parser.add_argument('--manifest', help='read this manifest instead of scanning, e.g. to check it')
+    parser.add_argument('--output', help='write the index as a manifest (.csv or .json); paths are stored relative to it')
+    options = parser.parse_args(args)
+
+    start = time.perf_counter()
+    index = DatasetIndex(options.root, options.manifest)
+    print(f"Indexed {len(index)} subjects in {time.perf_counter() - start:.2f}s")
+    for folder, column in DatasetIndex.manifest_columns.items():
+        missing = [name for name in index.subjects if index.volume_path(name, folder) is None]
+        if missing:
+            print(f"  missing {column}: {len(missing)} ({', '.join(missing[:5])}{', ...' if len(missing) > 5 else ''})")
+
+    if options.output:
+        base = os.path.dirname(os.path.abspath(options.output))
+        rows = [dict(subject=name, **{column: os.path.relpath(index.volume_path(name, folder), base) if index.volume_path(name, folder) else ''
+                                      for folder, column in DatasetIndex.manifest_columns.items()})
+                for name in index.subjects]
+        with open(options.output, 'w', newline='') as f:
+            if options.output.endswith('.json'):
+                json.dump(rows, f, indent=1)
+            else:
+                writer = csv.DictWriter(f, fieldnames=['subject', *DatasetIndex.manifest_columns.values()])
+                writer.writeheader()
+                writer.writerows(rows)
+        print(f"Wrote {options.output}")
+    return 0
+
+# Function to keep label volumes in the smallest unsigned integer type that holds their labels
+def compact_labels(volume):
+    if volume.dtype in (np.uint8, np.uint16):
+        return volume
+    low, high = volume.min(), volume.max()
+    if low < 0 or high >= 2**16:
+        return volume
+    return volume.astype(np.uint8 if high < 2**8 else np.uint16)
+
+# Function to estimate the peak memory of evaluating a subject from the header of its ground truth:
+# both label volumes as stored and compacted, plus the masks and distance maps of the surface distances
+def evaluation_bytes(ground_truth_path, surface=True):
+    import nibabel as nib
+    header = nib.load(ground_truth_path).header
+    voxels = int(np.prod(header.get_data_shape()[:3]))
+    return voxels * (4 * header.get_data_dtype().itemsize + (20 if surface else 2))
+
+evaluation_columns = ['subject', 'label', 'name', 'dice', 'iou', 'hd95', 'assd', 'ground_truth_volume', 'predicted_volume', 'volume_difference']
+
+# Function to evaluate one subject from its label volumes only (runs in a worker process)
+def evaluate_subject(subject_name, options):
+    index = dataset_index(options.manifest)
+    timings = {}
+    volumes = []
+    paths = [index.volume_path(subject_name, folder) for folder in ('Ground_truth', 'Predicted')]
+    for path in paths:
+        load_timings = {}
+        volume = load_nii(path, backend=options.backend, timings=load_timings)
+        for stage, seconds in load_timings.items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+        start = time.perf_counter()
+        volumes.append(compact_labels(volume))
+        timings['compact'] = timings.get('compact', 0.0) + time.perf_counter() - start
+    ground_truth, predicted = volumes
+    if ground_truth.shape != predicted.shape:
+        raise ValueError(f"ground truth {ground_truth.shape} and prediction {predicted.shape} dimensions do not match")
+
+    start = time.perf_counter()
+    labels = options.labels or discover_labels(ground_truth, predicted)
+    timings['labels'] = time.perf_counter() - start
+    result = segmentation_metrics(ground_truth, predicted, labels, volume_spacing(paths[0]), not options.no_surface, timings=timings)
+
+    rows = []
+    for label in labels:
+        metrics = result['metrics'][label]
+        if metrics['ground_truth_volume'] == 0 and metrics['predicted_volume'] == 0:
+            continue
+        name = options.label_names.get(label, '')
+        rows.append([subject_name, label, name] + [metrics[column] for column in evaluation_columns[3:]])
+    return subject_name, rows, timings
+
+# Function to get the file listing the evaluated subjects next to a results CSV. Subjects without labelled voxels
+# write no rows, so the CSV alone would not show that they are done.
+def evaluated_list_path(csv_path):
+    return f'{csv_path}.done'
+
+# Function to read the subjects already evaluated into a results CSV, to resume an interrupted evaluation
+def evaluated_subjects(csv_path):
+    subjects = set()
+    if os.path.exists(csv_path):
+        with open(csv_path, newline='') as f:
+            subjects.update(row['subject'] for row in csv.DictReader(f))
+    if os.path.exists(evaluated_list_path(csv_path)):
+        with open(evaluated_list_path(csv_path)) as f:
+            subjects.update(line.strip() for line in f if line.strip())
+    return subjects
+
+# Non-interactive evaluation of every prediction against its ground truth, e.g.
+#   python viewer.py evaluate --output results.csv --workers 16 --memory-gb 32
+# Rows are appended as subjects finish; running the command again resumes where it stopped.
+def evaluate_command(args):
+    parser = argparse.ArgumentParser(prog='viewer.py evaluate', description='Compute per-subject, per-label segmentation metrics for a whole dataset.')
+    parser.add_argument('subjects', nargs='*', default=['*'], help='subject names or glob patterns (default: every subject with a ground truth and a prediction)')
+    parser.add_argument('--manifest', help='dataset manifest (.csv or .json) to use instead of scanning the folders')
+    parser.add_argument('--output', default='metrics.csv', help='results file, .csv or .parquet (needs pyarrow; written from a .csv log next to it)')
+    parser.add_argument('--labels', nargs='+', type=int, help='labels to evaluate (default: labels.txt, else the labels found in each subject)')
+    parser.add_argument('--no-surface', action='store_true', help='skip HD95 and ASSD (much faster)')
+    parser.add_argument('--overwrite', action='store_true', help='start over instead of resuming from the existing output')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes (default: all cores)')
+    parser.add_argument('--memory-gb', type=float, help='memory budget; limits the number of workers from the size of the volumes')
+    parser.add_argument('--backend', default='zlib', choices=available_gzip_backends(), help='gzip decompression backend')
+    options = parser.parse_args(args)
+
+    parquet = options.output.endswith('.parquet')
+    if parquet:
+        try:
+            import pyarrow.csv
+            import pyarrow.parquet
+        except ImportError:
+            parser.error('Parquet output needs pyarrow (pip install pyarrow)')
+    csv_path = f'{options.output}.csv' if parquet else options.output
+    color_table = read_color_table('labels.txt') if os.path.exists('labels.txt') else {}
+    options.label_names = {label: name for label, (name, _) in color_table.items()}
+    if options.labels is None and color_table:
+        options.labels = list(color_table)
+
+    index = dataset_index(options.manifest)
+    available = [name for name in index.subjects if all(index.volume_path(name, folder) for folder in ('Ground_truth', 'Predicted'))]
+    missing = []
+    subjects = expand_subjects(options.subjects, available, missing)
+    for subject_name in missing:
+        if subject_name not in index.subjects:
+            print(f"{subject_name}: not in the dataset, skipped")
+        else:
+            volumes = [folder for folder in ('Ground_truth', 'Predicted') if not index.volume_path(subject_name, folder)]
+            print(f"{subject_name}: no {' or '.join(volumes)} volume, skipped")
+    if options.overwrite:
+        for path in (csv_path, evaluated_list_path(csv_path)):
+            if os.path.exists(path):
+                os.remove(path)
+    done = evaluated_subjects(csv_path)
+    pending = [name for name in subjects if name not in done]
+    print(f"{len(subjects)} subjects, {len(subjects) - len(pending)} already in {csv_path}, {len(pending)} to evaluate")
+
+    workers = max(1, options.workers)
+    if options.memory_gb and pending:
+        subject_bytes = evaluation_bytes(index.volume_path(pending[0], 'Ground_truth'), not options.no_surface)
+        workers = max(1, min(workers, int(options.memory_gb * 2**30 // subject_bytes)))
+        print(f"~{subject_bytes / 2**20:.0f} MB per subject: {workers} workers within {options.memory_gb:g} GB")
+
+    start = time.perf_counter()
+    stage_totals = {}
+    evaluated = 0
+    new_file = not os.path.exists(csv_path)
+    with open(csv_path, 'a', newline='') as f, open(evaluated_list_path(csv_path), 'a') as done_file:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(evaluation_columns)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(evaluate_subject, subject_name, options): subject_name for subject_name in pending}
+            for count, future in enumerate(as_completed(futures), 1):
+                try:
+                    subject_name, rows, timings = future.result()
+                except Exception as e:
+                    print(f"[{count}/{len(pending)}] {futures[future]}: failed: {e}")
+                    continue
+                writer.writerows(rows)
+                f.flush()
+                done_file.write(f'{subject_name}\n')
+                done_file.flush()
+                evaluated += 1
+                for stage, seconds in timings.items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+                dice = ', '.join(f"{row[1]}: {row[3]:.3f}" for row in rows)
+                print(f"[{count}/{len(pending)}] {subject_name}: {sum(timings.values()):.1f}s, Dice {dice or '-'}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Evaluated {evaluated} subjects in {elapsed:.1f}s with {workers} workers: "
+          f"{evaluated / elapsed * 60 if elapsed > 0 else 0:.1f} subjects/min")
+    total = sum(stage_totals.values())
+    for stage, seconds in sorted(stage_totals.items(), key=lambda item: -item[1]):
+        print(f"  {stage:<11}{seconds:9.1f}s  {seconds / total * 100 if total else 0:5.1f}%  {seconds / max(evaluated, 1):.3f}s/subject")
+
+    if parquet:
+        pyarrow.parquet.write_table(pyarrow.csv.read_csv(csv_path), options.output)
+        print(f"Wrote {options.output}")
+    return 0
@@ -0,0 +1,1808 @@
+# Qt user interface of the 3D CT Scan Viewer, on top of ct_core and ct_render
+import os
+import time
+import cProfile
+import pstats
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PyQt5.QtWidgets import (QApplication, QAbstractItemView, QListWidget, QListWidgetItem, QGroupBox, QCheckBox, QComboBox, QMainWindow, QVBoxLayout, QHBoxLayout, QPushButton, QSlider, QWidget, QLineEdit, QLabel, QRadioButton, QButtonGroup, QDialog)
+from PyQt5.QtCore import Qt, QTimer, QThread, QRectF, QSize, pyqtSignal
+from PyQt5.QtGui import QColor, QIcon, QImage, QIntValidator, QDoubleValidator, QPainter, QPen, QPixmap, QPolygonF
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+from matplotlib.transforms import Bbox
+from ct_core import (CineBuffer, DatasetIndex, FrameCache, LoadCancelled, MetricsCache, SubjectCache, VolumeCache, available_gzip_backends, build_axis_copy, build_pyramid, default_cache_dir,
+                     cine_index, cine_modes, color_map, composite_overlay, default_label_color, display_aspect, display_position, display_slice, histogram_statistics, intensity_histogram,
+                     max_intensity, min_intensity, overlay_lut, profiler, pyramid_level, read_color_table, slice_dice, slice_errors, slices_contiguous, subject_metrics, subject_volumes,
+                     view_axes, voxel_at, window_ct_slice, window_presets)
+from ct_render import SlicePanels, panel_titles
+
+# Worker thread that loads one subject through the cache without blocking the GUI.
+# The CT is handed over as soon as it is decoded, before the label volumes.
+class SubjectLoader(QThread):
+    volume_loaded = pyqtSignal(str, object)
+    progress_changed = pyqtSignal(str, int)
+    loaded = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, subject_name, subject_cache, parent=None):
+        super().__init__(parent)
+        self.subject_name = subject_name
+        self.subject_cache = subject_cache
+        self.cancel_event = threading.Event()
+        self.percentages = {}
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def report_progress(self, kind, fraction):
+        if self.cancel_event.is_set():
+            raise LoadCancelled(self.subject_name)
+        percentage = int(fraction * 100)
+        if self.percentages.get(kind) != percentage:
+            self.percentages[kind] = percentage
+            self.progress_changed.emit(kind, percentage)
+
+    def run(self):
+        try:
+            volumes, stats = self.subject_cache.get(self.subject_name, self.volume_loaded.emit, self.report_progress, self.cancel_event)
+            if not self.cancel_event.is_set():
+                self.loaded.emit(volumes, stats)
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(str(e))
+
+# Stages broken down in the HUD, in ms
+hud_stages = ['slice', 'composite', 'contour', 'draw']
+
+# Memory for the frames the cine mode renders ahead, and the fewest and most slices it holds
+cine_buffer_bytes = 64 * 2**20
+cine_buffer_slices = (2, 64)
+
+# Function to summarize the frames per second, measured over the last draws of a canvas (frame_times),
+# the frame time and the time per stage (means of the profiler timers) for the HUD
+def hud_summary(frame_times):
+    elapsed = frame_times[-1] - frame_times[0]
+    fps = (len(frame_times) - 1) / elapsed if elapsed > 0 else 0.0
+    parts = [f'{fps:.1f} FPS']
+    update, draw = profiler.mean_ms('update'), profiler.mean_ms('draw')
+    if update is not None and draw is not None:
+        parts.append(f'frame {update + draw:.1f} ms')
+    stages = [(stage, profiler.mean_ms(stage)) for stage in hud_stages]
+    parts.append(' '.join(f'{stage} {ms:.1f}' for stage, ms in stages if ms is not None))
+    return ' | '.join(part for part in parts if part)
+
+class MplCanvas(SlicePanels, FigureCanvas):
+    
+    def __init__(self, parent=None, width=10, height=5, dpi=100):
+        fig = Figure(figsize=(width, height), dpi=dpi, facecolor='black')
+        super(MplCanvas, self).__init__(fig)
+        self.setup_panels(fig)
+
+        # HUD with the frames per second, the frame time and the time per stage, see hud_summary()
+        # It is drawn over a saved background strip, so that it can be updated without drawing the figure
+        self.show_hud = False
+        self.frame_times = deque(maxlen=30)
+        self.hud_text = fig.text(0.005, 0.01, '', color='yellow', fontsize=9, ha='left', va='bottom', animated=True)
+        self.hud_background = None
+        self.mpl_connect('draw_event', self.on_draw)
+
+    def draw(self):
+        self.frame_times.append(time.perf_counter())
+        with profiler.timer('draw'):
+            super(MplCanvas, self).draw()
+
+    def on_draw(self, event):
+        # After a full draw: save the background of the HUD strip at the bottom and draw the HUD on it
+        height = 2.5 * self.hud_text.get_fontsize() * self.figure.dpi / 72
+        self.hud_bbox = Bbox.from_bounds(0, 0, self.figure.bbox.width, height)
+        self.hud_background = self.copy_from_bbox(self.hud_bbox)
+        self.draw_hud()
+
+    def draw_hud(self):
+        self.hud_text.set_text(hud_summary(self.frame_times) if self.show_hud and len(self.frame_times) > 1 else '')
+        self.restore_region(self.hud_background)
+        self.figure.draw_artist(self.hud_text)
+
+    # Only the panels whose image or contours changed are drawn again when nothing else changed. Images fill
+    # their axes and are opaque, so they are drawn over the previous frame, followed by their contours.
+    def request_draw(self):
+        panels, self.dirty_panels = self.dirty_panels, set()
+        if self.full_draw_needed or self.hud_background is None:
+            self.full_draw_needed = False
+            self.draw_idle()
+        elif panels:
+            self.redraw_panels(panels)
+
+    def redraw_panels(self, panels):
+        self.frame_times.append(time.perf_counter())
+        with profiler.timer('draw'):
+            for index in sorted(panels):
+                axes = self.panels[index]
+                if not axes.get_visible():
+                    continue
+                axes.draw_artist(self.images[index])
+                for collection in self.contour_collections[index].values():
+                    if collection.get_visible():
+                        axes.draw_artist(collection)
+                self.blit(axes.bbox)
+            self.draw_hud()
+            self.blit(self.hud_bbox)
+
+# Function to convert a contour line ((x, y) rows) to a polygon, written through its buffer instead of point by point
+def line_polygon(line):
+    polygon = QPolygonF(len(line))
+    buffer = polygon.data()
+    buffer.setsize(len(line) * 16)
+    np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = line
+    return polygon
+
+# The slice panels painted by Qt without Matplotlib (viewer.py --display raster). The composited uint8 frames
+# of SlicePanels are wrapped in QImages that share their memory and scaled into the panels by QPainter, so a
+# frame is not rasterized by Agg and copied into Qt. Titles, contours and the HUD are painted the same way.
+class RasterSliceCanvas(SlicePanels, QWidget):
+
+    def __init__(self, parent=None, width=10, height=5, dpi=100):
+        super(RasterSliceCanvas, self).__init__(parent)
+        # Same initial size as the Matplotlib canvas
+        self.initial_size = QSize(int(width * dpi), int(height * dpi))
+        self.setup_frames()
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        # The arrays behind the QImages, which do not own their pixels, and how each panel is drawn
+        self.frames = [None, None, None, None]
+        self.qimages = [None, None, None, None]
+        self.aspects = [1.0, 1.0, 1.0, 1.0]
+        self.panel_lines = [{}, {}, {}, {}]
+        self.line_widths = [1.0, 1.0, 1.0, 1.0]
+        self.titles = list(panel_titles)
+        self.panel_visible = [True, True, True]
+        self.show_hud = False
+        self.frame_times = deque(maxlen=30)
+
+    def sizeHint(self):
+        return self.initial_size
+
+    def draw_idle(self):
+        self.update()
+
+    def text_height(self):
+        return self.fontMetrics().height() + 6
+
+    # Function to get the area of a panel below its title; the HUD has a strip at the bottom
+    def panel_rect(self, index):
+        columns = 4 if self.show_errors else 3
+        width = self.width() / columns
+        return QRectF(index * width + 4, self.text_height(), width - 8, self.height() - 2 * self.text_height())
+
+    # Function to get where the image of a panel goes: the full resolution slice with its voxel aspect, centered
+    def image_rect(self, index):
+        rect = self.panel_rect(index)
+        if self.image_shapes[index] is None:
+            return rect
+        rows, columns = self.image_shapes[index]
+        height = rows * self.aspects[index]
+        scale = min(rect.width() / columns, rect.height() / height)
+        return QRectF(rect.center().x() - columns * scale / 2, rect.center().y() - height * scale / 2, columns * scale, height * scale)
+
+    def hud_rect(self):
+        return QRectF(0, self.height() - self.text_height(), self.width(), self.text_height())
+
+    def panel_size(self):
+        rect = self.image_rect(0)
+        return max(int(rect.height()), 1), max(int(rect.width()), 1)
+
+    def set_panel_image(self, index, data, aspect=1.0, shape=None, **kwargs):
+        if data is None:
+            if self.qimages[index] is not None:
+                self.frames[index] = self.qimages[index] = self.panel_frames[index] = None
+                self.full_draw_needed = True
+            return None
+        shape = data.shape[:2] if shape is None else tuple(shape)
+        if self.qimages[index] is None or self.image_shapes[index] != shape or self.aspects[index] != aspect:
+            self.full_draw_needed = True
+        elif data is self.panel_frames[index]:
+            return self.qimages[index]
+        self.panel_frames[index] = data
+        data = np.ascontiguousarray(data)
+        image_format = QImage.Format_Grayscale8 if data.ndim == 2 else QImage.Format_RGBA8888
+        self.frames[index] = data
+        self.qimages[index] = QImage(data.data, data.shape[1], data.shape[0], data.strides[0], image_format)
+        self.image_shapes[index] = shape
+        self.aspects[index] = aspect
+        self.dirty_panels.add(index)
+        return self.qimages[index]
+
+    def set_panel_contours(self, index, label_lines, line_width):
+        if label_lines or self.panel_lines[index]:
+            self.dirty_panels.add(index)
+        self.panel_lines[index] = label_lines
+        self.line_widths[index] = line_width
+
+    def set_error_panel(self, show_errors):
+        if show_errors != self.show_errors:
+            self.show_errors = show_errors
+            self.full_draw_needed = True
+
+    def set_panel_title(self, index, title):
+        self.titles[index] = title
+
+    def set_axes_visibility(self, show_ground_truth, show_prediction):
+        if self.panel_visible[1:] != [show_ground_truth, show_prediction]:
+            self.panel_visible[1:] = [show_ground_truth, show_prediction]
+            self.full_draw_needed = True
+
+    # Only the images of the changed panels and the HUD are painted again when nothing else changed
+    def request_draw(self):
+        panels, self.dirty_panels = self.dirty_panels, set()
+        if self.full_draw_needed:
+            self.full_draw_needed = False
+            self.update()
+        elif panels:
+            for index in panels:
+                self.update(self.image_rect(index).toAlignedRect())
+            self.update(self.hud_rect().toAlignedRect())
+
+    def paintEvent(self, event):
+        self.frame_times.append(time.perf_counter())
+        with profiler.timer('draw'):
+            painter = QPainter(self)
+            painter.fillRect(event.rect(), Qt.black)
+            area = QRectF(event.rect())
+            for index in range(4 if self.show_errors else 3):
+                if index < 3 and not self.panel_visible[index]:
+                    continue
+                rect = self.image_rect(index)
+                if rect.intersects(area):
+                    self.paint_panel(painter, index, rect)
+                panel_rect = self.panel_rect(index)
+                title_rect = QRectF(panel_rect.x(), 0, panel_rect.width(), self.text_height())
+                if title_rect.intersects(area):
+                    painter.setPen(Qt.white)
+                    painter.drawText(title_rect, Qt.AlignCenter, self.titles[index])
+            if self.show_hud and len(self.frame_times) > 1:
+                painter.setPen(QColor('yellow'))
+                painter.drawText(self.hud_rect().adjusted(4, 0, 0, 0), Qt.AlignLeft | Qt.AlignVCenter, hud_summary(self.frame_times))
+            painter.end()
+
+    def paint_panel(self, painter, index, rect):
+        image = self.qimages[index]
+        if image is None:
+            painter.setPen(Qt.white)
+            painter.drawText(rect, Qt.AlignCenter, 'No Image')
+            return
+        # Nearest neighbour when zooming in, like the Matplotlib panels; smoothed when a large slice is shrunk
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, rect.width() < image.width())
+        painter.drawImage(rect, image)
+        if not self.panel_lines[index]:
+            return
+        # Contours are in voxel coordinates of the full resolution slice, voxel centers at whole numbers
+        rows, columns = self.image_shapes[index]
+        painter.save()
+        painter.setClipRect(rect)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.translate(rect.x(), rect.y())
+        painter.scale(rect.width() / columns, rect.height() / rows)
+        painter.translate(0.5, 0.5)
+        for lines, color in self.panel_lines[index].values():
+            pen = QPen(QColor.fromRgbF(*color[:3]))
+            # Line widths are in points, as in Matplotlib
+            pen.setWidthF(self.line_widths[index] * self.logicalDpiX() / 72)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            for line in lines:
+                painter.drawPolyline(line_polygon(line))
+        painter.restore()
+
+# Axial, coronal and sagittal panes through a 3D crosshair. Clicking or dragging in a pane moves the
+# crosshair (crosshair_moved). Images and crosshair lines are blitted over cached pane backgrounds,
+# so only panes whose slice changed are composited and redrawn; the others just move their lines.
+class TriPlanarCanvas(FigureCanvas):
+    crosshair_moved = pyqtSignal(object)
+
+    def __init__(self, parent=None, width=10, height=5, dpi=100):
+        fig = Figure(figsize=(width, height), dpi=dpi, facecolor='black')
+        super(TriPlanarCanvas, self).__init__(fig)
+        self.views = ['axial', 'coronal', 'sagittal']
+        self.panes = [fig.add_subplot(1, 3, pane + 1) for pane in range(3)]
+        self.images = [None, None, None]
+        self.crosshair_lines = []
+        for axes, view in zip(self.panes, self.views):
+            axes.set_title(view.capitalize(), color='white')
+            axes.axis('off')
+            lines = (axes.axhline(0, color='yellow', linewidth=0.8, animated=True),
+                     axes.axvline(0, color='yellow', linewidth=0.8, animated=True))
+            self.crosshair_lines.append(lines)
+
+        # What each pane shows: the (slice, window, overlay) of its image and the crosshair position
+        self.pane_keys = [None, None, None]
+        self.pane_positions = [None, None, None]
+        # Pane backgrounds without and with the current image, captured after each full draw
+        self.backgrounds = [None, None, None]
+        self.image_backgrounds = [None, None, None]
+        self.frame_cache = FrameCache()
+        self.compositing_buffers = {}
+        self.volumes = (None, None)
+        self.mpl_connect('draw_event', self.on_draw)
+        self.mpl_connect('button_press_event', self.on_mouse)
+        self.mpl_connect('motion_notify_event', self.on_mouse)
+
+    def set_volumes(self, ct_scan, label_volume):
+        if ct_scan is self.volumes[0] and label_volume is self.volumes[1]:
+            return
+        self.volumes = (ct_scan, label_volume)
+        self.frame_cache.clear()
+        self.pane_keys = [None, None, None]
+        self.pane_positions = [None, None, None]
+        for pane in range(3):
+            if self.images[pane] is not None:
+                self.images[pane].remove()
+                self.images[pane] = None
+        self.draw_idle()
+
+    def plot_crosshair(self, ct_scan, label_volume, crosshair, min_intensity, max_intensity, label_colors, opacity, show_overlay=True):
+        self.set_volumes(ct_scan, label_volume)
+        if ct_scan is None:
+            return
+        overlay_colors = tuple(sorted(label_colors.items())) if show_overlay and label_volume is not None else ()
+        lut = overlay_lut(overlay_colors, opacity)
+        for pane, (axes, view) in enumerate(zip(self.panes, self.views)):
+            index = crosshair[view_axes[view]]
+            key = (index, min_intensity, max_intensity, overlay_colors, opacity)
+            image_changed = key != self.pane_keys[pane]
+            if image_changed:
+                frame = self.frame_cache.get((view,) + key)
+                if frame is None:
+                    # Strided views of the volumes; only the windowed slice and the frame are new arrays
+                    with profiler.timer('slice'):
+                        gray = window_ct_slice(display_slice(ct_scan, view, index), min_intensity, max_intensity)
+                        labels = display_slice(label_volume, view, index) if overlay_colors else np.zeros(gray.shape, dtype=np.uint8)
+                    with profiler.timer('composite'):
+                        frame = composite_overlay(gray, labels, lut, self.compositing_buffers)
+                    self.frame_cache.put((view,) + key, frame)
+                if self.images[pane] is None:
+                    self.images[pane] = axes.imshow(frame, animated=True, aspect=display_aspect(ct_scan, view))
+                    self.draw_idle()
+                else:
+                    self.images[pane].set_data(frame)
+                self.pane_keys[pane] = key
+
+            position = display_position(ct_scan.shape, view, crosshair)
+            if image_changed or position != self.pane_positions[pane]:
+                self.pane_positions[pane] = position
+                horizontal, vertical = self.crosshair_lines[pane]
+                horizontal.set_ydata([position[0], position[0]])
+                vertical.set_xdata([position[1], position[1]])
+                self.redraw_pane(pane, image_changed)
+
+    def redraw_pane(self, pane, image_changed, blit=True):
+        if self.backgrounds[pane] is None:
+            return  # The next full draw paints it
+        with profiler.timer('draw'):
+            self.blit_pane(pane, image_changed, blit)
+
+    def blit_pane(self, pane, image_changed, blit):
+        axes = self.panes[pane]
+        if image_changed or self.image_backgrounds[pane] is None:
+            self.restore_region(self.backgrounds[pane])
+            if self.images[pane] is not None:
+                axes.draw_artist(self.images[pane])
+            self.image_backgrounds[pane] = self.copy_from_bbox(axes.bbox)
+        else:
+            self.restore_region(self.image_backgrounds[pane])
+        for line in self.crosshair_lines[pane]:
+            axes.draw_artist(line)
+        if blit:
+            self.blit(axes.bbox)
+
+    def on_draw(self, event):
+        # After a full draw (first show, resize, new volumes) capture the backgrounds and paint every pane;
+        # the draw itself puts them on screen
+        for pane, axes in enumerate(self.panes):
+            self.backgrounds[pane] = self.copy_from_bbox(axes.bbox)
+            self.image_backgrounds[pane] = None
+            self.redraw_pane(pane, True, blit=False)
+
+    def on_mouse(self, event):
+        ct_scan = self.volumes[0]
+        if ct_scan is None or event.inaxes not in self.panes or event.button != 1 or event.xdata is None:
+            return
+        pane = self.panes.index(event.inaxes)
+        view = self.views[pane]
+        image = self.images[pane]
+        if image is None:
+            return
+        rows, columns = image.get_array().shape[:2]
+        row = min(max(int(round(event.ydata)), 0), rows - 1)
+        column = min(max(int(round(event.xdata)), 0), columns - 1)
+        index = self.pane_keys[pane][0]
+        self.crosshair_moved.emit(voxel_at(ct_scan.shape, view, index, row, column))
+
+# Non-blocking window with the intensity histogram and statistics of the current subject
+class HistogramDialog(QDialog):
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('CT Scan Intensity Histogram')
+        self.figure = Figure(figsize=(10, 6))
+        self.canvas = FigureCanvas(self.figure)
+        self.axes = self.figure.add_subplot(111)
+        self.mask_combo = QComboBox()
+        self.stats_label = QLabel()
+
+        mask_layout = QHBoxLayout()
+        mask_layout.addWidget(QLabel('Voxels:'))
+        mask_layout.addWidget(self.mask_combo)
+        mask_layout.addStretch()
+        layout = QVBoxLayout()
+        layout.addLayout(mask_layout)
+        layout.addWidget(self.canvas)
+        layout.addWidget(self.stats_label)
+        self.setLayout(layout)
+
+    def set_mask_options(self, labels, has_ground_truth, has_prediction):
+        current = self.mask_combo.currentData()
+        self.mask_combo.blockSignals(True)
+        self.mask_combo.clear()
+        self.mask_combo.addItem('All voxels', None)
+        for kind, name, present in (('ground_truth', 'Ground Truth', has_ground_truth), ('predicted', 'Prediction', has_prediction)):
+            if not present:
+                continue
+            self.mask_combo.addItem(f'{name}: any label', (kind, None))
+            for label in labels:
+                self.mask_combo.addItem(f'{name}: label {label}', (kind, label))
+        index = self.mask_combo.findData(current)
+        self.mask_combo.setCurrentIndex(max(index, 0))
+        self.mask_combo.blockSignals(False)
+
+    def show_message(self, message):
+        self.axes.clear()
+        self.axes.text(0.5, 0.5, message, ha='center', va='center', transform=self.axes.transAxes)
+        self.stats_label.setText('')
+        self.canvas.draw_idle()
+
+    def plot_histogram(self, counts, values, statistics):
+        if statistics is None:
+            self.show_message('No voxels')
+            return
+        mean_intensity = statistics['mean']
+        median_intensity = statistics['median']
+        axes = self.axes
+        axes.clear()
+
+        # Plot histogram, rebinned to 170 bars
+        edges = np.linspace(values[0], values[-1] + (values[1] - values[0] if len(values) > 1 else 1), 171)
+        bars = np.histogram(values, bins=edges, weights=counts)[0]
+        axes.bar(edges[:-1], bars, width=np.diff(edges) * 0.85, align='edge', color='#4682B4', alpha=0.7)
+
+        # Plot mean and median lines
+        axes.axvline(mean_intensity, color='red', linestyle='--', linewidth=1, label=f'Mean: {mean_intensity:.2f}')
+        axes.axvline(median_intensity, color='green', linestyle='-', linewidth=1, label=f'Median: {median_intensity:.2f}')
+
+        # Add title, labels, grid and legend
+        axes.set_title('CT Scan Intensity Histogram', fontsize=16, fontweight='bold')
+        axes.set_xlabel('Intensity', fontsize=14)
+        axes.set_ylabel('Frequency', fontsize=14)
+        axes.grid(color='gray', linestyle='-', linewidth=0.5, alpha=0.7)
+        axes.legend()
+
+        # Adding annotations
+        axes.annotate(f'Mean: {mean_intensity:.2f}', xy=(mean_intensity, axes.get_ylim()[1] * 0.9),
+                      xytext=(mean_intensity + 100, axes.get_ylim()[1] * 0.9),
+                      arrowprops=dict(facecolor='red', shrink=0.05), fontsize=12, color='red')
+        axes.annotate(f'Median: {median_intensity:.2f}', xy=(median_intensity, axes.get_ylim()[1] * 0.8),
+                      xytext=(median_intensity + 100, axes.get_ylim()[1] * 0.8),
+                      arrowprops=dict(facecolor='green', shrink=0.05), fontsize=12, color='green')
+
+        percentiles = ', '.join(f'P{q}: {value:.1f}' for q, value in statistics['percentiles'].items())
+        self.stats_label.setText(f"Voxels: {statistics['count']} | Mean: {mean_intensity:.2f} | Std: {statistics['std']:.2f} | "
+                                 f"Min: {statistics['min']:.1f} | Max: {statistics['max']:.1f} | {percentiles}")
+        self.canvas.draw_idle()
+
+# Per-slice Dice of the visible labels as a strip of cells under the slice slider: red for 0, green for 1,
+# dark where none of the labels is present. The current slice is marked; click a cell to jump to that slice.
+class DiceStrip(QWidget):
+    slice_clicked = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.values = np.zeros(0)
+        self.current = 0
+        self.setFixedHeight(10)
+        self.setToolTip('Per-slice Dice (red: 0, green: 1). Click to jump to a slice.')
+
+    def set_values(self, values):
+        self.values = values
+        self.update()
+
+    def set_current(self, index):
+        if index != self.current:
+            self.current = index
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor('#0b130d'))
+        count = len(self.values)
+        if count == 0:
+            return
+        width, height = self.width(), self.height()
+        for index, value in enumerate(self.values):
+            if not np.isnan(value):
+                left = index * width // count
+                painter.fillRect(left, 0, max((index + 1) * width // count - left, 1), height, QColor.fromRgbF(1 - value, value, 0))
+        painter.fillRect(min(self.current, count - 1) * width // count, 0, max(width // count, 2), height, QColor('white'))
+
+    def mousePressEvent(self, event):
+        if len(self.values):
+            self.slice_clicked.emit(min(event.x() * len(self.values) // max(self.width(), 1), len(self.values) - 1))
+
+class MainWindow(QMainWindow):
+    statistics_ready = pyqtSignal(object, object)
+    index_refreshed = pyqtSignal()
+    metrics_ready = pyqtSignal(object, object)
+
+    def __init__(self, manifest=None, display='matplotlib'):
+        super().__init__()
+
+        self.setWindowTitle('3D CT Scan Viewer')
+        self.setWindowIcon(QIcon('icon.png'))
+        self.setStyleSheet("background-color: black; color: white;")
+
+        self.base_resolution = (1920, 1080)
+        self.screen_resolution = QApplication.desktop().screenGeometry()
+
+        if self.screen_resolution.width() > self.screen_resolution.height():
+            self.window_width_percentage = 44
+            self.window_height_percentage = 56
+            self.scaling_factor_width = self.screen_resolution.width() / self.base_resolution[0]
+            self.scaling_factor_height = self.screen_resolution.height() / self.base_resolution[1]
+        else:
+            self.window_width_percentage = 56
+            self.window_height_percentage = 44
+            self.scaling_factor_width = self.screen_resolution.width() / self.base_resolution[1]
+            self.scaling_factor_height = self.screen_resolution.height() / self.base_resolution[0]
+
+        # Styles   
+        line_edit_style = """
+        QLineEdit {
+            background-color: #0b130d;
+            border: 2px solid #555;
+            padding: 5px;
+            border-radius: 5px;
+            color: white;
+            max-width: {30 * self.scaling_factor_width}px
+        }
+        """
+        
+        colors_style = """
+        QComboBox {
+            background-color: #0b130d;
+            border: 1px solid #555;
+            padding: 5px;
+            border-radius: 5px;
+            color: white;
+        }
+        """
+
+        button_style = """
+        QPushButton {
+            background-color: #4CAF50;
+            color: white;
+            border-radius: 5px;
+            padding: 10px;
+            width: {60 * self.scaling_factor_width}px;
+        }
+        QPushButton:hover {
+            background-color: #45a049;
+        }
+        """
+        square_button_style = """
+        QPushButton {
+            background-color: #4CAF50;
+            color: white;
+            border-radius: 5px;
+            padding: 10px;
+        }
+        QPushButton:hover {
+            background-color: #45a049;
+        }
+        """
+        checkbox_style = """
+        QCheckBox {
+            color: #FFFFFF;
+            spacing: 5px;
+        }
+        QCheckBox::indicator {
+            width: {30 * self.scaling_factor_width}px;
+            height: {30 * self.scaling_factor_height}px;
+        }
+        QCheckBox::indicator:unchecked {
+            border: 2px solid #555;
+            background-color: #0b130d;
+        }
+        QCheckBox::indicator:checked {
+            background-color: #176cbe;
+            border: 2px solid #176cbe;
+        }
+        QCheckBox::indicator:hover {
+            border: 2px solid #104f8b;
+        }
+        """
+        groupbox_style = """
+        QGroupBox {
+            border: 2px solid #555;
+            border-radius: 5px;
+            margin-top: 2px;
+            font-weight: bold;
+            color: #FFFFFF;
+        }
+        QGroupBox::title {
+            subcontrol-origin: margin;
+            subcontrol-position: top center;
+            padding: 0 3px;
+            background-color: #0b130d;
+        }
+        """
+        groupbox_style2 = """
+        QGroupBox {
+            border: 2px solid #555;
+            border-radius: 5px;
+            margin-top: 2px;
+            font-weight: bold;
+            color: #FFFFFF;
+        }
+        QGroupBox::title {
+            subcontrol-origin: margin;
+            subcontrol-position: top center;
+            padding: 0 3px;
+            background-color: #0b130d;
+        }
+        """
+        opacity_slider_style = """
+        QSlider::groove:horizontal {
+                height: 8px;
+                background: qlineargradient(x1:0, y1:0, x2:1, y2:0,
+                    stop:0 #B1B1B1, stop:1 #c4c4c4);
+                margin: 2px 0;
+            }
+            QSlider::handle:horizontal {
+                background: #5CACEE;
+                border: 1px solid #5CACEE;
+                width: 14px;
+                margin: -2px 0;
+                border-radius: 6px;
+            }
+        """
+
+        layout = QVBoxLayout()
+
+        self.subject_controls_layout = QHBoxLayout()
+        self.prev_subject_button = QPushButton('<')
+        self.prev_subject_button.setFixedWidth(int(40 * self.scaling_factor_width))
+        self.subject_input = QLineEdit()
+        self.subject_input.setText('SUB_001')
+        self.subject_input.setFixedWidth(int(150 * self.scaling_factor_width))
+        self.next_subject_button = QPushButton('>')
+        self.next_subject_button.setFixedWidth(int(40 * self.scaling_factor_width))
+
+        self.shape_label = QLabel()
+        self.shape_label.setFixedHeight(int(60 * self.scaling_factor_height))
+        self.shape_label.setText("Shape: Not loaded")
+
+        self.subject_cache = SubjectCache(budget_mb=2048)
+        self.prefetch_input = QLineEdit()
+        self.prefetch_input.setText('1')
+        self.prefetch_input.setFixedWidth(int(40 * self.scaling_factor_width))
+        self.prefetch_input.setValidator(QIntValidator(0, 20))
+        self.cache_budget_input = QLineEdit()
+        self.cache_budget_input.setText('2048')
+        self.cache_budget_input.setFixedWidth(int(70 * self.scaling_factor_width))
+        self.cache_budget_input.setValidator(QIntValidator(0, 1000000))
+        self.cache_budget_input.returnPressed.connect(self.update_cache_budget)
+        self.cache_label = QLabel()
+        self.load_progress_label = QLabel()
+        self.gzip_backend_combo = QComboBox()
+        self.gzip_backend_combo.addItems(available_gzip_backends())
+        self.gzip_backend_combo.currentIndexChanged.connect(self.update_gzip_backend)
+        self.gzip_backend_combo.setStyleSheet(colors_style)
+        self.disk_cache_checkbox = QCheckBox('Disk Cache')
+        self.disk_cache_checkbox.setChecked(True)
+        self.disk_cache_checkbox.stateChanged.connect(self.update_disk_cache)
+        self.disk_cache_checkbox.setStyleSheet(checkbox_style)
+        self.axis_copies_checkbox = QCheckBox('Axis Copies')
+        # Off by default: every copy is another full volume in RAM, counted against the subject cache budget
+        self.axis_copies_checkbox.setChecked(False)
+        self.axis_copies_checkbox.setToolTip('Build a contiguous copy of the volumes for the view that is scrolled, in the background, so that '
+                                             'all views scroll equally fast (more memory; not needed for volumes from the disk cache)')
+        self.axis_copies_checkbox.stateChanged.connect(self.request_render)
+        self.axis_copies_checkbox.setStyleSheet(checkbox_style)
+        # Axis copies and pyramids of the volumes are built one at a time in the background
+        self.volume_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='volume-copies')
+        self.axis_copy_requests = set()
+        self.volume_cache = VolumeCache()
+        self.subject_cache.volume_cache = self.volume_cache
+        self.dataset_index = DatasetIndex(manifest=manifest)
+        self.subject_cache.index = self.dataset_index
+        if self.dataset_index.ct_subjects and 'SUB_001' not in self.dataset_index:
+            self.subject_input.setText(self.dataset_index.ct_subjects[0])
+
+        self.subject_controls_layout.addWidget(self.prev_subject_button)
+        self.subject_controls_layout.addWidget(self.subject_input)
+        self.subject_controls_layout.addWidget(self.next_subject_button)
+        self.subject_controls_layout.addWidget(self.shape_label)
+        self.subject_controls_layout.addWidget(self.load_progress_label)
+        self.subject_controls_layout.addStretch()
+        self.subject_controls_layout.addWidget(QLabel('Decompression:'))
+        self.subject_controls_layout.addWidget(self.gzip_backend_combo)
+        self.subject_controls_layout.addWidget(self.disk_cache_checkbox)
+        self.subject_controls_layout.addWidget(self.axis_copies_checkbox)
+        self.subject_controls_layout.addWidget(QLabel('Prefetch ±:'))
+        self.subject_controls_layout.addWidget(self.prefetch_input)
+        self.subject_controls_layout.addWidget(QLabel('Cache (MB):'))
+        self.subject_controls_layout.addWidget(self.cache_budget_input)
+        self.subject_controls_layout.addWidget(self.cache_label)
+
+        layout.addLayout(self.subject_controls_layout)
+
+        horizontal_layout = QHBoxLayout()
+
+        # Create GroupBox
+        self.Mode_options = QGroupBox("Mode")
+        self.Mode_options.setStyleSheet(groupbox_style)
+        self.Mode_options.setFixedHeight(int(70 * self.scaling_factor_height))
+
+
+
+        # Create layout for GroupBox
+        self.view_controls_layout = QHBoxLayout()
+
+        self.axial_radio_button = QRadioButton('Axial')
+        self.axial_radio_button.setChecked(True)  # Set axial as the default view
+        self.coronal_radio_button = QRadioButton('Coronal')
+        self.sagittal_radio_button = QRadioButton('Sagittal')
+        self.tri_planar_radio_button = QRadioButton('Tri-planar')
+        self.tri_planar_radio_button.setToolTip('Axial, coronal and sagittal panes through a crosshair; click or drag in a pane to move it')
+
+        self.view_button_group = QButtonGroup()
+        self.view_button_group.addButton(self.axial_radio_button)
+        self.view_button_group.addButton(self.coronal_radio_button)
+        self.view_button_group.addButton(self.sagittal_radio_button)
+        self.view_button_group.addButton(self.tri_planar_radio_button)
+
+        self.view_controls_layout.addWidget(self.axial_radio_button)
+        self.view_controls_layout.addWidget(self.coronal_radio_button)
+        self.view_controls_layout.addWidget(self.sagittal_radio_button)
+        self.view_controls_layout.addWidget(self.tri_planar_radio_button)
+        self.view_controls_layout.addStretch()
+        
+        # Set layout for GroupBox
+        self.Mode_options.setLayout(self.view_controls_layout)
+
+
+        # Create GroupBox
+        self.visualization_options = QGroupBox("Visualization")
+        self.visualization_options.setStyleSheet(groupbox_style2)
+        self.visualization_options.setFixedHeight(int(70 * self.scaling_factor_height))
+
+
+        # Create layout for GroupBox
+        visualization_layout = QHBoxLayout()
+
+        # Create and style checkboxes
+        self.show_ground_truth_checkbox = QCheckBox('Show Ground Truth')
+        self.show_ground_truth_checkbox.setChecked(True)
+        self.show_ground_truth_checkbox.stateChanged.connect(self.request_render)
+        self.show_ground_truth_checkbox.setStyleSheet(checkbox_style)
+
+        self.show_prediction_checkbox = QCheckBox('Show Prediction')
+        self.show_prediction_checkbox.setChecked(True)
+        self.show_prediction_checkbox.stateChanged.connect(self.request_render)
+        self.show_prediction_checkbox.setStyleSheet(checkbox_style)
+
+        # Add checkboxes to layout
+        visualization_layout.addWidget(self.show_ground_truth_checkbox)
+        visualization_layout.addWidget(self.show_prediction_checkbox)
+
+    
+        self.show_contour_checkbox = QCheckBox('Show Contour')
+        self.show_contour_checkbox.setChecked(False)
+        self.show_contour_checkbox.stateChanged.connect(self.contour_mode_changed)
+        self.show_contour_checkbox.setStyleSheet(checkbox_style)
+
+
+        # Fourth panel with the TP / FP / FN map of the prediction against the ground truth
+        self.show_errors_checkbox = QCheckBox('Show Errors')
+        self.show_errors_checkbox.setChecked(False)
+        self.show_errors_checkbox.stateChanged.connect(self.request_render)
+        self.show_errors_checkbox.setStyleSheet(checkbox_style)
+
+        self.line_width_label = QLabel('Contour Line Width:')
+        self.line_width_label.setHidden(True)
+        self.line_width_input = QLineEdit()
+        self.line_width_input.setText('1.1')  # Default value
+        self.line_width_input.setFixedWidth(int(40 * self.scaling_factor_width))
+        self.line_width_input.setValidator(QDoubleValidator(0, 10, 2))
+        self.line_width_input.setStyleSheet(line_edit_style)
+        self.line_width_input.setHidden(True)
+        self.line_width_input.returnPressed.connect(self.request_render)
+
+        self.opacity_slider = QSlider(Qt.Horizontal)
+        self.opacity_slider.setMinimum(0)
+        self.opacity_slider.setMaximum(100)
+        self.opacity_slider.setValue(75)
+        self.opacity_slider.setTickInterval(1)
+        self.opacity_slider.valueChanged.connect(self.update_opacity_input)
+        self.opacity_slider.valueChanged.connect(self.request_render)
+        self.opacity_slider.setStyleSheet(opacity_slider_style)
+        # self.opacity_slider.setFixedSize(int(150 * self.scaling_factor_width), int(20 * self.scaling_factor_height))
+    
+
+        self.opacity_input = QLineEdit()
+        self.opacity_input.setText('75')
+        self.opacity_input.setFixedWidth(int(40 * self.scaling_factor_width))
+        self.opacity_input.textChanged.connect(self.update_opacity_slider)
+        self.opacity_input.setValidator(QIntValidator(0, 100))
+
+        # Labels of the current subject: tick to show, select and pick a color to recolor
+        self.label_list = QListWidget()
+        self.label_list.setFixedWidth(int(180 * self.scaling_factor_width))
+        self.label_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.label_list.setStyleSheet("background-color: #0b130d; border: 2px solid #555; border-radius: 5px;")
+        self.label_list.itemChanged.connect(self.label_visibility_changed)
+
+        self.label_color_combo = QComboBox()
+        self.label_color_combo.addItems(list(color_map))
+        self.label_color_combo.activated.connect(self.recolor_selected_labels)
+        self.label_color_combo.setStyleSheet(colors_style)
+
+        self.show_hud_checkbox = QCheckBox('Show HUD')
+        self.show_hud_checkbox.setChecked(False)
+        self.show_hud_checkbox.setToolTip('Show the frames per second, frame time and time per stage (ms) on the slices')
+        self.show_hud_checkbox.stateChanged.connect(self.update_hud)
+        self.show_hud_checkbox.setStyleSheet(checkbox_style)
+        self.record_profile_button = QPushButton('Record Profile')
+        self.record_profile_button.setCheckable(True)
+        self.record_profile_button.setToolTip('Record a trace of the timed stages and a cProfile profile until clicked again, '
+                                              'e.g. while scrolling through slices')
+        self.record_profile_button.toggled.connect(self.record_profile)
+        self.session_profile = None
+
+        visualization_layout.addWidget(self.show_contour_checkbox)
+        visualization_layout.addWidget(self.show_errors_checkbox)
+        visualization_layout.addWidget(self.line_width_label)
+        visualization_layout.addWidget(self.line_width_input)
+
+        visualization_layout.addWidget(QLabel('Opacity:'))
+        visualization_layout.addWidget(self.opacity_slider)
+        visualization_layout.addWidget(self.opacity_input)
+
+        visualization_layout.addWidget(QLabel('Label Color:'))
+        visualization_layout.addWidget(self.label_color_combo)
+        visualization_layout.addWidget(self.show_hud_checkbox)
+        visualization_layout.addWidget(self.record_profile_button)
+        visualization_layout.addStretch()
+
+        self.visualization_options.setLayout(visualization_layout)
+
+        # Add both GroupBoxes to the horizontal layout
+        horizontal_layout.addWidget(self.Mode_options)
+        horizontal_layout.addWidget(self.visualization_options)
+        horizontal_layout.addStretch(1)
+        layout.addLayout(horizontal_layout)
+
+
+        # Subjects of the dataset index with the volumes they have (-- when missing); type to filter, click to load
+        self.subject_search_input = QLineEdit()
+        self.subject_search_input.setPlaceholderText('Search subjects')
+        self.subject_search_input.setFixedWidth(int(180 * self.scaling_factor_width))
+        self.subject_search_input.textChanged.connect(self.filter_subject_list)
+        self.subject_list = QListWidget()
+        self.subject_list.setFixedWidth(int(180 * self.scaling_factor_width))
+        self.subject_list.setUniformItemSizes(True)
+        self.subject_list.setStyleSheet("background-color: #0b130d; border: 2px solid #555; border-radius: 5px;")
+        self.subject_list.itemClicked.connect(self.subject_selected)
+        self.subject_items = {}
+        subject_list_layout = QVBoxLayout()
+        subject_list_layout.addWidget(self.subject_search_input)
+        subject_list_layout.addWidget(self.subject_list)
+
+        # Slice panels drawn by Matplotlib, or painted directly by Qt (display='raster'); the histogram always uses Matplotlib
+        canvas_class = RasterSliceCanvas if display == 'raster' else MplCanvas
+        self.canvas = canvas_class(self, width=int(30 * self.scaling_factor_width), height=int(5 * self.scaling_factor_height), dpi=100)
+        canvas_layout = QHBoxLayout()
+        canvas_layout.addLayout(subject_list_layout)
+        canvas_layout.addWidget(self.canvas, 1)
+        # Tri-planar view; the slider moves the crosshair through the axial slices
+        self.tri_canvas = TriPlanarCanvas(self, width=int(30 * self.scaling_factor_width), height=int(5 * self.scaling_factor_height), dpi=100)
+        self.tri_canvas.crosshair_moved.connect(self.move_crosshair)
+        self.tri_canvas.hide()
+        self.crosshair = None
+        canvas_layout.addWidget(self.tri_canvas, 1)
+        canvas_layout.addWidget(self.label_list)
+        layout.addLayout(canvas_layout)
+
+        self.slider = QSlider(Qt.Horizontal)
+        self.slider.setMinimum(0)
+        self.slider.setMaximum(99)
+        self.slider.setValue(0)
+        self.slider.setTickInterval(1)
+        self.slider.valueChanged.connect(self.request_render)
+        self.dice_strip = DiceStrip()
+        self.dice_strip.slice_clicked.connect(self.slider.setValue)
+        slider_layout = QVBoxLayout()
+        slider_layout.setSpacing(2)
+        slider_layout.addWidget(self.slider)
+        slider_layout.addWidget(self.dice_strip)
+
+        self.min_intensity_input = QLineEdit()
+        self.min_intensity_input.setText(str(min_intensity))
+        self.min_intensity_input.setFixedWidth(int(60 * self.scaling_factor_width))
+        self.max_intensity_input = QLineEdit()
+        self.max_intensity_input.setText(str(max_intensity))
+        self.max_intensity_input.setFixedWidth(int(60 * self.scaling_factor_width))
+
+        self.window_preset_combo = QComboBox()
+        self.window_preset_combo.addItems(list(window_presets) + ['Custom'])
+        self.window_preset_combo.currentIndexChanged.connect(self.apply_window_preset)
+        self.window_preset_combo.setStyleSheet(colors_style)
+
+        self.duration_input = QLineEdit()
+        self.duration_input.setText("20")
+        self.duration_input.setFixedWidth(int(60 * self.scaling_factor_width))
+
+        self.prev_button = QPushButton('<')
+        self.next_button = QPushButton('>')
+        self.animate_button = QPushButton('▶')
+        # Cine mode: playback order and the slices it plays (empty: from the first / to the last slice)
+        self.cine_mode_combo = QComboBox()
+        self.cine_mode_combo.addItems(cine_modes)
+        self.cine_mode_combo.setToolTip('Loop: start over after the last slice, Bounce: play back and forth, Once: stop at the end')
+        self.cine_mode_combo.setStyleSheet(colors_style)
+        self.cine_first_input = QLineEdit()
+        self.cine_last_input = QLineEdit()
+        for cine_input, placeholder in ((self.cine_first_input, 'first'), (self.cine_last_input, 'last')):
+            cine_input.setPlaceholderText(placeholder)
+            cine_input.setValidator(QIntValidator(0, 99999))
+            cine_input.setFixedWidth(int(50 * self.scaling_factor_width))
+        self.cine_label = QLabel('')
+        self.cine_label.setToolTip('Frames per second shown / requested (1000 / Duration), and the slices dropped to keep up')
+        self.toggle_overlay_button = QPushButton('Toggle Overlay')
+        self.plot_histogram_button = QPushButton('Plot Intensity Histogram')
+        self.worst_slice_button = QPushButton('Worst Dice')
+        self.worst_slice_button.setToolTip('Jump to the slice with the lowest Dice, then the next lowest')
+        self.worst_slice_button.clicked.connect(self.jump_to_worst_slice)
+        self.next_error_button = QPushButton('Next Error')
+        self.next_error_button.setToolTip('Jump to the next slice with false positive or false negative voxels of the visible labels')
+        self.next_error_button.clicked.connect(self.jump_to_next_error)
+
+        self.plot_histogram_button.clicked.connect(self.plot_intensity_histogram)
+        self.prev_button.clicked.connect(self.prev_slice)
+        self.next_button.clicked.connect(self.next_slice)
+        self.animate_button.clicked.connect(self.toggle_animation)
+        self.toggle_overlay_button.pressed.connect(self.hide_overlay)
+        self.toggle_overlay_button.released.connect(self.show_overlay)
+        self.prev_subject_button.clicked.connect(self.prev_subject)
+        self.next_subject_button.clicked.connect(self.next_subject)
+        self.subject_input.returnPressed.connect(self.load_subject)
+
+        # Once per switch: toggled fires for the button that was unchecked too
+        self.view_button_group.buttonToggled.connect(self.view_changed)
+
+        self.prev_button.setStyleSheet(button_style)
+        self.next_button.setStyleSheet(button_style)
+        self.animate_button.setStyleSheet(button_style)
+        self.toggle_overlay_button.setStyleSheet(button_style)
+        self.prev_subject_button.setStyleSheet(button_style)
+        self.next_subject_button.setStyleSheet(button_style)
+        self.plot_histogram_button.setStyleSheet(button_style)
+        self.worst_slice_button.setStyleSheet(button_style)
+        self.next_error_button.setStyleSheet(button_style)
+        
+
+        self.animate_button.setStyleSheet(square_button_style)
+
+        self.min_intensity_input.setStyleSheet(line_edit_style)
+        self.min_intensity_input.returnPressed.connect(self.intensity_range_changed)
+        self.max_intensity_input.setStyleSheet(line_edit_style)
+        self.max_intensity_input.returnPressed.connect(self.intensity_range_changed)
+        self.duration_input.setStyleSheet(line_edit_style)
+        self.cine_first_input.setStyleSheet(line_edit_style)
+        self.cine_last_input.setStyleSheet(line_edit_style)
+        self.subject_input.setStyleSheet(line_edit_style)
+        self.prefetch_input.setStyleSheet(line_edit_style)
+        self.cache_budget_input.setStyleSheet(line_edit_style)
+        self.opacity_input.setStyleSheet(line_edit_style)
+
+        controls_layout = QHBoxLayout()
+        controls_layout.addWidget(QLabel('Min Intensity:'))
+        controls_layout.addWidget(self.min_intensity_input)
+        controls_layout.addWidget(QLabel('Max Intensity:'))
+        controls_layout.addWidget(self.max_intensity_input)
+        controls_layout.addWidget(QLabel('Window:'))
+        controls_layout.addWidget(self.window_preset_combo)
+        controls_layout.addWidget(QLabel('Duration (ms):'))
+        controls_layout.addWidget(self.duration_input)
+        controls_layout.addWidget(self.prev_button)
+        controls_layout.addLayout(slider_layout)
+        controls_layout.addWidget(self.next_button)
+        controls_layout.addWidget(self.worst_slice_button)
+        controls_layout.addWidget(self.next_error_button)
+        controls_layout.addWidget(self.animate_button)
+        controls_layout.addWidget(self.cine_mode_combo)
+        controls_layout.addWidget(self.cine_first_input)
+        controls_layout.addWidget(self.cine_last_input)
+        controls_layout.addWidget(self.cine_label)
+        controls_layout.addWidget(self.toggle_overlay_button)
+        controls_layout.addWidget(self.plot_histogram_button)
+
+
+        layout.addLayout(controls_layout)
+
+        container = QWidget()
+        container.setLayout(layout)
+        self.setCentralWidget(container)
+
+        self.show_overlay_flag = True
+        self.is_animating = False
+        # Cine mode: the timer shows the slice that is due by the clock; the buffer renders the next ones ahead
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.cine_buffer = None
+        self.cine_shown = 0
+        # Render scheduler: widget changes only mark the view dirty (request_render); bursts of changes are
+        # coalesced into at most one render per display frame, and a render that would not change anything is skipped
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.timeout.connect(self.update_plot)
+        screen = QApplication.primaryScreen()
+        self.frame_interval = 1.0 / (screen.refreshRate() if screen is not None and screen.refreshRate() > 0 else 60.0)
+        self.last_render_time = 0.0
+        self.rendered_state = None
+        self.rendered_volumes = (None, None, None)
+        self.refining = False
+        self.refine_timer = QTimer(self)
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.setInterval(150)
+        self.refine_timer.timeout.connect(self.refine_plot)
+        self.timer.timeout.connect(self.cine_tick)
+
+        self.ct_scan = self.ground_truth = self.predicted = None
+        self.memory_text = ''
+        # Display style per label; names and colors come from labels.txt when it exists
+        self.color_table = read_color_table('labels.txt') if os.path.exists('labels.txt') else {}
+        self.subject_cache.known_labels = list(self.color_table) if self.color_table else None
+        self.label_styles = {}
+        self.subject_labels = []
+        self.histogram_dialog = None
+        self.statistics_cache = {}
+        self.statistics_pending = set()
+        self.statistics_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='statistics')
+        self.statistics_ready.connect(self.statistics_computed)
+        self.loader = None
+        self.loading_subject = None
+        self.load_progress = {}
+        self.refresh_subject_list()
+        # New or removed files are picked up by re-listing the folders whose mtime changed
+        self.index_refreshed.connect(self.refresh_subject_list)
+        self.index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index')
+        self.index_refresh_pending = False
+        self.index_timer = QTimer(self)
+        self.index_timer.timeout.connect(self.refresh_index)
+        self.index_timer.start(10000)
+        # Segmentation metrics of the current subject, computed on a worker thread and cached on disk
+        self.metrics_cache = MetricsCache()
+        self.metrics = None
+        self.metrics_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='metrics')
+        self.metrics_ready.connect(self.metrics_computed)
+        self.dice_strip_key = None
+        self.worst_slice_rank = 0
+        self.update_hud()
+        self.load_subject()
+
+    def contour_mode_changed(self):
+        show_contour = self.show_contour_checkbox.isChecked()
+        self.line_width_label.setHidden(not show_contour)
+        self.line_width_input.setHidden(not show_contour)
+        self.request_render()
+
+    def update_hud(self):
+        self.canvas.show_hud = self.show_hud_checkbox.isChecked()
+        self.canvas.frame_times.clear()
+        # The stage timers only run while they are shown or recorded
+        profiler.enabled = self.canvas.show_hud or self.session_profile is not None
+        profiler.clear()
+        self.canvas.draw_idle()
+
+    # Function to start or stop recording a profile. The trace (Chrome trace format, open it in chrome://tracing
+    # or https://ui.perfetto.dev) and the cProfile statistics are written to the profiles folder of the cache.
+    def record_profile(self, recording):
+        if recording:
+            profiler.enabled = True
+            profiler.start_trace()
+            self.session_profile = cProfile.Profile()
+            self.session_profile.enable()
+            self.record_profile_button.setText('Stop Recording')
+            return
+        if self.session_profile is None:
+            return
+        self.session_profile.disable()
+        profile_dir = os.path.join(default_cache_dir(), 'profiles')
+        os.makedirs(profile_dir, exist_ok=True)
+        name = time.strftime('profile-%Y%m%d-%H%M%S')
+        trace_path = os.path.join(profile_dir, f'{name}.json')
+        events = profiler.stop_trace(trace_path)
+        self.session_profile.dump_stats(os.path.join(profile_dir, f'{name}.prof'))
+        print(f"Recorded {events} timed stages to {trace_path} and a cProfile profile to {name}.prof:")
+        pstats.Stats(self.session_profile).sort_stats('cumulative').print_stats(20)
+        self.session_profile = None
+        self.update_hud()
+        self.record_profile_button.setText('Record Profile')
+        self.load_progress_label.setText(f"Profile saved: {trace_path}")
+
+    def update_opacity_input(self, value):
+        # Without textChanged, which would set the slider again
+        if self.opacity_input.text() != str(value):
+            self.opacity_input.blockSignals(True)
+            self.opacity_input.setText(str(value))
+            self.opacity_input.blockSignals(False)
+
+    def update_opacity_slider(self):
+        try:
+            value = int(self.opacity_input.text())
+            if value < 0:
+                self.opacity_slider.setValue(0)
+            elif value > 100:
+                self.opacity_slider.setValue(100)
+            else:
+                self.opacity_slider.setValue(value)
+        except ValueError:
+            pass
+
+    def apply_window_preset(self):
+        preset = window_presets.get(self.window_preset_combo.currentText())
+        if preset is None:
+            return
+        self.min_intensity_input.setText(str(preset[0]))
+        self.max_intensity_input.setText(str(preset[1]))
+        self.request_render()
+
+    def intensity_range_changed(self):
+        window = (int(self.min_intensity_input.text()), int(self.max_intensity_input.text()))
+        matching = [name for name, preset in window_presets.items() if preset == window]
+        self.window_preset_combo.blockSignals(True)
+        self.window_preset_combo.setCurrentText(matching[0] if matching else 'Custom')
+        self.window_preset_combo.blockSignals(False)
+        self.request_render()
+
+    def load_subject(self):
+        subject_name = self.subject_input.text()
+
+        # A new request supersedes the one in flight
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+
+        self.loading_subject = subject_name
+        self.subject_cache.current = subject_name
+        self.select_current_subject()
+        entry = self.subject_cache.peek(subject_name)
+        if entry is not None:
+            self.show_subject(*entry)
+            return
+
+        self.load_progress = {kind: 0 for _, kind in subject_volumes}
+        self.ct_scan = self.ground_truth = self.predicted = None
+        self.memory_text = 'Memory: loading'
+        self.loader = SubjectLoader(subject_name, self.subject_cache, self)
+        self.loader.volume_loaded.connect(self.volume_loaded)
+        self.loader.progress_changed.connect(self.load_progress_changed)
+        self.loader.loaded.connect(self.subject_loaded)
+        self.loader.failed.connect(self.subject_failed)
+        self.loader.finished.connect(self.loader.deleteLater)
+        self.loader.start()
+        self.update_load_progress_label()
+
+    def volume_loaded(self, kind, volume):
+        if self.sender() is not self.loader:
+            return
+        setattr(self, kind, volume)
+        self.request_render()
+
+    def load_progress_changed(self, kind, percentage):
+        if self.sender() is not self.loader:
+            return
+        self.load_progress[kind] = percentage
+        self.update_load_progress_label()
+
+    def subject_loaded(self, volumes, stats):
+        if self.sender() is not self.loader:
+            return
+        self.loader = None
+        self.show_subject(volumes, stats)
+
+    def subject_failed(self, message):
+        if self.sender() is not self.loader:
+            return
+        self.loader = None
+        self.show_load_error(message)
+
+    def show_subject(self, volumes, stats):
+        self.load_progress = {}
+        self.ct_scan, self.ground_truth, self.predicted = volumes
+        self.crosshair = None
+        self.axis_copy_requests = set()
+        for volume, labels in ((self.ct_scan, False), (self.ground_truth, True), (self.predicted, True)):
+            if volume is not None:
+                self.volume_executor.submit(build_pyramid, volume, labels)
+        self.subject_labels = stats['labels']
+        self.request_metrics()
+        self.refresh_label_list()
+        self.request_statistics(None)
+        self.update_histogram_masks()
+        self.show_histogram()
+        # Prefetched subjects are loaded without tracking the peak
+        peak = 'n/a (prefetched)' if stats['peak'] is None else f"{stats['peak'] / 2**20:.1f} MB"
+        self.memory_text = f"Memory: peak {peak}, resident {stats['resident'] / 2**20:.1f} MB"
+        try:
+            self.update_plot()
+        except Exception as e:
+            self.show_load_error(str(e))
+            return
+        self.update_load_progress_label()
+        self.subject_cache.prefetch(self.dataset_index.neighbours(self.loading_subject, self.prefetch_radius()))
+
+    def show_load_error(self, message):
+        self.load_progress = {}
+        self.update_load_progress_label()
+        self.load_progress_label.setText(f"Error loading {self.loading_subject}")
+        print(f"Error loading subject {self.loading_subject}: {message}")
+        self.update_shape_label()
+
+    def refresh_subject_list(self):
+        self.subject_list.setUpdatesEnabled(False)
+        self.subject_list.clear()
+        self.subject_items = {}
+        for subject_name in self.dataset_index.subjects:
+            available = self.dataset_index.available(subject_name)
+            marks = ' '.join(name if present else '--' for name, present in zip(('CT', 'GT', 'Pred'), available))
+            item = QListWidgetItem(f"{subject_name}  {marks}")
+            item.setData(Qt.UserRole, subject_name)
+            if not available[0]:
+                item.setForeground(QColor('gray'))
+            self.subject_list.addItem(item)
+            self.subject_items[subject_name] = item
+        self.filter_subject_list()
+        self.select_current_subject()
+        self.subject_list.setUpdatesEnabled(True)
+
+    def filter_subject_list(self):
+        text = self.subject_search_input.text().lower()
+        for subject_name, item in self.subject_items.items():
+            item.setHidden(text not in subject_name.lower())
+
+    def select_current_subject(self):
+        item = self.subject_items.get(self.loading_subject)
+        if item is not None:
+            self.subject_list.setCurrentItem(item)
+            self.subject_list.scrollToItem(item)
+
+    def subject_selected(self, item):
+        self.subject_input.setText(item.data(Qt.UserRole))
+        self.load_subject()
+
+    def refresh_index(self):
+        if self.index_refresh_pending:
+            return
+        self.index_refresh_pending = True
+
+        def refresh():
+            try:
+                if self.dataset_index.refresh():
+                    self.index_refreshed.emit()
+            except Exception as e:
+                print(f"Error refreshing the dataset index: {e}")
+            finally:
+                self.index_refresh_pending = False
+
+        self.index_executor.submit(refresh)
+
+    def label_style(self, label):
+        if label not in self.label_styles:
+            name, color = self.color_table.get(label, (f'Label {label}', default_label_color(label)))
+            self.label_styles[label] = {'name': name, 'color': color, 'visible': True}
+        return self.label_styles[label]
+
+    def refresh_label_list(self):
+        self.label_list.blockSignals(True)
+        self.label_list.clear()
+        for label in self.subject_labels:
+            style = self.label_style(label)
+            text = f"{label}: {style['name']}"
+            metrics = self.metrics['metrics'].get(label) if self.metrics is not None else None
+            if metrics is not None:
+                text += f"\nDice {metrics['dice']:.3f}  IoU {metrics['iou']:.3f}\nHD95 {metrics['hd95']:.1f}  ASSD {metrics['assd']:.2f} mm"
+                text += f"\nVolume {metrics['volume_difference']:+.1f} mL"
+            item = QListWidgetItem(text)
+            item.setData(Qt.UserRole, label)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if style['visible'] else Qt.Unchecked)
+            swatch = QPixmap(12, 12)
+            swatch.fill(QColor.fromRgbF(*style['color']))
+            item.setIcon(QIcon(swatch))
+            self.label_list.addItem(item)
+        self.label_list.blockSignals(False)
+
+    def label_visibility_changed(self, item):
+        self.label_style(item.data(Qt.UserRole))['visible'] = item.checkState() == Qt.Checked
+        self.request_render()
+
+    def recolor_selected_labels(self):
+        color = tuple(color_map[self.label_color_combo.currentText()])
+        for item in self.label_list.selectedItems():
+            self.label_style(item.data(Qt.UserRole))['color'] = color
+        self.refresh_label_list()
+        self.request_render()
+
+    def visible_label_colors(self):
+        return {label: self.label_style(label)['color'] for label in self.subject_labels if self.label_style(label)['visible']}
+
+    def update_load_progress_label(self):
+        names = {'ct_scan': 'CT', 'ground_truth': 'GT', 'predicted': 'Prediction'}
+        if self.load_progress:
+            progress = ' | '.join(f"{names[kind]} {percentage}%" for kind, percentage in self.load_progress.items())
+            self.load_progress_label.setText(f"Loading {self.loading_subject}: {progress}")
+        else:
+            self.load_progress_label.setText('')
+        self.update_shape_label()
+
+    # Previous / next subject of the dataset index that has a CT; missing subjects are skipped
+    def prev_subject(self):
+        self.subject_input.setText(self.dataset_index.shift(self.subject_input.text(), -1))
+        self.load_subject()
+
+    def next_subject(self):
+        self.subject_input.setText(self.dataset_index.shift(self.subject_input.text(), 1))
+        self.load_subject()
+
+    def prefetch_radius(self):
+        try:
+            return max(int(self.prefetch_input.text()), 0)
+        except ValueError:
+            return 0
+
+    def update_cache_budget(self):
+        try:
+            self.subject_cache.set_budget(int(self.cache_budget_input.text()))
+        except ValueError:
+            pass
+        self.update_shape_label()
+
+    def update_gzip_backend(self):
+        self.subject_cache.gzip_backend = self.gzip_backend_combo.currentText()
+
+    def update_disk_cache(self):
+        self.subject_cache.volume_cache = self.volume_cache if self.disk_cache_checkbox.isChecked() else None
+
+    def closeEvent(self, event):
+        self.stop_animation()
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader.wait()
+        self.subject_cache.shutdown()
+        self.volume_cache.shutdown()
+        self.index_executor.shutdown(wait=False, cancel_futures=True)
+        self.metrics_executor.shutdown(wait=False, cancel_futures=True)
+        self.volume_executor.shutdown(wait=False, cancel_futures=True)
+        super().closeEvent(event)
+
+    # Function to schedule a render; connected to the widget signals, whose arguments are ignored
+    def request_render(self, *args):
+        if self.render_timer.isActive():
+            return
+        wait = self.frame_interval - (time.perf_counter() - self.last_render_time)
+        self.render_timer.start(max(int(wait * 1000), 0))
+
+    def view_changed(self, button, checked):
+        if checked:
+            self.request_render()
+
+    # Function to render now; prefer request_render()
+    def update_plot(self):
+        self.render_timer.stop()
+        self.last_render_time = time.perf_counter()
+        with profiler.timer('update'):
+            self.plot_current_slice()
+
+    def plot_current_slice(self):
+        min_intensity = int(self.min_intensity_input.text())
+        max_intensity = int(self.max_intensity_input.text())
+        view = self.view_type()
+        line_width = float(self.line_width_input.text())
+        show_contour = self.show_contour_checkbox.isChecked()
+        label_colors = self.visible_label_colors()
+        opacity = self.opacity_slider.value() / 100.0
+
+        if self.ct_scan is not None:
+            if view == 'axial':
+                self.slider.setMaximum(self.ct_scan.shape[2] - 1)
+            elif view == 'coronal':
+                self.slider.setMaximum(self.ct_scan.shape[1] - 1)
+            elif view == 'sagittal':
+                self.slider.setMaximum(self.ct_scan.shape[0] - 1)
+        else:
+            self.slider.setMaximum(0)
+        slice_index = self.slider.value()
+        show_ground_truth = self.show_ground_truth_checkbox.isChecked()
+        show_prediction = self.show_prediction_checkbox.isChecked()
+        show_errors = self.show_errors_checkbox.isChecked()
+        # Large volumes are previewed at a coarser resolution while the slider is dragged or the slices animate,
+        # and drawn in full once they rest for a moment
+        preview = not self.refining and (self.slider.isSliderDown() or self.is_animating) and getattr(self.ct_scan, 'pyramid', None) is not None
+
+        # Everything the frame depends on; when none of it changed there is nothing to draw
+        volumes = (self.ct_scan, self.ground_truth, self.predicted)
+        state = (view, self.tri_planar_radio_button.isChecked(), slice_index, tuple(self.crosshair or ()), min_intensity, max_intensity,
+                 line_width, show_contour, tuple(label_colors.items()), opacity, show_ground_truth, show_prediction, show_errors,
+                 self.show_overlay_flag, preview, self.canvas.panel_size())
+        if state == self.rendered_state and all(volume is rendered for volume, rendered in zip(volumes, self.rendered_volumes)):
+            return
+        self.rendered_state, self.rendered_volumes = state, volumes
+
+        if self.tri_planar_radio_button.isChecked():
+            # The panes are strided views; only the axis the slider scrolls gets a copy
+            self.request_axis_copies([view_axes[view]])
+            self.update_tri_planar(min_intensity, max_intensity, label_colors, opacity)
+            self.update_dice_strip(view, label_colors)
+            self.update_shape_label()
+            return
+        self.tri_canvas.hide()
+        self.canvas.show()
+
+        if show_ground_truth and show_prediction:
+            self.canvas.set_axes_visibility(True, True)
+        elif show_ground_truth:
+            self.canvas.set_axes_visibility(True, False)
+        elif show_prediction:
+            self.canvas.set_axes_visibility(False, True)
+        else:
+            self.canvas.set_axes_visibility(False, False)
+
+        self.request_axis_copies([view_axes[view]])
+        if preview:
+            self.refine_timer.start()
+        self.canvas.plot_slices(slice_index, min_intensity, max_intensity, self.ct_scan, self.ground_truth, self.predicted, self.show_overlay_flag, view, show_contour, label_colors, opacity, line_width, show_errors, preview)
+        self.update_dice_strip(view, label_colors)
+        self.update_shape_label()
+
+    # Function to draw the tri-planar panes with the ground truth overlay, or the prediction when only it is shown
+    def update_tri_planar(self, min_intensity, max_intensity, label_colors, opacity):
+        self.canvas.hide()
+        self.tri_canvas.show()
+        if self.ct_scan is None:
+            self.tri_canvas.set_volumes(None, None)
+            return
+        if self.crosshair is None:
+            self.crosshair = [size // 2 for size in self.ct_scan.shape]
+        self.crosshair[2] = self.slider.value()
+        if self.show_ground_truth_checkbox.isChecked() and self.ground_truth is not None:
+            label_volume = self.ground_truth
+        elif self.show_prediction_checkbox.isChecked():
+            label_volume = self.predicted
+        else:
+            label_volume = None
+        self.tri_canvas.plot_crosshair(self.ct_scan, label_volume, tuple(self.crosshair), min_intensity, max_intensity, label_colors, opacity, self.show_overlay_flag)
+
+    def refine_plot(self):
+        self.refining = True
+        try:
+            self.update_plot()
+        finally:
+            self.refining = False
+
+    # Function to build, in the background, contiguous copies of the subject volumes for slicing along the given axes
+    def request_axis_copies(self, axes):
+        if not self.axis_copies_checkbox.isChecked():
+            return
+        for volume in (self.ct_scan, self.ground_truth, self.predicted):
+            for axis in axes:
+                if volume is None or (id(volume), axis) in self.axis_copy_requests or slices_contiguous(volume, axis):
+                    continue
+                self.axis_copy_requests.add((id(volume), axis))
+                self.volume_executor.submit(build_axis_copy, volume, axis)
+
+    def move_crosshair(self, voxel):
+        self.crosshair = list(voxel)
+        if self.slider.value() != voxel[2]:
+            self.slider.setValue(voxel[2])
+        else:
+            self.request_render()
+
+    def request_metrics(self):
+        self.metrics = None
+        self.update_dice_strip(self.view_type(), self.visible_label_colors())
+        if self.ground_truth is None or self.predicted is None or not self.subject_labels:
+            return
+        subject_name, ground_truth, predicted, labels = self.loading_subject, self.ground_truth, self.predicted, list(self.subject_labels)
+        paths = [self.dataset_index.volume_path(subject_name, folder) for folder in ('Ground_truth', 'Predicted')]
+
+        def compute():
+            try:
+                self.metrics_ready.emit(subject_name, subject_metrics(ground_truth, predicted, labels, *paths, self.metrics_cache))
+            except Exception as e:
+                print(f"Error computing segmentation metrics of {subject_name}: {e}")
+
+        self.metrics_executor.submit(compute)
+
+    def metrics_computed(self, subject_name, metrics):
+        if subject_name != self.loading_subject:
+            return
+        self.metrics = metrics
+        self.refresh_label_list()
+        self.update_dice_strip(self.view_type(), self.visible_label_colors())
+
+    def update_dice_strip(self, view, label_colors):
+        # Recomputed only when the metrics, the view or the visible labels change
+        key = (id(self.metrics), view, tuple(label_colors))
+        if key != self.dice_strip_key:
+            self.dice_strip_key = key
+            self.worst_slice_rank = 0
+            values = slice_dice(self.metrics, label_colors, view_axes[view]) if self.metrics is not None else np.zeros(0)
+            self.dice_strip.set_values(values)
+        self.dice_strip.set_current(self.slider.value())
+
+    def jump_to_worst_slice(self):
+        values = self.dice_strip.values
+        ranked = np.argsort(values)[:np.count_nonzero(~np.isnan(values))]
+        if len(ranked) == 0:
+            return
+        self.slider.setValue(int(ranked[self.worst_slice_rank % len(ranked)]))
+        self.worst_slice_rank += 1
+
+    def jump_to_next_error(self):
+        # Per-slice error counts come with the metrics of the subject; wraps around to the first error slice
+        if self.metrics is None:
+            return
+        errors = slice_errors(self.metrics, self.visible_label_colors(), view_axes[self.view_type()])
+        error_indices = np.flatnonzero(errors)
+        if len(error_indices) == 0:
+            return
+        later = error_indices[error_indices > self.slider.value()]
+        self.slider.setValue(int(later[0] if len(later) else error_indices[0]))
+
+    def view_type(self):
+        # The slider and the Dice strip follow the axial slices in the tri-planar view
+        if self.axial_radio_button.isChecked() or self.tri_planar_radio_button.isChecked():
+            view = 'axial'
+        elif self.coronal_radio_button.isChecked():
+            view = 'coronal'
+        else:
+            view = 'sagittal'
+        return view
+    
+    def prev_slice(self):
+        current_value = self.slider.value()
+        if current_value > 0:
+            self.slider.setValue(current_value - 1)
+
+    def next_slice(self):
+        current_value = self.slider.value()
+        if current_value < self.slider.maximum():
+            self.slider.setValue(current_value + 1)
+
+    def toggle_animation(self):
+        if self.is_animating:
+            self.stop_animation()
+        else:
+            self.start_animation()
+
+    def start_animation(self):
+        duration = max(int(self.duration_input.text()), 1)
+        self.cine_fps = 1000.0 / duration
+        self.is_animating = True
+        self.restart_cine()
+        self.timer.start(duration)
+        self.animate_button.setText('■')
+        self.animate_button.setStyleSheet("""
+        QPushButton {
+            background-color: #f44336;
+            color: white;
+            border-radius: {5 * self.scaling_factor_width}px;
+            padding: {10 * self.scaling_factor_width}px;
+        }
+        QPushButton:hover {
+            background-color: #d32f2f;
+        }
+        """)
+
+    def stop_animation(self):
+        self.timer.stop()
+        if self.cine_buffer is not None:
+            self.cine_buffer.stop()
+            self.cine_buffer = None
+        if self.cine_shown:
+            self.cine_label_time = 0.0
+            self.update_cine_label()
+        self.animate_button.setText('▶')
+        self.animate_button.setStyleSheet("""
+        QPushButton {
+            background-color: #4CAF50;
+            color: white;
+            border-radius: {5 * self.scaling_factor_width}px;
+            padding: {10 * self.scaling_factor_width}px;
+        }
+        QPushButton:hover {
+            background-color: #45a049;
+        }
+        """)
+        self.is_animating = False
+
+    # Everything the frames of the cine mode depend on: the render-ahead buffer starts over when it changes
+    def cine_settings(self):
+        volumes = (self.ct_scan, self.ground_truth, self.predicted)
+        view = self.view_type()
+        # Animation is previewed from a coarser pyramid level, see plot_current_slice()
+        preview = getattr(self.ct_scan, 'pyramid', None) is not None
+        return (tuple(id(volume) for volume in volumes), view, self.tri_planar_radio_button.isChecked(), self.slider.maximum(),
+                self.cine_first_input.text(), self.cine_last_input.text(), self.cine_mode_combo.currentText(),
+                int(self.min_intensity_input.text()), int(self.max_intensity_input.text()), self.show_overlay_flag,
+                self.show_contour_checkbox.isChecked(), tuple(self.visible_label_colors().items()), self.opacity_slider.value() / 100.0,
+                pyramid_level(volumes, view, self.canvas.panel_size(), 1 if preview else 0))
+
+    # Function to start the cine mode from the current slice: the frame clock, the slice range and the buffer of frames
+    # rendered ahead on a worker thread (CineBuffer)
+    def restart_cine(self):
+        if self.cine_buffer is not None:
+            self.cine_buffer.stop()
+            self.cine_buffer = None
+        self.cine_state = self.cine_settings()
+        (_, view, tri_planar, last_slice, first_text, last_text, mode, min_intensity, max_intensity, show_overlay, show_contour,
+         label_colors, opacity, level) = self.cine_state
+        first = min(int(first_text), last_slice) if first_text else 0
+        last = min(max(int(last_text), first), last_slice) if last_text else last_slice
+        current = self.slider.value()
+        offset = current - first if first <= current <= last else 0
+        self.cine_range = (first, last, mode, offset)
+        self.cine_start = time.perf_counter()
+        self.cine_position = 0
+        self.cine_shown = 0
+        self.cine_dropped = 0
+        self.cine_label_time = 0.0
+
+        # The tri-planar view composites its panes itself
+        volumes = (self.ct_scan, self.ground_truth, self.predicted)
+        if self.ct_scan is not None and not tri_planar:
+            canvas = self.canvas
+            label_colors = dict(label_colors)
+            buffers = {}
+
+            def render(slice_index):
+                return canvas.prepare_frames(slice_index, min_intensity, max_intensity, volumes, view, show_overlay, show_contour,
+                                             label_colors, opacity, level, buffers)
+
+            def slice_at(position):
+                return cine_index(offset + position, first, last, mode)
+
+            frame_bytes = sum(frame.nbytes for _, frame in render(first + offset))
+            capacity = int(np.clip(cine_buffer_bytes // max(frame_bytes, 1), *cine_buffer_slices))
+            self.cine_buffer = CineBuffer(render, slice_at, capacity, start=1)
+        self.show_cine_slice(0, cine_index(offset, first, last, mode))
+
+    # Function to show the slice that is due by the clock. Slices whose time has passed are dropped, so playback
+    # keeps the requested frame rate when rendering is slower, and the event loop is not flooded.
+    def cine_tick(self):
+        if self.cine_settings() != self.cine_state:
+            self.restart_cine()
+            return
+        position = round((time.perf_counter() - self.cine_start) * self.cine_fps)
+        if position <= self.cine_position:
+            return
+        first, last, mode, offset = self.cine_range
+        slice_index = cine_index(offset + position, first, last, mode)
+        if slice_index is None:
+            self.stop_animation()
+            return
+        self.cine_dropped += position - self.cine_position - 1
+        self.cine_position = position
+        self.show_cine_slice(position, slice_index)
+
+    def show_cine_slice(self, position, slice_index):
+        if self.cine_buffer is not None:
+            # Not rendered ahead yet: plot_slices() composites it
+            for key, frame in self.cine_buffer.take(position) or ():
+                self.canvas.frame_cache.put(key, frame)
+        self.slider.setValue(slice_index)
+        self.update_plot()
+        self.cine_shown += 1
+        self.update_cine_label()
+
+    # Function to show the achieved and the requested frames per second, a few times a second
+    def update_cine_label(self):
+        now = time.perf_counter()
+        if now - self.cine_label_time < 0.25:
+            return
+        self.cine_label_time = now
+        elapsed = now - self.cine_start
+        fps = (self.cine_shown - 1) / elapsed if elapsed > 0 else 0.0
+        self.cine_label.setText(f'{fps:.1f} / {self.cine_fps:.1f} FPS, {self.cine_dropped} dropped')
+
+    def hide_overlay(self):
+        self.show_overlay_flag = False
+        self.request_render()
+
+    def show_overlay(self):
+        self.show_overlay_flag = True
+        self.request_render()
+
+    def plot_intensity_histogram(self):
+        if self.ct_scan is None:
+            print('No CT scan data loaded.')
+            return
+        if self.histogram_dialog is None:
+            self.histogram_dialog = HistogramDialog(self)
+            self.histogram_dialog.mask_combo.currentIndexChanged.connect(self.show_histogram)
+        self.update_histogram_masks()
+        self.histogram_dialog.show()
+        self.histogram_dialog.raise_()
+        self.show_histogram()
+
+    def update_histogram_masks(self):
+        if self.histogram_dialog is not None:
+            self.histogram_dialog.set_mask_options(self.subject_labels, self.ground_truth is not None, self.predicted is not None)
+
+    def request_statistics(self, mask):
+        # Statistics are computed once per subject and mask on a background thread, then cached
+        key = (self.loading_subject, mask)
+        if key in self.statistics_cache or key in self.statistics_pending or self.ct_scan is None:
+            return key
+        mask_volume = None
+        if mask is not None:
+            mask_volume = self.ground_truth if mask[0] == 'ground_truth' else self.predicted
+            if mask_volume is None:
+                return key
+        self.statistics_pending.add(key)
+        ct_scan, mask_label = self.ct_scan, mask[1] if mask is not None else None
+
+        def compute():
+            try:
+                counts, values = intensity_histogram(ct_scan, mask_volume, mask_label)
+                self.statistics_ready.emit(key, (counts, values, histogram_statistics(counts, values)))
+            except Exception as e:
+                print(f"Error computing intensity statistics: {e}")
+                self.statistics_ready.emit(key, (None, None, None))
+
+        self.statistics_executor.submit(compute)
+        return key
+
+    def statistics_computed(self, key, result):
+        self.statistics_pending.discard(key)
+        self.statistics_cache[key] = result
+        # Keep the statistics of the last few subjects only
+        while len(self.statistics_cache) > 32:
+            del self.statistics_cache[next(iter(self.statistics_cache))]
+        if self.histogram_dialog is not None and self.histogram_dialog.isVisible() and key == (self.loading_subject, self.histogram_dialog.mask_combo.currentData()):
+            self.histogram_dialog.plot_histogram(*result)
+
+    def show_histogram(self):
+        if self.histogram_dialog is None or not self.histogram_dialog.isVisible():
+            return
+        key = self.request_statistics(self.histogram_dialog.mask_combo.currentData())
+        if key in self.statistics_cache:
+            self.histogram_dialog.plot_histogram(*self.statistics_cache[key])
+        else:
+            self.histogram_dialog.show_message('Computing...')
+
+    def update_shape_label(self):
+        if self.ct_scan is not None:
+            shape_text = f"Shape: {self.ct_scan.shape} | Slice: {self.slider.value()} | {self.memory_text}"
+            if self.tri_planar_radio_button.isChecked() and self.crosshair is not None:
+                shape_text = f"Shape: {self.ct_scan.shape} | Crosshair: {tuple(self.crosshair)} | {self.memory_text}"
+        else:
+            shape_text = "Shape: Not loaded"
+        self.shape_label.setText(shape_text)
+        self.cache_label.setText(self.subject_cache.status_text())
+
+
+          
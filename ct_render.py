@@ -0,0 +1,452 @@
+# Offscreen rendering of the CT / CT + Ground Truth / CT + Prediction panels and the
+# headless batch render command. Shared with the viewer through SlicePanels.
+import os
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import matplotlib.image
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from ct_core import (ContourCache, FrameCache, available_gzip_backends, composite_overlay, dataset_index, default_label_color,
+                     discover_labels, display_aspect, display_slice, error_classes, error_colors, error_slice, expand_subjects,
+                     level_slice, load_subject_data, max_intensity, min_intensity, overlay_lut, profiler, pyramid_level, read_color_table,
+                     view_axes, window_ct_slice, window_presets)
+
+# Titles of the CT / CT + Ground Truth / CT + Prediction panels and of the optional error panel
+panel_titles = ['CT', 'CT + Ground Truth', 'CT + Prediction', 'Errors']
+
+# Function to get the frame cache keys of the windowed CT and the two overlay panels of a slice
+def frame_keys(view, slice_index, level, min_intensity, max_intensity, overlay_colors, opacity):
+    window = (view, slice_index, level, min_intensity, max_intensity)
+    return [(0,) + window] + [(index,) + window + (overlay_colors, opacity) for index in (1, 2)]
+
+# Function to sort the visible labels and their colors (default: labels 1 and 2), and to get those drawn as filled
+# overlays: none when the overlay is hidden or the labels are drawn as contours
+def overlay_label_colors(label_colors, show_overlay, show_contour):
+    if label_colors is None:
+        label_colors = {1: default_label_color(1), 2: default_label_color(2)}
+    label_colors = tuple(sorted(label_colors.items()))
+    return label_colors, label_colors if show_overlay and not show_contour else ()
+
+# The CT / CT + Ground Truth / CT + Prediction panels. Shared by the Qt canvas of the viewer
+# and the headless Agg canvas used for batch export, so both render exactly the same frames.
+# Displays that do not draw with Matplotlib (RasterSliceCanvas) call setup_frames() instead of
+# setup_panels() and override the panel methods (set_panel_image ... set_axes_visibility).
+class SlicePanels:
+
+    def setup_panels(self, fig):
+        self.axes1 = fig.add_subplot(131)
+        self.axes2 = fig.add_subplot(132)
+        self.axes3 = fig.add_subplot(133)
+        # Optional fourth panel with the TP / FP / FN map of the prediction, see set_error_panel()
+        self.axes4 = fig.add_subplot(144)
+        self.axes4.set_visible(False)
+
+        # Artists are created once and then only updated on slice changes
+        self.panels = [self.axes1, self.axes2, self.axes3, self.axes4]
+        self.images = [None, None, None, None]
+        self.contour_collections = [{}, {}, {}, {}]
+        self.no_image_texts = []
+        for axes, title in zip(self.panels, panel_titles):
+            axes.set_title(title, color='white')
+            axes.axis('off')
+            for spine in axes.spines.values():
+                spine.set_edgecolor('white')
+            text = axes.text(0.5, 0.5, 'No Image', color='white', ha='center', va='center', transform=axes.transAxes)
+            text.set_visible(False)
+            self.no_image_texts.append(text)
+        self.setup_frames()
+
+    # Function to set up what does not depend on how the panels are displayed
+    def setup_frames(self):
+        self.show_errors = False
+        self.error_title = None
+        self.image_shapes = [None, None, None, None]
+        # Frame shown by each panel; frames come from the frame cache, so an unchanged panel gets the same object
+        self.panel_frames = [None, None, None, None]
+        # Panels whose image or contours changed since the last draw, and whether anything else (layout,
+        # titles, visibility) changed, which needs a draw of the whole figure; see request_draw()
+        self.dirty_panels = set()
+        self.full_draw_needed = True
+
+        # Composited overlay frames of the current subject, and scratch buffers for compositing
+        self.frame_cache = FrameCache()
+        self.frame_cache_volumes = (None, None, None)
+        self.compositing_buffers = {}
+        # Voxels per error class of each error map frame, e.g. for the panel title
+        self.error_counts = {}
+
+        # Contour lines per (panel, view, slice, label), filled on demand and in the background
+        self.contour_cache = ContourCache()
+        self.contour_precomputed = set()
+        self.precompute_contours = True
+
+    # shape is the full resolution (rows, columns) of the slice; data can be a coarser pyramid level of it,
+    # which is stretched over the same extent so that the axes and contours do not move
+    def set_panel_image(self, index, data, aspect=1.0, shape=None, **kwargs):
+        axes = self.panels[index]
+        image = self.images[index]
+
+        if data is None:
+            if (image is not None and image.get_visible()) or not self.no_image_texts[index].get_visible():
+                self.full_draw_needed = True
+            if image is not None:
+                image.set_visible(False)
+            self.no_image_texts[index].set_visible(True)
+            self.panel_frames[index] = None
+            return None
+
+        if self.no_image_texts[index].get_visible():
+            self.no_image_texts[index].set_visible(False)
+            self.full_draw_needed = True
+        shape = data.shape[:2] if shape is None else tuple(shape)
+        if image is None or self.image_shapes[index] != shape:
+            self.full_draw_needed = True
+            # First frame for this panel, or the slice shape changed (new subject / view)
+            if image is not None:
+                image.remove()
+            image = axes.imshow(data, extent=(-0.5, shape[1] - 0.5, shape[0] - 0.5, -0.5), **kwargs)
+            axes.set_xlim(-0.5, shape[1] - 0.5)
+            axes.set_ylim(shape[0] - 0.5, -0.5)
+            self.images[index] = image
+            self.image_shapes[index] = shape
+        elif data is not self.panel_frames[index]:
+            image.set_data(data)
+            self.dirty_panels.add(index)
+        if not image.get_visible():
+            image.set_visible(True)
+            self.full_draw_needed = True
+        self.panel_frames[index] = data
+        # Height / width of a pixel, from the voxel size
+        if axes.get_aspect() != aspect:
+            axes.set_aspect(aspect)
+            self.full_draw_needed = True
+        return image
+
+    def set_panel_contours(self, index, label_lines, line_width):
+        # One persistent line collection per label; only segments and style change between frames
+        collections = self.contour_collections[index]
+        if label_lines or any(collection.get_visible() for collection in collections.values()):
+            self.dirty_panels.add(index)
+        for label, collection in collections.items():
+            if label not in label_lines:
+                collection.set_visible(False)
+        for label, (lines, color) in label_lines.items():
+            collection = collections.get(label)
+            if collection is None:
+                collection = LineCollection([], zorder=3)
+                self.panels[index].add_collection(collection, autolim=False)
+                collections[label] = collection
+            collection.set_segments(lines)
+            collection.set_color(color)
+            collection.set_linewidth(line_width)
+            collection.set_visible(True)
+
+    def set_error_panel(self, show_errors):
+        # Lay the panels out in three or four columns
+        if show_errors == self.show_errors:
+            return
+        self.show_errors = show_errors
+        self.full_draw_needed = True
+        grid = self.figure.add_gridspec(1, 4 if show_errors else 3)
+        for column, axes in enumerate(self.panels[:grid.ncols]):
+            axes.set_subplotspec(grid[column])
+        self.axes4.set_visible(show_errors)
+
+    # The map is drawn at the pyramid level of the other panels (gt_slice, pred_slice); the counts in the title
+    # always come from the full resolution slices (full_slices) and are not computed during a preview
+    def plot_error_panel(self, slice_index, view, ct_slice, gt_slice, pred_slice, window, label_colors, show_overlay, opacity, aspect=1.0,
+                         level=0, full_slices=None, preview=False):
+        if ct_slice is None or gt_slice is None or pred_slice is None:
+            self.set_panel_image(3, None)
+            title = 'Errors'
+        else:
+            visible_labels = tuple(label for label, _ in label_colors)
+            full_slices = full_slices or (gt_slice, pred_slice)
+            key = (3, view, slice_index, level, window, visible_labels, show_overlay, opacity)
+            frame = self.frame_cache.get(key)
+            classes = None
+            if frame is None:
+                with profiler.timer('composite'):
+                    classes = error_slice(gt_slice, pred_slice, visible_labels)
+                    lut = overlay_lut(error_colors if show_overlay else (), opacity)
+                    frame = composite_overlay(ct_slice, classes, lut, self.compositing_buffers)
+                self.frame_cache.put(key, frame)
+            count_key = (view, slice_index, visible_labels)
+            if count_key not in self.error_counts and not preview:
+                if classes is None or level != 0:
+                    classes = error_slice(*full_slices, visible_labels)
+                self.error_counts[count_key] = np.bincount(classes.ravel(), minlength=len(error_classes) + 1)
+            self.set_panel_image(3, frame, aspect, full_slices[0].shape)
+            title = 'Errors'
+            if count_key in self.error_counts:
+                title = 'Errors: ' + ' | '.join(f'{name} {count}' for name, count in zip(error_classes[1:], self.error_counts[count_key][2:]))
+        if title != self.error_title:
+            self.error_title = title
+            self.full_draw_needed = True
+            self.set_panel_title(3, title)
+
+    def set_panel_title(self, index, title):
+        self.panels[index].set_title(title, color='white')
+
+    # Function to get the (height, width) in screen pixels of a slice panel
+    def panel_size(self):
+        bbox = self.axes1.bbox
+        return max(int(bbox.height), 1), max(int(bbox.width), 1)
+
+    # Large volumes with a pyramid (see build_pyramid) are drawn from the level that matches the panel size on
+    # screen, and from a coarser level when preview is set (fast scrolling, animation)
+    def plot_slices(self, slice_index, min_intensity, max_intensity, ct_scan, ground_truth, predicted=None, show_overlay=True, view='axial', show_contour=False, label_colors=None, opacity=0.5, line_width=0.7, show_errors=False, preview=False):
+        volumes = (ct_scan, ground_truth, predicted)
+        level = pyramid_level(volumes, view, self.panel_size(), 1 if preview else 0)
+        # label_colors maps each visible label to its (r, g, b) color
+        label_colors, overlay_colors = overlay_label_colors(label_colors, show_overlay, show_contour)
+        keys = frame_keys(view, slice_index, level, min_intensity, max_intensity, overlay_colors, opacity)
+        # Windowed slices and overlays are composited with a label LUT and cached, so revisiting a slice costs nothing
+        if any(volume is not cached for volume, cached in zip(volumes, self.frame_cache_volumes)):
+            self.frame_cache.clear()
+            self.contour_cache.clear()
+            self.contour_precomputed = set()
+            self.error_counts = {}
+            self.frame_cache_volumes = volumes
+        # Slices are views; the time goes into windowing, which reads the CT slice from the volume
+        with profiler.timer('slice'):
+            full_slices = [display_slice(volume, view, slice_index) for volume in volumes]
+            shape = full_slices[0].shape if ct_scan is not None else None
+            if level == 0:
+                ct_slice, gt_slice, pred_slice = full_slices
+            else:
+                ct_slice, gt_slice, pred_slice = (level_slice(volume, view, slice_index, level) for volume in volumes)
+
+            # Window the raw slice for display; the volume itself is never rescaled
+            if ct_slice is not None:
+                windowed = self.frame_cache.get(keys[0])
+                if windowed is None:
+                    windowed = window_ct_slice(ct_slice, min_intensity, max_intensity)
+                    self.frame_cache.put(keys[0], windowed)
+                ct_slice = windowed
+
+        aspect = display_aspect(ct_scan, view)
+        self.set_panel_image(0, ct_slice, aspect, shape, cmap='gray', vmin=0, vmax=255)
+
+        lut = overlay_lut(overlay_colors, opacity)
+        for index, volume, label_slice in ((1, ground_truth, gt_slice), (2, predicted, pred_slice)):
+            if ct_scan is None or volume is None:
+                self.set_panel_image(index, None)
+                continue
+
+            frame = self.frame_cache.get(keys[index])
+            if frame is None:
+                with profiler.timer('composite'):
+                    frame = composite_overlay(ct_slice, label_slice, lut, self.compositing_buffers)
+                self.frame_cache.put(keys[index], frame)
+            self.set_panel_image(index, frame, aspect, shape)
+
+            label_lines = {}
+            if show_contour:
+                with profiler.timer('contour'):
+                    if self.precompute_contours and (index, view) not in self.contour_precomputed:
+                        self.contour_precomputed.add((index, view))
+                        self.contour_cache.precompute(index, volume, view, [label for label, _ in label_colors])
+                    for label, color in label_colors:
+                        # Contours are always traced at full resolution
+                        label_lines[label] = (self.contour_cache.get(index, volume, view, slice_index, label, full_slices[index]), color)
+            self.set_panel_contours(index, label_lines, line_width)
+
+        self.set_error_panel(show_errors)
+        if show_errors:
+            self.plot_error_panel(slice_index, view, ct_slice if ct_scan is not None else None, gt_slice, pred_slice,
+                                  (min_intensity, max_intensity), label_colors, show_overlay, opacity, aspect, level, full_slices[1:], preview)
+
+        self.request_draw()
+
+    # Function to window and composite the panels of a slice like plot_slices() does, without the figure or the
+    # frame cache, e.g. ahead of playback on the worker thread of the cine mode (with its own buffers).
+    # Returns the (frame cache key, frame) pairs to put into the frame cache before plot_slices().
+    def prepare_frames(self, slice_index, min_intensity, max_intensity, volumes, view, show_overlay, show_contour, label_colors, opacity,
+                       level, buffers):
+        ct_scan = volumes[0]
+        if ct_scan is None:
+            return []
+        label_colors, overlay_colors = overlay_label_colors(label_colors, show_overlay, show_contour)
+        keys = frame_keys(view, slice_index, level, min_intensity, max_intensity, overlay_colors, opacity)
+        ct_slice = window_ct_slice(level_slice(ct_scan, view, slice_index, level), min_intensity, max_intensity)
+        frames = [(keys[0], ct_slice)]
+        lut = overlay_lut(overlay_colors, opacity)
+        for index in (1, 2):
+            if volumes[index] is not None:
+                frames.append((keys[index], composite_overlay(ct_slice, level_slice(volumes[index], view, slice_index, level), lut, buffers)))
+        return frames
+
+    # Function to draw the changes of plot_slices. Canvases that can redraw single panels override it.
+    def request_draw(self):
+        self.dirty_panels = set()
+        self.full_draw_needed = False
+        self.draw_idle()
+
+    def set_axes_visibility(self, show_ground_truth, show_prediction):
+        # Drawn with the next plot_slices()
+        if (self.axes2.get_visible(), self.axes3.get_visible()) != (show_ground_truth, show_prediction):
+            self.axes2.set_visible(show_ground_truth)
+            self.axes3.set_visible(show_prediction)
+            self.full_draw_needed = True
+
+# Offscreen canvas for rendering without a display (batch export)
+class AggSliceCanvas(SlicePanels, FigureCanvasAgg):
+
+    def __init__(self, width=15, height=5, dpi=100):
+        fig = Figure(figsize=(width, height), dpi=dpi, facecolor='black')
+        super(AggSliceCanvas, self).__init__(fig)
+        self.setup_panels(fig)
+        self.precompute_contours = False
+
+    def draw_idle(self, *args, **kwargs):
+        # Frames are drawn explicitly by render_frame() or the animation writer
+        pass
+
+    def render_frame(self):
+        with profiler.timer('draw'):
+            self.draw()
+        return np.asarray(self.buffer_rgba()).copy()
+
+# Function to pick the slice indices to render: 'start:stop:step' or count evenly spaced slices
+def select_slices(num_slices, slice_range=None, count=12):
+    if slice_range:
+        bounds = [int(value) if value else None for value in (slice_range.split(':') + ['', ''])[:3]]
+        return list(range(num_slices))[slice(*bounds)]
+    return sorted(set(np.linspace(0, num_slices - 1, min(count, num_slices)).round().astype(int).tolist()))
+
+# Function to check a --slices value (start:stop:step, each part optional) while the arguments are parsed
+def slice_range_argument(value):
+    parts = value.split(':')
+    try:
+        bounds = [int(part) if part else None for part in parts]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not start:stop:step with whole numbers")
+    if len(bounds) > 3 or (len(bounds) == 3 and bounds[2] == 0):
+        raise argparse.ArgumentTypeError(f"'{value}' is not start:stop:step with a step other than 0")
+    return value
+
+# Function to check a count that must be at least 1 while the arguments are parsed
+def positive_int_argument(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a whole number")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{number} is not at least 1")
+    return number
+
+# Function to render the chosen views of one subject to PNG montages, GIF or MP4 (runs in a worker process)
+def render_subject(subject_name, options):
+    start = time.perf_counter()
+    ct_scan, ground_truth, predicted = load_subject_data(subject_name, backend=options.backend, verbose=options.verbose,
+                                                         index=dataset_index(options.manifest))
+    if ct_scan is None:
+        return subject_name, 0, time.perf_counter() - start, []
+
+    color_table = read_color_table('labels.txt') if os.path.exists('labels.txt') else {}
+    labels = list(color_table) if color_table else discover_labels(ground_truth, predicted)
+    label_colors = {label: color_table[label][1] if label in color_table else default_label_color(label) for label in labels}
+
+    canvas = AggSliceCanvas(width=options.width, height=options.width / 3, dpi=options.dpi)
+    canvas.set_axes_visibility(ground_truth is not None, predicted is not None)
+    outputs = []
+    frames = 0
+    for view in options.views:
+        num_slices = ct_scan.shape[view_axes[view]]
+        slice_indices = select_slices(num_slices, options.slices, options.count)
+        if not slice_indices:
+            raise ValueError(f"--slices {options.slices} selects none of the {num_slices} {view} slices")
+        path = os.path.join(options.output, f'{subject_name}_{view}.{options.format}')
+
+        def plot(slice_index):
+            canvas.plot_slices(slice_index, options.window[0], options.window[1], ct_scan, ground_truth, predicted,
+                               not options.no_overlay, view, options.contour, label_colors, options.opacity, options.line_width,
+                               options.errors)
+
+        if options.format == 'png':
+            images = []
+            for slice_index in slice_indices:
+                plot(slice_index)
+                images.append(canvas.render_frame())
+            rows = -(-len(images) // options.columns)
+            height, width = images[0].shape[:2]
+            montage = np.zeros((rows * height, options.columns * width, 4), dtype=np.uint8)
+            montage[..., 3] = 255
+            for position, image in enumerate(images):
+                row, column = divmod(position, options.columns)
+                montage[row * height:(row + 1) * height, column * width:(column + 1) * width] = image
+            matplotlib.image.imsave(path, montage)
+        else:
+            from matplotlib.animation import FFMpegWriter, PillowWriter
+            writer = PillowWriter(fps=options.fps) if options.format == 'gif' else FFMpegWriter(fps=options.fps)
+            with writer.saving(canvas.figure, path, options.dpi):
+                for slice_index in slice_indices:
+                    plot(slice_index)
+                    writer.grab_frame()
+        frames += len(slice_indices)
+        outputs.append(path)
+    return subject_name, frames, time.perf_counter() - start, outputs
+
+# Headless batch export, e.g. for nightly QA:
+#   python viewer.py render 'SUB_0*' --views axial coronal --format gif --workers 8
+def render_command(args):
+    parser = argparse.ArgumentParser(prog='viewer.py render', description='Render CT / CT + Ground Truth / CT + Prediction slices without a display.')
+    parser.add_argument('subjects', nargs='*', default=['*'], help='subject names or glob patterns (default: every subject in CT)')
+    parser.add_argument('--subjects-file', help='file with one subject name per line')
+    parser.add_argument('--manifest', help='dataset manifest (.csv or .json) to use instead of scanning the folders')
+    parser.add_argument('--views', nargs='+', default=['axial'], choices=list(view_axes), help='views to render (default: axial)')
+    parser.add_argument('--slices', type=slice_range_argument, help="slice range as start:stop:step (default: --count evenly spaced slices)")
+    parser.add_argument('--count', type=positive_int_argument, default=12, help='number of evenly spaced slices when --slices is not given')
+    parser.add_argument('--format', default='png', choices=['png', 'gif', 'mp4'], help='PNG montage, GIF or MP4 (needs ffmpeg)')
+    parser.add_argument('--output', default='renders', help='output folder (default: renders)')
+    parser.add_argument('--window', nargs=2, type=int, default=[min_intensity, max_intensity], metavar=('MIN', 'MAX'), help='intensity window')
+    parser.add_argument('--preset', choices=list(window_presets), help='window preset, overrides --window')
+    parser.add_argument('--contour', action='store_true', help='draw label contours instead of filled overlays')
+    parser.add_argument('--no-overlay', action='store_true', help='do not draw labels')
+    parser.add_argument('--errors', action='store_true', help='add a fourth panel with the TP / FP / FN map of the prediction')
+    parser.add_argument('--opacity', type=float, default=0.75, help='overlay opacity (default: 0.75)')
+    parser.add_argument('--line-width', type=float, default=1.1, help='contour line width (default: 1.1)')
+    parser.add_argument('--columns', type=positive_int_argument, default=3, help='frames per row in PNG montages (default: 3)')
+    parser.add_argument('--fps', type=positive_int_argument, default=10, help='frames per second for GIF/MP4 (default: 10)')
+    parser.add_argument('--width', type=float, default=15, help='frame width in inches (default: 15)')
+    parser.add_argument('--dpi', type=int, default=100, help='frame resolution (default: 100)')
+    parser.add_argument('--backend', default='zlib', choices=available_gzip_backends(), help='gzip decompression backend')
+    parser.add_argument('--workers', type=positive_int_argument, default=os.cpu_count() or 1, help='worker processes (default: all cores)')
+    parser.add_argument('--verbose', action='store_true', help='print the load-time breakdown of every file')
+    options = parser.parse_args(args)
+    if options.preset:
+        options.window = list(window_presets[options.preset])
+
+    patterns = list(options.subjects)
+    if options.subjects_file:
+        with open(options.subjects_file) as f:
+            patterns = [line.strip() for line in f if line.strip()]
+    missing = []
+    subjects = expand_subjects(patterns, dataset_index(options.manifest).ct_subjects, missing)
+    for subject_name in missing:
+        print(f"{subject_name}: no CT volume, skipped")
+    os.makedirs(options.output, exist_ok=True)
+
+    start = time.perf_counter()
+    total_frames = 0
+    rendered = 0
+    with ProcessPoolExecutor(max_workers=options.workers) as executor:
+        futures = {executor.submit(render_subject, subject_name, options): subject_name for subject_name in subjects}
+        for count, future in enumerate(as_completed(futures), 1):
+            try:
+                subject_name, frames, seconds, outputs = future.result()
+            except Exception as e:
+                print(f"[{count}/{len(subjects)}] {futures[future]}: failed: {e}")
+                continue
+            total_frames += frames
+            rendered += 1 if frames else 0
+            print(f"[{count}/{len(subjects)}] {subject_name}: {frames} frames in {seconds:.1f}s -> {', '.join(outputs) or 'no CT'}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Rendered {rendered} of {len(subjects)} subjects ({total_frames} frames) in {elapsed:.1f}s: "
+          f"{rendered / elapsed * 60 if elapsed > 0 else 0:.1f} subjects/min, {total_frames / elapsed if elapsed > 0 else 0:.1f} frames/s")
+    return 0
@@ -0,0 +1,16 @@
+# The modules of the viewer are imported from the repository root; caches go to a temporary folder
+import os
+import sys
+
+import matplotlib
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+matplotlib.use('Agg')
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('CT_VIEWER_CACHE', str(path))
+    return path
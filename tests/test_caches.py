@@ -0,0 +1,140 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from ct_core import FrameCache, SubjectCache, VolumeCache, track_peak_memory, volume_with
+
+
+@pytest.fixture
+def volume_cache(tmp_path):
+    cache = VolumeCache(str(tmp_path / 'volumes'))
+    yield cache
+    cache.shutdown()
+
+
+def source_file(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(name.encode())
+    return str(path)
+
+
+def test_volume_cache_round_trip(tmp_path, volume_cache):
+    path = source_file(tmp_path, 'SUB_001.nii.gz')
+    assert volume_cache.load(path) is None
+    volume = volume_with(np.arange(24, dtype=np.int16).reshape(2, 3, 4), spacing=(0.8, 0.8, 2.5))
+    volume_cache.store(path, volume)
+    cached = volume_cache.load(path)
+    assert np.array_equal(cached, volume) and cached.dtype == np.int16
+    assert cached.spacing == (0.8, 0.8, 2.5)
+    # One copy per axis with that axis first
+    for axis, axis_copy in cached.axis_copies.items():
+        assert np.array_equal(axis_copy, np.moveaxis(volume, axis, 0))
+        assert axis_copy.flags.c_contiguous
+
+
+def test_volume_cache_misses_a_changed_file(tmp_path, volume_cache):
+    path = source_file(tmp_path, 'SUB_001.nii.gz')
+    volume_cache.store(path, np.zeros((2, 2, 2), dtype=np.uint8))
+    with open(path, 'ab') as f:
+        f.write(b'changed')
+    assert volume_cache.load(path) is None
+
+
+def test_volume_cache_evicts_the_oldest_entries(tmp_path, volume_cache):
+    volume_cache.max_size = 1
+    paths = [source_file(tmp_path, f'SUB_00{i}.nii.gz') for i in range(3)]
+    for age, path in enumerate(paths):
+        volume_cache.store(path, np.zeros((4, 4, 4), dtype=np.int16))
+        os.utime(volume_cache.entry_dir(path), (1000 + age, 1000 + age))
+    # The most recent entry is kept even though it alone is over the cap
+    assert [volume_cache.load(path) is not None for path in paths] == [False, False, True]
+
+
+def test_eviction_keeps_the_other_cache_files(tmp_path, volume_cache):
+    profile = tmp_path / 'volumes' / 'profiles' / 'profile.json'
+    profile.parent.mkdir(parents=True)
+    profile.write_text('{}')
+    volume_cache.max_size = 1
+    for i in range(2):
+        volume_cache.store(source_file(tmp_path, f'SUB_00{i}.nii.gz'), np.zeros((4, 4, 4), dtype=np.int16))
+    assert profile.exists()
+    assert len(volume_cache.entries()) == 1
+
+
+def test_eviction_keeps_the_benchmark_volumes(tmp_path, cache_dir):
+    # Where viewer.py benchmark generates its volumes by default
+    volume = cache_dir / 'benchmark' / 'small-0-ct.nii.gz'
+    volume.parent.mkdir(parents=True)
+    volume.write_bytes(b'volume')
+    volume_cache = VolumeCache(max_size_gb=0)
+    try:
+        for i in range(2):
+            volume_cache.store(source_file(tmp_path, f'SUB_00{i}.nii.gz'), np.zeros((4, 4, 4), dtype=np.int16))
+    finally:
+        volume_cache.shutdown()
+    assert volume.exists()
+    assert len(volume_cache.entries()) == 1
+
+
+def test_frame_cache_is_bounded():
+    frames = FrameCache(max_bytes=250)
+    for key in 'abc':
+        frames.put(key, np.zeros(100, dtype=np.uint8))
+    assert frames.get('a') is None and frames.get('c') is not None
+    assert frames.size == 200
+
+
+def subject_entry(megabytes):
+    return (np.zeros(megabytes * 2**20, dtype=np.uint8), None, None), {}
+
+
+def test_subject_cache_keeps_the_shown_subject():
+    cache = SubjectCache(budget_mb=20)
+    try:
+        cache.put('SUB_001', subject_entry(8))
+        cache.put('SUB_002', subject_entry(8))
+        cache.current = 'SUB_001'
+        cache.put('SUB_003', subject_entry(8))
+        assert list(cache.entries) == ['SUB_001', 'SUB_003']
+    finally:
+        cache.shutdown()
+
+
+def test_subject_cache_evicts_prefetched_subjects_first():
+    cache = SubjectCache(budget_mb=20)
+    try:
+        cache.put('SUB_002', subject_entry(8))
+        cache.current = 'SUB_002'
+        cache.put('SUB_003', subject_entry(8), prefetched=True)
+        cache.put('SUB_001', subject_entry(8), prefetched=True)
+        assert list(cache.entries) == ['SUB_002', 'SUB_001']
+        # Showing a prefetched subject makes it an ordinary entry
+        assert cache.peek('SUB_001') is not None
+        assert cache.prefetched == set()
+    finally:
+        cache.shutdown()
+
+
+def test_overlapping_loads_keep_their_peak():
+    stats_a, stats_b = {}, {}
+    started, finished = threading.Event(), threading.Event()
+
+    def load_a():
+        with track_peak_memory(stats_a):
+            data = np.ones(50 * 2**20, dtype=np.uint8)
+            started.set()
+            finished.wait(10)
+            del data
+
+    thread = threading.Thread(target=load_a)
+    thread.start()
+    started.wait(10)
+    with track_peak_memory(stats_b):
+        pass
+    finished.set()
+    thread.join()
+    # The second load starting and ending must not reset the peak of the first
+    assert stats_a['peak'] >= 50 * 2**20
+    assert stats_b['peak'] >= 50 * 2**20
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from ct_core import CineBuffer, cine_index
+
+
+def test_cine_modes():
+    assert [cine_index(position, 5, 7) for position in range(6)] == [5, 6, 7, 5, 6, 7]
+    assert [cine_index(position, 5, 7, 'Bounce') for position in range(7)] == [5, 6, 7, 6, 5, 6, 7]
+    assert [cine_index(position, 5, 7, 'Once') for position in range(4)] == [5, 6, 7, None]
+    assert [cine_index(position, 3, 3, 'Bounce') for position in range(3)] == [3, 3, 3]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail('timed out')
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def buffer_of(request):
+    buffers = []
+
+    def make(*args, **kwargs):
+        buffers.append(CineBuffer(*args, **kwargs))
+        return buffers[-1]
+
+    yield make
+    for buffer in buffers:
+        buffer.stop()
+
+
+def positions(buffer):
+    with buffer.condition:
+        return [position for position, _ in buffer.frames]
+
+
+def test_buffer_renders_ahead_up_to_its_capacity(buffer_of):
+    buffer = buffer_of(lambda slice_index: ('frame', slice_index), lambda position: position + 10, capacity=4, start=1)
+    wait_for(lambda: len(positions(buffer)) == 4)
+    assert positions(buffer) == [1, 2, 3, 4]
+    assert buffer.take(1) == ('frame', 11)
+    wait_for(lambda: positions(buffer) == [2, 3, 4, 5])
+
+
+def test_take_drops_skipped_frames(buffer_of):
+    buffer = buffer_of(lambda slice_index: slice_index, lambda position: position, capacity=4, start=1)
+    wait_for(lambda: len(positions(buffer)) == 4)
+    assert buffer.take(3) == 3
+    wait_for(lambda: positions(buffer) == [4, 5, 6, 7])
+
+
+def test_late_playback_skips_ahead(buffer_of):
+    buffer = buffer_of(lambda slice_index: slice_index, lambda position: position, capacity=2)
+    wait_for(lambda: len(positions(buffer)) == 2)
+    # Frames behind playback are not rendered: the worker continues after the position taken
+    assert buffer.take(100) is None
+    wait_for(lambda: positions(buffer) == [101, 102])
+
+
+def test_buffer_ends_with_the_playback(buffer_of):
+    buffer = buffer_of(lambda slice_index: slice_index, lambda position: cine_index(position, 0, 2, 'Once'), capacity=8)
+    buffer.thread.join(5)
+    assert positions(buffer) == [0, 1, 2]
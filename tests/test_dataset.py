@@ -0,0 +1,80 @@
+import csv
+import os
+
+from ct_core import DatasetIndex, evaluated_list_path, evaluated_subjects, expand_subjects
+
+
+def make_dataset(root, volumes):
+    for folder, subjects in volumes.items():
+        (root / folder).mkdir(exist_ok=True)
+        for subject_name in subjects:
+            (root / folder / f'{subject_name}.nii.gz').write_bytes(b'')
+    return DatasetIndex(root=str(root), cache_dir=str(root / 'cache'))
+
+
+def test_index_sorts_subjects_naturally(tmp_path):
+    index = make_dataset(tmp_path, {'CT': ['SUB_10', 'SUB_2', 'SUB_1'], 'Ground_truth': ['SUB_2', 'SUB_3'], 'Predicted': []})
+    assert index.subjects == ['SUB_1', 'SUB_2', 'SUB_3', 'SUB_10']
+    assert index.ct_subjects == ['SUB_1', 'SUB_2', 'SUB_10']
+    assert index.available('SUB_2') == (True, True, False)
+    assert index.available('SUB_3') == (False, True, False)
+
+
+def test_shift_skips_subjects_without_ct(tmp_path):
+    index = make_dataset(tmp_path, {'CT': ['SUB_1', 'SUB_2', 'SUB_10'], 'Ground_truth': ['SUB_3'], 'Predicted': []})
+    assert index.shift('SUB_2', 1) == 'SUB_10'
+    assert index.shift('SUB_2', -1) == 'SUB_1'
+    assert index.shift('SUB_1', 2) == 'SUB_10'
+    # Clamped at both ends
+    assert index.shift('SUB_1', -1) == 'SUB_1'
+    assert index.shift('SUB_10', 5) == 'SUB_10'
+    # Names outside the index are placed by their natural order
+    assert index.shift('SUB_3', 1) == 'SUB_10'
+    assert index.shift('SUB_3', -1) == 'SUB_2'
+
+
+def test_neighbours_nearest_first(tmp_path):
+    index = make_dataset(tmp_path, {'CT': [f'SUB_{i}' for i in range(1, 6)], 'Ground_truth': [], 'Predicted': []})
+    assert index.neighbours('SUB_3', 2) == ['SUB_4', 'SUB_2', 'SUB_5', 'SUB_1']
+    assert index.neighbours('SUB_1', 2) == ['SUB_2', 'SUB_3']
+    assert index.neighbours('SUB_5') == ['SUB_4']
+
+
+def test_index_cache_is_written_through_a_file_of_this_process(tmp_path, monkeypatch):
+    replaced = []
+    replace = os.replace
+    monkeypatch.setattr(os, 'replace', lambda source, target: replaced.append(source) or replace(source, target))
+    index = make_dataset(tmp_path, {'CT': ['SUB_1'], 'Ground_truth': [], 'Predicted': []})
+    # Worker processes can share thread ids, so the temporary file carries the process id too
+    assert replaced and all(f'.tmp{os.getpid()}-' in path for path in replaced)
+    assert os.listdir(os.path.dirname(index.cache_path)) == [os.path.basename(index.cache_path)]
+
+def test_index_reads_a_manifest(tmp_path):
+    manifest = tmp_path / 'dataset.csv'
+    manifest.write_text('subject,ct,ground_truth,predicted\nA,ct/a.nii.gz,gt/a.nii.gz,\nB,ct/b.nii.gz,,\n')
+    index = DatasetIndex(manifest=str(manifest), cache_dir=str(tmp_path / 'cache'))
+    assert index.subjects == ['A', 'B']
+    assert index.volume_path('A', 'Ground_truth') == str(tmp_path / 'gt' / 'a.nii.gz')
+    assert index.volume_path('A', 'Predicted') is None
+    assert index.volume_path('C', 'CT') is None
+
+
+def test_expand_subjects():
+    available = ['SUB_001', 'SUB_002', 'SUB_010']
+    assert expand_subjects(['SUB_00*', 'SUB_001'], available) == ['SUB_001', 'SUB_002']
+    # Plain names are checked against the available subjects too
+    missing = []
+    assert expand_subjects(['SUB_010', 'SUB_004', 'SUB_004'], available, missing) == ['SUB_010']
+    assert missing == ['SUB_004']
+
+
+def test_evaluated_subjects_include_subjects_without_rows(tmp_path):
+    csv_path = str(tmp_path / 'metrics.csv')
+    assert evaluated_subjects(csv_path) == set()
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['subject', 'label', 'dice'])
+        writer.writerow(['SUB_001', 1, 0.9])
+    with open(evaluated_list_path(csv_path), 'w') as f:
+        f.write('SUB_001\nSUB_002\n')
+    assert evaluated_subjects(csv_path) == {'SUB_001', 'SUB_002'}
@@ -0,0 +1,107 @@
+import nibabel as nib
+import numpy as np
+import pytest
+
+from ct_core import (composite_overlay, histogram_statistics, intensity_histogram, load_nii, overlay_lut, read_color_table,
+                     resident_memory, window_ct_slice, window_lut)
+
+
+def test_window_int16_uses_the_raw_bits():
+    ct_slice = np.array([-32768, -1024, 0, 40, 80, 32767], dtype=np.int16)
+    assert window_ct_slice(ct_slice, 0, 80).tolist() == [0, 0, 0, 128, 255, 255]
+    # The table is rolled so that it is indexed with the unsigned view of the values
+    lut = window_lut(np.dtype(np.int16), 0, 80)
+    assert lut[np.array([40], dtype=np.int16).view(np.uint16)[0]] == 128
+
+
+def test_window_matches_the_float_path():
+    ct_slice = np.arange(-200, 300, dtype=np.int16).reshape(20, 25)
+    expected = window_ct_slice(ct_slice.astype(np.float32), -160, 240)
+    assert np.array_equal(window_ct_slice(ct_slice, -160, 240), expected)
+    assert np.array_equal(window_ct_slice(ct_slice.astype(np.uint8), 0, 255), ct_slice.astype(np.uint8))
+
+
+def test_composite_overlay_blends_only_the_labelled_pixels():
+    gray = np.full((2, 2), 100, dtype=np.uint8)
+    labels = np.array([[0, 1], [2, 0]], dtype=np.uint8)
+    lut = overlay_lut(((1, (1.0, 0.0, 0.0)), (2, (0.0, 0.0, 1.0))), 0.5)
+    frame = composite_overlay(gray, labels, lut)
+    assert frame.dtype == np.uint8 and frame.shape == (2, 2, 4)
+    assert frame[0, 0].tolist() == [100, 100, 100, 255]
+    # 8.8 fixed point: (255 * 128 + 100 * 128) >> 8 and (100 * 128) >> 8
+    assert frame[0, 1].tolist() == [177, 50, 50, 255]
+    assert frame[1, 0].tolist() == [50, 50, 177, 255]
+
+
+def test_overlay_lut_without_labels_keeps_the_gray_levels():
+    gray = np.arange(256, dtype=np.uint8).reshape(16, 16)
+    frame = composite_overlay(gray, np.ones((16, 16), dtype=np.uint8), overlay_lut((), 0.75))
+    assert np.array_equal(frame[..., 0], gray)
+
+
+def test_histogram_statistics_match_numpy():
+    rng = np.random.default_rng(0)
+    volume = rng.integers(-1000, 1000, (8, 16, 16)).astype(np.int16)
+    counts, values = intensity_histogram(volume, chunk_voxels=300)
+    statistics = histogram_statistics(counts, values)
+    assert statistics['count'] == volume.size
+    assert statistics['mean'] == pytest.approx(volume.mean())
+    assert statistics['std'] == pytest.approx(volume.std())
+    assert (statistics['min'], statistics['max']) == (volume.min(), volume.max())
+    for q, value in statistics['percentiles'].items():
+        assert value == pytest.approx(np.percentile(volume, q))
+
+
+def test_histogram_of_a_label_mask():
+    volume = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+    mask = np.zeros(volume.shape, dtype=np.uint8)
+    mask[1, 2] = 3
+    counts, values = intensity_histogram(volume, mask, 3)
+    assert values[counts > 0].tolist() == [20, 21, 22, 23]
+    assert histogram_statistics(*intensity_histogram(volume, mask, 5)) is None
+
+
+def save_scaled(path, raw, slope, inter, affine=np.eye(4)):
+    img = nib.Nifti1Image(raw, affine)
+    img.header.set_slope_inter(slope, inter)
+    nib.save(img, str(path))
+
+
+def test_integral_scaling_keeps_integers(tmp_path):
+    raw = np.array([0, 100, 2000], dtype=np.int16).reshape(1, 1, 3)
+    save_scaled(tmp_path / 'ct.nii', raw, 1, -1024)
+    volume = load_nii(str(tmp_path / 'ct.nii'))
+    assert volume.dtype.kind == 'i'
+    assert np.asarray(volume).ravel().tolist() == [-1024, -924, 976]
+
+
+def test_fractional_scaling_gives_float32(tmp_path):
+    raw = np.array([0, 1, 2], dtype=np.int16).reshape(1, 1, 3)
+    save_scaled(tmp_path / 'ct.nii', raw, 0.5, 10)
+    volume = load_nii(str(tmp_path / 'ct.nii'))
+    assert volume.dtype == np.float32
+    assert np.asarray(volume).ravel().tolist() == [10.0, 10.5, 11.0]
+
+
+def test_volumes_are_reoriented_with_their_voxel_size(tmp_path):
+    raw = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+    # RAS voxel axes with 0.8 x 0.9 x 2.5 mm voxels become LPS: the first two axes are flipped
+    save_scaled(tmp_path / 'ct.nii', raw, 1, 0, np.diag([0.8, 0.9, 2.5, 1.0]))
+    volume = load_nii(str(tmp_path / 'ct.nii'))
+    assert volume.spacing == pytest.approx((0.8, 0.9, 2.5))
+    assert np.array_equal(volume, raw[::-1, ::-1, :])
+
+
+@pytest.mark.parametrize('affine', [np.diag([-1.0, -1.0, 1.0, 1.0]), np.eye(4)])
+def test_uncompressed_volumes_stay_memory_mapped(tmp_path, affine):
+    raw = np.zeros((20, 30, 40), dtype=np.int16)
+    for name in ('ct.nii', 'ct.nii.gz'):
+        nib.save(nib.Nifti1Image(raw, affine), str(tmp_path / name))
+    # Reoriented or not, a memory-mapped volume is paged in on demand and takes no RAM up front
+    assert resident_memory(load_nii(str(tmp_path / 'ct.nii'))) == 0
+    assert resident_memory(load_nii(str(tmp_path / 'ct.nii.gz'))) == raw.nbytes
+
+def test_color_table_skips_the_background(tmp_path):
+    path = tmp_path / 'labels.txt'
+    path.write_text('# Slicer color table\n0 Background 0 0 0 0\n1 Liver 255 0 0 255\n2 Spleen 0 0 255 255\n')
+    assert read_color_table(str(path)) == {1: ('Liver', (1.0, 0.0, 0.0)), 2: ('Spleen', (0.0, 0.0, 1.0))}
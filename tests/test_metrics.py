@@ -0,0 +1,139 @@
+import csv
+import math
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from ct_core import (MetricsCache, error_slice, evaluate_command, evaluated_subjects, segmentation_metrics, slice_dice, slice_errors,
+                     surface_distances)
+
+
+def cubes(shift=1):
+    ground_truth = np.zeros((10, 10, 10), dtype=np.uint8)
+    predicted = np.zeros_like(ground_truth)
+    ground_truth[2:6, 2:6, 2:6] = 1
+    predicted[2 + shift:6 + shift, 2:6, 2:6] = 1
+    return ground_truth, predicted
+
+
+def test_overlap_and_volumes():
+    ground_truth, predicted = cubes()
+    metrics = segmentation_metrics(ground_truth, predicted, [1], spacing=(2, 1, 1), surface=False)['metrics'][1]
+    assert metrics['dice'] == pytest.approx(0.75)
+    assert metrics['iou'] == pytest.approx(0.6)
+    # 64 voxels of 2 mm^3, in mL
+    assert metrics['ground_truth_volume'] == pytest.approx(0.128)
+    assert metrics['predicted_volume'] == pytest.approx(0.128)
+    assert metrics['volume_difference'] == pytest.approx(0.0)
+
+
+def test_chunked_counts_match():
+    rng = np.random.default_rng(1)
+    ground_truth = rng.integers(0, 3, (6, 7, 8)).astype(np.uint8)
+    predicted = rng.integers(0, 3, (6, 7, 8)).astype(np.uint8)
+    whole = segmentation_metrics(ground_truth, predicted, [1, 2], surface=False)
+    chunked = segmentation_metrics(ground_truth, predicted, [1, 2], surface=False, chunk_voxels=50)
+    for label in (1, 2):
+        for key in ('dice', 'iou', 'ground_truth_volume', 'predicted_volume', 'volume_difference'):
+            assert whole['metrics'][label][key] == chunked['metrics'][label][key]
+    for axis in range(3):
+        assert np.array_equal(whole['slice_intersection'][axis], chunked['slice_intersection'][axis])
+        assert np.array_equal(whole['slice_total'][axis], chunked['slice_total'][axis])
+    dice = 2 * np.sum((ground_truth == 1) & (predicted == 1)) / (np.sum(ground_truth == 1) + np.sum(predicted == 1))
+    assert whole['metrics'][1]['dice'] == pytest.approx(dice)
+
+
+def test_surface_distances():
+    ground_truth, predicted = cubes(shift=0)
+    assert surface_distances(ground_truth == 1, predicted == 1, (2, 1, 1)) == (0.0, 0.0)
+    ground_truth, predicted = cubes()
+    hd95, assd = surface_distances(ground_truth == 1, predicted == 1, (2, 1, 1))
+    # The far faces are one 2 mm voxel apart; the sides coincide
+    assert hd95 == pytest.approx(2.0)
+    assert 0 < assd < 2
+
+
+def test_undefined_metrics_are_nan():
+    ground_truth, predicted = cubes()
+    result = segmentation_metrics(ground_truth, predicted, [1, 2])
+    assert result['labels'] == [1, 2]
+    assert all(math.isnan(value) for key, value in result['metrics'][2].items() if key in ('dice', 'iou', 'hd95', 'assd'))
+    empty = segmentation_metrics(ground_truth, np.zeros_like(predicted), [1])['metrics'][1]
+    assert empty['dice'] == 0 and math.isnan(empty['hd95'])
+
+
+def test_slice_dice():
+    ground_truth, predicted = cubes()
+    dice = slice_dice(segmentation_metrics(ground_truth, predicted, [1], surface=False), [1], 0)
+    # Slices 2 and 6 hold one of the two cubes only, slices 3 to 5 both
+    assert np.isnan(dice[:2]).all() and np.isnan(dice[7:]).all()
+    assert dice[2:7].tolist() == [0.0, 1.0, 1.0, 1.0, 0.0]
+
+
+def test_metrics_cache_round_trip(tmp_path):
+    paths = []
+    for name in ('gt.nii.gz', 'pred.nii.gz'):
+        (tmp_path / name).write_bytes(name.encode())
+        paths.append(str(tmp_path / name))
+    cache = MetricsCache(str(tmp_path / 'cache'))
+    assert cache.load(*paths, [1]) is None
+    ground_truth, predicted = cubes()
+    result = segmentation_metrics(ground_truth, predicted, [1], surface=False)
+    cache.store(*paths, [1], True, result)
+    cached = cache.load(*paths, [1])
+    assert cached['labels'] == [1]
+    assert cached['metrics'][1]['dice'] == pytest.approx(0.75)
+    assert np.array_equal(cached['slice_total'][2], result['slice_total'][2])
+    assert cache.load(*paths, [1], surface=False) is None
+
+
+def test_metrics_cache_is_written_through_a_file_of_this_process(tmp_path, monkeypatch):
+    replaced = []
+    replace = os.replace
+    monkeypatch.setattr(os, 'replace', lambda source, target: replaced.append(source) or replace(source, target))
+    (tmp_path / 'gt.nii.gz').write_bytes(b'gt')
+    ground_truth, predicted = cubes()
+    cache = MetricsCache(str(tmp_path / 'cache'))
+    cache.store(str(tmp_path / 'gt.nii.gz'), str(tmp_path / 'gt.nii.gz'), [1], False, segmentation_metrics(ground_truth, predicted, [1], surface=False))
+    assert len(replaced) == 1 and f'.tmp{os.getpid()}-' in replaced[0]
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+
+
+def test_error_slice_classes():
+    ground_truth = np.array([[0, 1, 0, 1, 2]])
+    predicted = np.array([[0, 1, 1, 0, 1]])
+    assert error_slice(ground_truth, predicted).tolist() == [[0, 1, 2, 3, 4]]
+    # Labels that are not shown are background
+    assert error_slice(ground_truth, predicted, [2]).tolist() == [[0, 0, 0, 0, 3]]
+
+
+def test_slice_errors():
+    ground_truth, predicted = cubes()
+    errors = slice_errors(segmentation_metrics(ground_truth, predicted, [1], surface=False), [1], 0)
+    assert errors.tolist() == [0, 0, 16, 0, 0, 0, 16, 0, 0, 0]
+
+def test_evaluate_resumes_and_remembers_empty_subjects(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    ground_truth, predicted = cubes()
+    rows = ['subject,ct,ground_truth,predicted']
+    for subject_name, volumes in (('SUB_1', (ground_truth, predicted)), ('SUB_2', (np.zeros_like(ground_truth),) * 2)):
+        for kind, volume in zip(('gt', 'pred'), volumes):
+            nib.save(nib.Nifti1Image(volume, np.eye(4)), f'{subject_name}_{kind}.nii.gz')
+        rows.append(f'{subject_name},,{subject_name}_gt.nii.gz,{subject_name}_pred.nii.gz')
+    (tmp_path / 'dataset.csv').write_text('\n'.join(rows) + '\n')
+    arguments = ['--manifest', str(tmp_path / 'dataset.csv'), '--output', 'metrics.csv', '--workers', '1', '--no-surface']
+
+    assert evaluate_command(arguments + ['SUB_*', 'SUB_3']) == 0
+    output = capsys.readouterr().out
+    assert 'SUB_3: not in the dataset, skipped' in output
+    assert 'Evaluated 2 subjects' in output
+    with open('metrics.csv', newline='') as f:
+        results = list(csv.DictReader(f))
+    assert [(row['subject'], row['label']) for row in results] == [('SUB_1', '1')]
+    assert float(results[0]['dice']) == pytest.approx(0.75)
+    assert evaluated_subjects('metrics.csv') == {'SUB_1', 'SUB_2'}
+
+    evaluate_command(arguments)
+    assert '2 already in metrics.csv, 0 to evaluate' in capsys.readouterr().out
@@ -0,0 +1,84 @@
+import argparse
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from ct_render import AggSliceCanvas, positive_int_argument, render_command, select_slices, slice_range_argument
+
+
+def test_select_slices():
+    assert select_slices(40, count=5) == [0, 10, 20, 29, 39]
+    assert select_slices(3, count=12) == [0, 1, 2]
+    assert select_slices(40, '10:16:2') == [10, 12, 14]
+    assert select_slices(40, '-2:') == [38, 39]
+    assert select_slices(40, '100:200') == []
+
+
+@pytest.mark.parametrize('value', ['a:b', '1:2:3:4', '::0', '1.5'])
+def test_bad_slice_ranges_are_rejected(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        slice_range_argument(value)
+
+
+@pytest.mark.parametrize('value', ['0', '-3', 'two'])
+def test_counts_must_be_positive(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        positive_int_argument(value)
+
+
+@pytest.mark.parametrize('arguments', [['--columns', '0'], ['--count', '0'], ['--fps', '-1'], ['--slices', '::0']])
+def test_render_command_rejects_bad_arguments(arguments, capsys):
+    with pytest.raises(SystemExit):
+        render_command(arguments)
+    assert 'error' in capsys.readouterr().err
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ct_scan = np.arange(16 * 16 * 8, dtype=np.int16).reshape(16, 16, 8) % 90
+    labels = np.zeros(ct_scan.shape, dtype=np.uint8)
+    labels[4:12, 4:12, 2:6] = 1
+    for kind, volume in (('ct', ct_scan), ('gt', labels)):
+        nib.save(nib.Nifti1Image(volume, np.eye(4)), f'SUB_1_{kind}.nii.gz')
+    (tmp_path / 'dataset.csv').write_text('subject,ct,ground_truth,predicted\nSUB_1,SUB_1_ct.nii.gz,SUB_1_gt.nii.gz,\n')
+    return ['SUB_1', '--manifest', str(tmp_path / 'dataset.csv'), '--workers', '1', '--width', '3', '--dpi', '20']
+
+
+def test_render_command_writes_a_montage(dataset, tmp_path, capsys):
+    assert render_command(dataset + ['--count', '4', '--columns', '2']) == 0
+    assert 'Rendered 1 of 1 subjects (4 frames)' in capsys.readouterr().out
+    assert (tmp_path / 'renders' / 'SUB_1_axial.png').exists()
+
+
+def test_empty_slice_selection_fails_the_subject(dataset, capsys):
+    render_command(dataset + ['--slices', '100:200'])
+    output = capsys.readouterr().out
+    assert 'selects none of the 8 axial slices' in output
+    assert 'Rendered 0 of 1 subjects' in output
+
+
+def test_only_changed_panels_are_redrawn():
+    ct_scan = np.arange(8 * 8 * 4, dtype=np.int16).reshape(8, 8, 4)
+    labels = (ct_scan % 3).astype(np.uint8)
+    canvas = AggSliceCanvas(width=3, height=1, dpi=20)
+    dirty = []
+    request_draw = canvas.request_draw
+
+    def record_draw():
+        dirty.append(sorted(canvas.dirty_panels))
+        request_draw()
+
+    canvas.request_draw = record_draw
+    colors = {1: (1.0, 0.0, 0.0), 2: (0.0, 1.0, 0.0)}
+
+    def plot(slice_index, opacity=0.5):
+        canvas.plot_slices(slice_index, 0, 90, ct_scan, labels, None, True, 'axial', False, colors, opacity)
+
+    plot(1)
+    plot(1, opacity=0.8)
+    plot(2, opacity=0.8)
+    plot(2, opacity=0.8)
+    # A new opacity only changes the overlay; the same frame again changes nothing
+    assert dirty[1:] == [[1], [0, 1], []]